@@ -6,4 +6,4 @@ from django.utils.translation import ugettext_lazy as _
 verbose_name = _('fiëé dorsale')
 verbose_name_plural = _('fiëé dorsale')
 
-__all__ = ['admin', 'context_processors', 'export', 'forms', 'json', 'managers', 'middleware', 'models', 'settings', 'tools', 'urls', 'views', 'widgets']
+__all__ = ['admin', 'archive', 'bulk', 'context_processors', 'deletion', 'export', 'exportjobs', 'extractors', 'forms', 'generations', 'indexes', 'json', 'local', 'managers', 'middleware', 'models', 'pagination', 'permissions', 'settings', 'sites', 'spreadsheets', 'tools', 'urls', 'views', 'widgets']
@@ -2,7 +2,9 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from django.contrib import admin
-from django.contrib.auth import get_permission_codename
+from django.contrib.admin.views.main import ChangeList
+from dorsale import local
+from dorsale.permissions import object_permissions
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,6 +16,16 @@ except ImportError:
     now = datetime.now
 
 
+class DorsaleChangeList(ChangeList):
+    """
+    ChangeList that checks the row permissions of a whole page at once
+    (memoised for the request, see `dorsale.permissions`).
+    """
+    def get_results(self, request):
+        super(DorsaleChangeList, self).get_results(request)
+        object_permissions(request.user, self.model, self.result_list, owner_only=True)
+
+
 class DorsaleBaseAdmin(admin.ModelAdmin):
     """
     ModelAdmin for DorsaleBaseModels, automaticalls sets createdby,
@@ -21,7 +33,9 @@ class DorsaleBaseAdmin(admin.ModelAdmin):
 
     Beware, this overrides "queryset" and "has_change_permissions"!
 
-    TODO: Permissions
+    Object permissions: users may change (and delete) objects they created,
+    if they have the model permission, and objects they have
+    django-guardian object permissions for (see `dorsale.permissions`).
 
     TODO: see http://www.stereoplex.com/blog/filtering-dropdown-lists-in-the-django-admin
     """
@@ -36,8 +50,7 @@ class DorsaleBaseAdmin(admin.ModelAdmin):
             if hasattr(obj, 'deleted'):
                 obj.deleted = False
         if hasattr(obj, 'site'):
-            from django.contrib.sites.models import Site
-            obj.site = Site.objects.get_current()
+            obj.site = local.get_current_site()
             # we could allow superusers to change the site
         if hasattr(obj, 'lastchangedby'):
             obj.lastchangedby = request.user
@@ -65,14 +78,12 @@ class DorsaleBaseAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         if not self.has_class_permission(request, obj):
             return False
-        if obj is not None \
-                and not request.user.is_superuser \
-                and request.user.id != obj.createdby_id:
-            # TODO: Permissions!
-            return False
-        opts = self.opts
-        codename = get_permission_codename('change', opts)
-        return request.user.has_perm("%s.%s" % (opts.app_label, codename))
+        if obj is None:
+            return True
+        return 'change' in object_permissions(request.user, self.model, [obj], owner_only=True)[obj.pk]
+
+    def get_changelist(self, request, **kwargs):
+        return DorsaleChangeList
 
 try:
     from registration.models import RegistrationProfile
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Archive and purge soft-deleted rows of `FakeDeleteMixin` models.
+
+Rows that are marked as deleted for longer than the model’s retention
+period (`archive_after_days` or `settings.DORSALE_ARCHIVE_AFTER_DAYS`,
+counted from `lastchangedon`) get written to gzipped JSON-lines files
+below `settings.DORSALE_ARCHIVE_ROOT` and then really deleted,
+together with the rows that depend on them (CASCADE), in batches:
+
+    <root>/<app_label>/<model_name>/<timestamp>-<first pk>.jsonl.gz
+
+Every line is one serialized object (like `dumpdata`), parents before
+children. Rows that only point to archived rows with SET_NULL etc.
+stay and lose that reference.
+
+A checkpoint file per model remembers a written, but not yet purged batch,
+so an interrupted run finishes that batch first (`archive_model` resumes).
+If the rows of that batch changed in the meantime (undeleted or with new
+dependent rows), resuming raises `ArchiveError` and keeps the checkpoint.
+
+`restore(model, pk)` puts an archived object back (still marked as deleted)
+with the archived rows that depend on it.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import io
+import os
+import gzip
+import json
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.db.models.deletion import Collector, ProtectedError
+from dorsale.conf import settings
+from dorsale.deletion import is_fake_deletable
+from dorsale.generations import bump_generation
+import logging
+logger = logging.getLogger(settings.PROJECT_NAME)
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+CHECKPOINT_FILE = 'checkpoint.json'
+ARCHIVE_SUFFIX = '.jsonl.gz'
+
+
+class ArchiveError(Exception):
+    """
+    The database doesn’t match an archive batch anymore.
+    """
+
+
+class ArchiveCollector(Collector):
+    """
+    `Collector` that loads every dependent row (no fast deletes),
+    so that all of them can be archived.
+    """
+    def can_fast_delete(self, *args, **kwargs):
+        return False
+
+    def live_rows(self):
+        """
+        number of collected rows of `FakeDeleteMixin` models that aren’t marked as deleted
+        """
+        return sum(1 for model, obj in self.instances_with_model()
+                   if is_fake_deletable(model) and not obj.deleted)
+
+    def archive_order(self):
+        """
+        list of (model, instances), parents before children
+        """
+        self.sort()  # children first, as for deletion
+        return list(reversed(list(self.data.items())))
+
+
+def archive_root():
+    root = getattr(settings, 'DORSALE_ARCHIVE_ROOT', None)
+    if not root:
+        raise ImproperlyConfigured('Set DORSALE_ARCHIVE_ROOT to archive soft-deleted rows.')
+    return root
+
+
+def model_dir(model):
+    path = os.path.join(archive_root(), model._meta.app_label, model._meta.model_name)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def retention_days(model):
+    """
+    days after which deleted rows of `model` get archived, or `None` (never)
+    """
+    days = getattr(model, 'archive_after_days', None)
+    if days is None:
+        days = getattr(settings, 'DORSALE_ARCHIVE_AFTER_DAYS', None)
+    return days
+
+
+def is_archivable(model):
+    return is_fake_deletable(model) \
+        and not model._meta.abstract and not model._meta.proxy \
+        and 'lastchangedon' in [f.name for f in model._meta.concrete_fields]
+
+
+def archivable_queryset(model, days=None, using=None):
+    """
+    Queryset of the rows of `model` that are due for archiving (all sites).
+    """
+    if days is None:
+        days = retention_days(model)
+    qs = model._base_manager.using(using or router.db_for_write(model))
+    if days is None:
+        return qs.none()
+    return qs.filter(deleted=True, lastchangedon__lt=now() - timedelta(days=days)).order_by('pk')
+
+
+def read_checkpoint(model):
+    path = os.path.join(model_dir(model), CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_checkpoint(model, **state):
+    path = os.path.join(model_dir(model), CHECKPOINT_FILE)
+    with io.open(path + '.part', 'w', encoding='utf-8') as f:
+        f.write(json.dumps(state, ensure_ascii=False))
+    os.rename(path + '.part', path)
+
+
+def write_records(path, records):
+    """
+    Write `records` (dicts) as gzipped JSON lines; the file appears complete or not at all.
+    """
+    with gzip.open(path + '.part', 'wb') as f:
+        for record in records:
+            f.write((json.dumps(record, cls=DjangoJSONEncoder) + '\n').encode('utf-8'))
+    os.rename(path + '.part', path)
+
+
+def read_records(path):
+    with gzip.open(path, 'rb') as f:
+        return [json.loads(line.decode('utf-8')) for line in f if line.strip()]
+
+
+def archive_files(model):
+    """
+    archive files of `model`, newest first
+    """
+    path = model_dir(model)
+    return sorted((os.path.join(path, name) for name in os.listdir(path) if name.endswith(ARCHIVE_SUFFIX)),
+                  reverse=True)
+
+
+def bump_after_commit(models, using):
+    """
+    Bump the generations of `models` once the deletion is committed
+    (there are no `post_delete` receivers for them), so caches can’t
+    get filled with the old rows in between.
+    """
+    def bump():
+        for model in models:
+            bump_generation(model)
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(bump, using=using)
+    else:  # Django < 1.9
+        bump()
+
+
+def purge(collector, using):
+    """
+    Really delete the archived rows of `collector`.
+    """
+    models = list(collector.data)
+    result = collector.delete()
+    bump_after_commit(models, using)
+    return result
+
+
+def record_key(model_label, pk):
+    return model_label, '%s' % pk
+
+
+def recollect(records, using):
+    """
+    `ArchiveCollector` of what’s left of the archived `records`;
+    raise `ArchiveError` unless these are deleted rows, all archived.
+    """
+    pks = {}
+    for record in records:
+        pks.setdefault(record['model'], []).append(record['pk'])
+    collector = ArchiveCollector(using=using)
+    for label, pk_list in pks.items():
+        objs = list(apps.get_model(label)._base_manager.using(using).filter(pk__in=pk_list))
+        if objs:
+            collector.collect(objs)
+    live = collector.live_rows()
+    if live:
+        raise ArchiveError('%d rows are not deleted anymore.' % live)
+    archived = set(record_key(record['model'], record['pk']) for record in records)
+    unarchived = [key for key in (record_key(model._meta.label_lower, obj.pk)
+                                  for model, obj in collector.instances_with_model())
+                  if key not in archived]
+    if unarchived:
+        raise ArchiveError('%d dependent rows are not archived, e.g. %s %s.' % (
+            (len(unarchived),) + unarchived[0]))
+    return collector
+
+
+def resume(model, using):
+    """
+    Purge the rows of a batch that was archived, but not (completely) deleted.
+    """
+    pending = read_checkpoint(model).get('pending')
+    if not pending:
+        return
+    if os.path.exists(pending):
+        logger.info('Resuming archive batch %s', pending)
+        try:
+            with transaction.atomic(using=using):
+                purge(recollect(read_records(pending), using), using)
+        except ArchiveError as ex:
+            logger.error('Not resuming archive batch %s, check it: %s', pending, ex)
+            raise
+    write_checkpoint(model, pending=None)
+
+
+def archive_batch(model, objs, using):
+    """
+    Archive and delete `objs` (instances of `model`) with their dependent rows;
+    skip objects with dependent rows that aren’t deleted.
+    Return the number of archived rows.
+    """
+    collector = ArchiveCollector(using=using)
+    collector.collect(objs)
+    if collector.live_rows():
+        # find the culprits one by one
+        keep = []
+        for obj in objs:
+            single = ArchiveCollector(using=using)
+            single.collect([obj])
+            if single.live_rows():
+                logger.warn('Not archiving %s %s, it has live dependent rows.', model._meta.label, obj.pk)
+            else:
+                keep.append(obj)
+        if not keep:
+            return 0
+        collector = ArchiveCollector(using=using)
+        collector.collect(keep)
+        objs = keep
+
+    records = []
+    for related_model, instances in collector.archive_order():
+        records.extend(serializers.serialize('python', sorted(instances, key=lambda o: o.pk)))
+    path = os.path.join(model_dir(model), '%s-%s%s' % (
+        time.strftime('%Y%m%d%H%M%S'), objs[0].pk, ARCHIVE_SUFFIX))
+    write_checkpoint(model, pending=path)
+    write_records(path, records)
+    with transaction.atomic(using=using):
+        purge(collector, using)
+    write_checkpoint(model, pending=None)
+    return len(records)
+
+
+def archive_model(model, days=None, batch_size=None, max_batches=None, using=None, dry_run=False):
+    """
+    Archive and delete the rows of `model` that are deleted for longer than
+    its retention period, in batches of `batch_size` objects
+    (default: `settings.DORSALE_ARCHIVE_BATCH_SIZE`), at most `max_batches`.
+
+    Return the number of archived rows (with `dry_run`: due objects).
+    """
+    using = using or router.db_for_write(model)
+    batch_size = int(batch_size or getattr(settings, 'DORSALE_ARCHIVE_BATCH_SIZE', 500))
+    qs = archivable_queryset(model, days, using)
+    if dry_run:
+        return qs.count()
+    resume(model, using)
+    count = 0
+    batches = 0
+    skipped = set()
+    while max_batches is None or batches < max_batches:
+        objs = list(qs.exclude(pk__in=skipped)[:batch_size]) if skipped else list(qs[:batch_size])
+        if not objs:
+            break
+        try:
+            archived = archive_batch(model, objs, using)
+        except ProtectedError as ex:
+            logger.warn('Not archiving %s batch from %s: %s', model._meta.label, objs[0].pk, ex)
+            archived = 0
+        if not archived:
+            skipped.update(obj.pk for obj in objs)
+        count += archived
+        batches += 1
+    return count
+
+
+def dependent_records(records, model, pk):
+    """
+    records of `model` `pk` and the rows that (transitively) point to it
+    """
+    wanted = set([(model._meta.label_lower, '%s' % pk)])
+    selected = []
+    rest = list(records)
+    changed = True
+    while changed:
+        changed = False
+        for record in list(rest):
+            key = (record['model'], '%s' % record['pk'])
+            related = set()
+            for field in apps.get_model(record['model'])._meta.concrete_fields:
+                if field.is_relation and (field.many_to_one or field.one_to_one) \
+                        and record['fields'].get(field.name) is not None:
+                    related.add((field.related_model._meta.label_lower, '%s' % record['fields'][field.name]))
+            if key in wanted or related & wanted:
+                wanted.add(key)
+                selected.append(record)
+                rest.remove(record)
+                changed = True
+    return selected, rest
+
+
+def restore(model, pk, using=None):
+    """
+    Put archived object `pk` of `model` and its archived dependent rows back
+    into the database (still marked as deleted) and remove them from the archive.
+
+    Return the number of restored rows (0 if `pk` isn’t archived).
+    """
+    using = using or router.db_for_write(model)
+    for path in archive_files(model):
+        records = read_records(path)
+        if not [r for r in records if r['model'] == model._meta.label_lower and '%s' % r['pk'] == '%s' % pk]:
+            continue
+        selected, rest = dependent_records(records, model, pk)
+        # file order is parents before children
+        order = dict((id(record), i) for i, record in enumerate(records))
+        selected.sort(key=lambda record: order[id(record)])
+        with transaction.atomic(using=using):
+            for obj in serializers.deserialize('python', selected, using=using):
+                # many-to-many rows come back from their own (through model) records
+                obj.save(using=using, save_m2m=False)
+        if rest:
+            write_records(path, rest)
+        else:
+            os.remove(path)
+        return len(selected)
+    return 0
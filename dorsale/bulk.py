@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk writes for dorsale models, e.g. for data imports.
+
+Audit fields (`createdby`, `createdon`, `lastchangedby`, `lastchangedon`),
+`deleted` and `site` get filled in Python once per batch instead of
+calling `save()` (and looking up the current site) per instance;
+rows get written with `bulk_create` or one UPDATE per batch.
+
+Like Django’s bulk methods, these don’t call `save()` and send no
+`pre_save`/`post_save` signals; the model’s generation
+(see `dorsale.generations`) gets bumped once per call.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from itertools import islice
+from django.db import connections, router, transaction
+from django.db.models import Case, Value, When
+from dorsale import local
+from dorsale.conf import settings
+from dorsale.generations import bump_generation
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from django.db.models.functions import Cast
+except ImportError:  # Django < 1.10
+    Cast = None
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+def iter_chunks(iterable, size):
+    """
+    Generator of lists with up to `size` items of `iterable`,
+    without reading all of it at once.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def batch_size_or_default(batch_size):
+    return int(batch_size or getattr(settings, 'DORSALE_BULK_BATCH_SIZE', 1000))
+
+
+def field_attnames(model):
+    """
+    {field name: attname} of the concrete fields of `model`
+    """
+    return dict((f.name, f.attname) for f in model._meta.concrete_fields)
+
+
+def audit_values(model, user, created=False):
+    """
+    dict {attname: value} of the audit fields of `model`
+    for rows that `user` (object or ID) changes (or creates) now
+    """
+    attnames = field_attnames(model)
+    user_id = getattr(user, 'pk', user)
+    timestamp = now()
+    values = {}
+    names = ['lastchangedby', 'lastchangedon']
+    if created:
+        names += ['createdby', 'createdon']
+    for name in names:
+        if name not in attnames:
+            continue
+        if name.endswith('by'):
+            if user_id is not None:
+                values[attnames[name]] = user_id
+        else:
+            values[attnames[name]] = timestamp
+    return values
+
+
+def bulk_create_for(model, user, site, objs, batch_size=None, using=None, site_field_name='site'):
+    """
+    Create `objs` (iterable of unsaved `model` instances) as `user`
+    (object or ID) on `site` (`Site`, ID or `None` for the current site),
+    with one `bulk_create` per batch.
+
+    Return the list of created objects.
+    """
+    batch_size = batch_size_or_default(batch_size)
+    using = using or router.db_for_write(model)
+    attnames = field_attnames(model)
+    if site is None:
+        site_id = local.get_current_site_id()
+    else:
+        site_id = getattr(site, 'pk', site)
+    created = []
+    for batch in iter_chunks(objs, batch_size):
+        values = audit_values(model, user, created=True)
+        if site_field_name in attnames:
+            values[attnames[site_field_name]] = site_id
+        if 'deleted' in attnames:
+            values['deleted'] = False
+        for obj in batch:
+            for attname, value in values.items():
+                setattr(obj, attname, value)
+        created.extend(model._base_manager.using(using).bulk_create(batch, batch_size=batch_size))
+    if created:
+        bump_generation(model)
+    return created
+
+
+def case_update(model, objs, field, connection):
+    """
+    CASE expression that sets `field` of every row of `objs` to its value
+    (like `QuerySet.bulk_update` of Django ≥ 2.2)
+    """
+    whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+             for obj in objs]
+    case = Case(*whens, output_field=field)
+    if Cast is not None and connection.vendor == 'postgresql':
+        case = Cast(case, output_field=field)
+    return case
+
+
+def bulk_update_for(queryset, user, objs, fields, batch_size=None):
+    """
+    Save `fields` (list of field names) of `objs` (iterable of saved instances)
+    as changed by `user` (object or ID), with one UPDATE per batch.
+
+    Only rows within `queryset` (e.g. the current site’s not deleted objects)
+    get changed. Return the number of changed rows.
+    """
+    model = queryset.model
+    batch_size = batch_size_or_default(batch_size)
+    model_fields = [model._meta.get_field(name) for name in fields]
+    if [f for f in model_fields if f.primary_key or not f.concrete or f.many_to_many]:
+        raise ValueError('bulk_update_for can only update concrete, non-primary key fields.')
+    connection = connections[queryset.db]
+    count = 0
+    with transaction.atomic(using=queryset.db, savepoint=False):
+        for batch in iter_chunks(objs, batch_size):
+            values = audit_values(model, user)
+            for obj in batch:
+                for attname, value in values.items():
+                    setattr(obj, attname, value)
+            updates = dict(values)
+            for field in model_fields:
+                if field.attname not in values:
+                    updates[field.attname] = case_update(model, batch, field, connection)
+            count += queryset.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    if count:
+        bump_generation(model)
+    return count
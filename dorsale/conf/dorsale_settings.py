@@ -5,3 +5,25 @@ PROJECT_NAME = 'dorsale'
 ANONYMOUS_USER_ID = -1  # like in django-registration
 
 DORSALE_ITEMS_PER_PAGE = 10  # for paginated views
+DORSALE_GROUP_CACHE_TIMEOUT = 3600  # seconds to cache the group IDs of users (only with a shared cache backend), 0 to switch off
+DORSALE_SITES_RELOAD_INTERVAL = 300  # seconds until RequestSiteMiddleware reloads its host map, None: never
+
+DORSALE_SOFT_DELETE_BATCH_SIZE = 500  # primary keys per UPDATE in soft deletion
+DORSALE_BULK_BATCH_SIZE = 1000  # rows per INSERT/UPDATE of bulk_create_for/bulk_update_for
+DORSALE_PARTIAL_INDEXES = False  # True: default indexes not in Meta.indexes, but made partial by dorsale_indexes --create
+
+DORSALE_ARCHIVE_ROOT = None  # directory for archives of soft-deleted rows (required for archiving)
+DORSALE_ARCHIVE_AFTER_DAYS = None  # archive rows deleted for longer, unless the model sets archive_after_days; None: never
+DORSALE_ARCHIVE_BATCH_SIZE = 500  # objects per archive batch
+
+DORSALE_EXPORT_BACKEND = 'thread'  # background exports: 'thread', 'celery' or 'sync'
+DORSALE_EXPORT_WORKERS = 2  # threads for background exports
+DORSALE_EXPORT_ROOT = None  # directory for export files, default: temp dir
+DORSALE_EXPORT_JOB_TIMEOUT = 86400  # seconds to keep export job state in cache
+
+DORSALE_COUNT_STRATEGY = 'exact'  # list views: 'exact', 'cached', 'estimate', 'none' or paginator class name
+DORSALE_COUNT_CACHE_TIMEOUT = 3600  # seconds for 'cached' counts
+DORSALE_COUNT_ESTIMATE_THRESHOLD = 10000  # 'estimate': count exactly below this estimate
+
+DORSALE_LIST_CACHE_TIMEOUT = 300  # seconds to cache rendered list tables, 0 to switch off
+DORSALE_TREE_CACHE_TIMEOUT = 3600  # seconds to cache MPTT trees (cached_tree), 0 to switch off
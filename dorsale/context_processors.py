@@ -1,6 +1,6 @@
 from datetime import datetime
 from django.conf import settings
-from django.contrib.sites.models import Site
+from dorsale import local
 
 
 def info(request):
@@ -9,11 +9,13 @@ def info(request):
     :site: site ID of current site
     :site_profile: `dorsale.siteprofile.models.SiteProfile` of current site
     :MEDIA_URL: `settings.MEDIA_URL`
+
+    Site and profile come from caches, there are no queries per request.
     """
-    site = Site.objects.get_current()
+    site = local.get_current_site()
     try:
         from siteprofile.models import SiteProfile
-        siteprofile = SiteProfile.objects.get(pk=site)
+        siteprofile = SiteProfile.objects.get_cached(site)
     except ImportError:
         siteprofile = None
     except SiteProfile.DoesNotExist:
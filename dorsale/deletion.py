@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Set-based soft deletion for `FakeDeleteMixin` models.
+
+The cascade gets collected once by Django’s `Collector`, then every model’s
+primary keys get marked as deleted with one `UPDATE ... WHERE pk IN (...)`
+per batch, instead of calling `delete()` on every single instance.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import six
+from collections import Counter
+from operator import attrgetter
+from django.db import router, transaction
+from django.db.models import signals, sql
+from django.db.models.deletion import CASCADE, Collector
+from django.dispatch import Signal
+from dorsale.conf import settings
+import logging
+logger = logging.getLogger(settings.PROJECT_NAME)
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+#: sent once per model and batch before soft-deleted rows get marked
+pre_soft_delete = Signal(providing_args=['pk_set', 'using'])
+#: sent once per model and batch after soft-deleted rows got marked
+post_soft_delete = Signal(providing_args=['pk_set', 'using'])
+
+
+def is_fake_deletable(model):
+    """
+    Does `model` only get marked as deleted (i.e. is it a `FakeDeleteMixin`)?
+    """
+    from dorsale.models import FakeDeleteMixin  # avoid circular import
+    return issubclass(model, FakeDeleteMixin)
+
+
+def chunked(seq, size):
+    """
+    Generator of lists with up to `size` items of `seq`.
+    """
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+class SoftDeleteCollector(Collector):
+    """
+    `Collector` that marks instances of `FakeDeleteMixin` models as deleted
+    instead of deleting them; other models get deleted as usual.
+
+    :batch_size: int
+        max. number of primary keys per UPDATE
+        (default: `settings.DORSALE_SOFT_DELETE_BATCH_SIZE`)
+    :bulk_signals: bool
+        send `pre_soft_delete`/`post_soft_delete` once per model and batch
+        instead of `pre_delete`/`post_delete` per soft-deleted instance
+    :user: `contrib.auth.models.User` or None
+        set as `lastchangedby` of soft-deleted rows
+    """
+    def __init__(self, using, batch_size=None, bulk_signals=False, user=None):
+        super(SoftDeleteCollector, self).__init__(using=using)
+        self.batch_size = batch_size or int(getattr(settings, 'DORSALE_SOFT_DELETE_BATCH_SIZE', 500))
+        self.bulk_signals = bulk_signals
+        self.user = user
+
+    def discard(self, obj):
+        """
+        Remove `obj` from the collection, e.g. because it was already saved.
+        """
+        model = type(obj)
+        instances = self.data.get(model)
+        if instances is None:
+            return
+        instances.discard(obj)
+        if not instances:
+            del self.data[model]
+
+    def soft_values(self, model):
+        """
+        dict of field values that mark a row of `model` as deleted
+        """
+        values = {'deleted': True}
+        field_names = [f.name for f in model._meta.concrete_fields]
+        if 'lastchangedon' in field_names:
+            values['lastchangedon'] = now()
+        if self.user is not None and 'lastchangedby' in field_names:
+            values['lastchangedby'] = self.user
+        return values
+
+    def mark_deleted(self, model, pk_list):
+        """
+        Mark rows of `model` with primary keys in `pk_list` as deleted,
+        in batches of `batch_size`. Return the number of changed rows.
+        """
+        count = 0
+        values = self.soft_values(model)
+        manager = model._base_manager.using(self.using)
+        for pk_set in chunked(pk_list, self.batch_size):
+            if self.bulk_signals and not model._meta.auto_created:
+                pre_soft_delete.send(sender=model, pk_set=pk_set, using=self.using)
+            count += manager.filter(pk__in=pk_set).update(**values)
+            if self.bulk_signals and not model._meta.auto_created:
+                post_soft_delete.send(sender=model, pk_set=pk_set, using=self.using)
+        return count
+
+    def sends_instance_signals(self, model):
+        if model._meta.auto_created:
+            return False
+        return not (self.bulk_signals and is_fake_deletable(model))
+
+    def keeps_rows(self, model):
+        """
+        Skip deleting rows of `model`? Many-to-many rows between soft-deleted
+        models stay, like their foreign keys, so they’re still there for archives.
+        """
+        return model._meta.auto_created and all(
+            is_fake_deletable(f.remote_field.model)
+            for f in model._meta.concrete_fields if f.is_relation)
+
+    def keeps_reference(self, field, value):
+        """
+        Skip this field update? On databases without deferred constraint checks,
+        `CASCADE` nulls nullable foreign keys before deleting the rows;
+        rows of soft-deleted parents stay, so their children keep the reference.
+        """
+        return value is None and field.remote_field.on_delete is CASCADE \
+            and is_fake_deletable(field.remote_field.model)
+
+    def delete(self):
+        """
+        Like `Collector.delete`, but soft-delete where possible.
+
+        Return a tuple (number of affected rows, {model label: number}).
+        """
+        for model, instances in self.data.items():
+            self.data[model] = sorted(instances, key=attrgetter('pk'))
+
+        self.sort()
+        deleted_counter = Counter()
+
+        with transaction.atomic(using=self.using, savepoint=False):
+            # send pre_delete signals
+            for model, obj in self.instances_with_model():
+                if self.sends_instance_signals(model):
+                    signals.pre_delete.send(
+                        sender=model, instance=obj, using=self.using
+                    )
+
+            # fast deletes: soft where possible, like the collected instances
+            for qs in self.fast_deletes:
+                if self.keeps_rows(qs.model):
+                    continue
+                if is_fake_deletable(qs.model):
+                    count = qs.update(**self.soft_values(qs.model))
+                else:
+                    count = qs._raw_delete(using=self.using)
+                deleted_counter[qs.model._meta.label] += count
+
+            # update fields
+            for model, instances_for_fieldvalues in six.iteritems(self.field_updates):
+                query = sql.UpdateQuery(model)
+                for (field, value), instances in six.iteritems(instances_for_fieldvalues):
+                    if self.keeps_reference(field, value):
+                        continue
+                    query.update_batch([obj.pk for obj in instances],
+                                       {field.name: value}, self.using)
+
+            # reverse instance collections
+            for instances in six.itervalues(self.data):
+                instances.reverse()
+
+            # delete instances
+            for model, instances in six.iteritems(self.data):
+                if self.keeps_rows(model):
+                    continue
+                pk_list = [obj.pk for obj in instances]
+                if is_fake_deletable(model):
+                    count = self.mark_deleted(model, pk_list)
+                else:
+                    query = sql.DeleteQuery(model)
+                    count = query.delete_batch(pk_list, self.using)
+                deleted_counter[model._meta.label] += count
+
+                if self.sends_instance_signals(model):
+                    for obj in instances:
+                        signals.post_delete.send(
+                            sender=model, instance=obj, using=self.using
+                        )
+
+        # no post_save for UPDATEs, don’t keep stale caches
+        from dorsale.generations import bump_generation  # avoid circular import
+        for model in set(self.data) | set(qs.model for qs in self.fast_deletes):
+            bump_generation(model)
+
+        # update collected instances
+        for model, instances_for_fieldvalues in six.iteritems(self.field_updates):
+            for (field, value), instances in six.iteritems(instances_for_fieldvalues):
+                if self.keeps_reference(field, value):
+                    continue
+                for obj in instances:
+                    setattr(obj, field.attname, value)
+        for model, instances in six.iteritems(self.data):
+            if is_fake_deletable(model):
+                for instance in instances:
+                    instance.deleted = True
+            elif not self.keeps_rows(model):
+                for instance in instances:
+                    setattr(instance, model._meta.pk.attname, None)
+        return sum(deleted_counter.values()), dict(deleted_counter)
+
+
+def soft_delete(objs, using=None, keep_parents=False, batch_size=None, bulk_signals=False, user=None):
+    """
+    Soft-delete `objs` (list of instances or a queryset) and their cascade.
+
+    Return a tuple (number of affected rows, {model label: number}).
+    """
+    if using is None:
+        if hasattr(objs, 'db'):
+            using = objs.db
+        else:
+            objs = list(objs)
+            if not objs:
+                return 0, {}
+            using = router.db_for_write(type(objs[0]), instance=objs[0])
+    collector = SoftDeleteCollector(using=using, batch_size=batch_size,
+                                    bulk_signals=bulk_signals, user=user)
+    collector.collect(objs, keep_parents=keep_parents)
+    return collector.delete()
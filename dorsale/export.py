@@ -2,27 +2,26 @@
 # based on http://djangosnippets.org/snippets/1792/ by monokrome
 from __future__ import absolute_import
 from __future__ import unicode_literals
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.conf import settings
 from django.core import serializers
-from django.db.models import Model
 from django.apps import apps as django_apps
-from django.db.models.query import QuerySet
+from django.core.exceptions import FieldDoesNotExist
 from django.template.defaultfilters import slugify
 from django.utils.translation import ugettext as _
+from dorsale.extractors import get_extractor, model_attributes
+from dorsale.spreadsheets import odsstreamwriter, xlsxwriter
 from datetime import date
-import decimal, datetime
+import datetime
 import csv
+import itertools
+import threading
+from collections import namedtuple
 try:
     import xlwt  # XLS Writer, see pypi
     xl_active = True
 except ImportError:
     xl_active = False
-try:
-    import odf, odf.opendocument, odf.table  # odfpy, see pypi
-    odf_active = True
-except ImportError:
-    odf_active = False
     
 import logging
 logger = logging.getLogger(settings.PROJECT_NAME)
@@ -38,18 +37,44 @@ DEFAULT_PARAMS = {
     'charset': 'utf-8',
     'filename': '',
     'sheet_title': _('Export'),
+    'stream': False,
+    'chunk_size': 2000,
 }
 
 
+ExportOptions = namedtuple('ExportOptions', sorted(DEFAULT_PARAMS))
+
+
+def export_options(**kwargs):
+    """
+    Return new, immutable `ExportOptions` from `DEFAULT_PARAMS` and `kwargs`.
+
+    `DEFAULT_PARAMS` doesn’t get changed, so options of one export
+    can’t leak into another (or another thread).
+    Change options with `options._replace(key=value)`.
+    """
+    params = dict(DEFAULT_PARAMS)
+    for key, value in kwargs.items():
+        if key not in params:
+            logger.warn('Unknown export option %s', key)
+            continue
+        params[key] = value
+    for key in ('fields', 'headers'):
+        params[key] = tuple(params[key])
+    return ExportOptions(**params)
+
+
 ALLOWED_EXPORT_TYPES = {
     'csv': {
         'mimetype': 'text/csv',
         # 'template': 'admin/export/csv',
-        'writer': csv.writer
+        'writer': csv.writer,
+        'streamable': True,
     },
     'json': {
         'mimetype': 'text/json',
         'serializer': 'json',
+        'streamable': True,
     },
     'xml': {
         'mimetype': 'text/xml',
@@ -71,18 +96,39 @@ if xl_active:
     class xlswriter(object):
         """
         XLS creator as drop-in replacement for csv.writer
+
+        Several threads may use their own writers or share one.
+        Starts a new sheet when the XLS limit of `max_rows` rows is reached,
+        written rows are flushed every `flush_rows` rows.
         """
+        max_rows = 65536
+        flush_rows = 1000
         # style0 = xlwt.easyxf('font: name Arial, color-index red, bold on', num_format_str='#,##0.00')
         # style1 = xlwt.easyxf(num_format_str='D-MMM-YY')
     
         def __init__(self, targetfile, **kwargs):
-            self.params = DEFAULT_PARAMS
-            self.params.update(kwargs)
+            self.params = export_options(**kwargs)
+            self.lock = threading.Lock()
     
             self.stream = targetfile
-            self.xlwb = xlwt.Workbook(encoding=self.params['charset'])
-            self.xlws = self.xlwb.add_sheet(self.params['sheet_title'])
+            self.xlwb = xlwt.Workbook(encoding=self.params.charset)
+            self.date_style = xlwt.easyxf(num_format_str='YYYY-MM-DD')  # once per workbook
+            self.sheetcounter = 0
+            self.header = None
+            self.add_sheet()
+
+        def add_sheet(self):
+            """
+            Start a new sheet; the first row of the first sheet gets repeated.
+            """
+            self.sheetcounter += 1
+            title = self.params.sheet_title
+            if self.sheetcounter > 1:
+                title = '%s (%d)' % (title, self.sheetcounter)
+            self.xlws = self.xlwb.add_sheet(title)
             self.rowcounter = 0
+            if self.header:
+                self._writerow(*self.header)
     
         def write_value(self, x, y, val, style):
             self.xlws.write(y, x, val, style)
@@ -96,22 +142,35 @@ if xl_active:
         def save(self, filename=None):
             if not filename:
                 filename = self.stream
-            self.xlwb.save(filename)
-            self.rowcounter = 0
+            with self.lock:
+                self.xlwb.save(filename)
+                self.rowcounter = 0
     
-        def writerow(self, fields, style=None):
-            if not style:
-                style = xlwt.Style.default_style
+        def _writerow(self, fields, style):
             y = self.rowcounter
             for x in range(len(fields)):
                 val = fields[x]
                 if hasattr(val, 'startswith') and val.startswith('='):
                     val = val.strip('=')  # otherwise parsing error
                     self.write_formula(x, y, val, style)
+                elif style is xlwt.Style.default_style and isinstance(val, (datetime.date, datetime.time)):
+                    self.write_value(x, y, val, self.date_style)
                 else:
                     self.write_value(x, y, val, style)
             self.set_row_style(y, style)
             self.rowcounter += 1
+            if not self.rowcounter % self.flush_rows:
+                self.xlws.flush_row_data()  # free memory of written rows
+
+        def writerow(self, fields, style=None):
+            if not style:
+                style = xlwt.Style.default_style
+            with self.lock:
+                if self.header is None:
+                    self.header = (fields, style)
+                elif self.rowcounter >= self.max_rows:
+                    self.add_sheet()
+                self._writerow(fields, style)
     
         def writerows(self, rows):
             for row in rows:
@@ -123,70 +182,202 @@ if xl_active:
     }
     
 
-if odf_active:
-    
-    class odswriter(object):
-        """
-        ODS creator as drop-in replacement for csv.writer
-        """
-    
-        def __init__(self, targetfile, **kwargs):
-            self.params = DEFAULT_PARAMS
-            self.params.update(kwargs)
-    
-            self.stream = targetfile
-            self.ods = odf.opendocument.OpenDocumentSpreadsheet()
-            self.odtable = odf.table.Table(name=self.params['sheet_title'])
-            self.ods.spreadsheet.addElement(self.odtable)
-            self.rowcounter = 0
-    
-        def save(self, filename=None):
-            if not filename:
-                self.ods.write(self.stream)
-            else:
-                self.ods.save(filename)
-            self.rowcounter = 0
-    
-        def writerow(self, fields, style=None):
-            row = odf.table.TableRow()
-            for x in range(len(fields)):
-                val = fields[x]
-                args = {'value':val}
-                if hasattr(val, 'startswith') and val.startswith('='):
-                    args = {'formula': val}
-                elif type(val) in (str, unicode):
-                    args = {'stringvalue': val, 'valuetype': 'string'}
-                elif type(val) in (decimal.Decimal,):
-                    args = {'currency': 'EUR', 'valuetype': 'currency'}
-                elif type(val) in (int, float):
-                    args['valuetype'] = 'float'
-                elif type(val) in (datetime.datetime, datetime.date):
-                    args = {'datevalue': val, 'valuetype': 'date'}
-                elif type(val) in (datetime.time,):
-                    args = {'timevalue': val, 'valuetype': 'time'}
-                elif type(val) in (bool,):
-                    args = {'booleanvalue': val, 'valuetype': 'boolean'}
-                if style:
-                    args['stylename'] = style
-                row.addElement(odf.table.TableCell(attributes=args))
-            self.odtable.addElement(row)
-            self.rowcounter += 1
-    
-        def writerows(self, rows):
-            for row in rows:
-                self.writerow(row)
+# streaming writers, no dependencies
+ALLOWED_EXPORT_TYPES['ods'] = {
+    'mimetype': 'application/vnd.oasis.opendocument.spreadsheet',
+    'writer': odsstreamwriter
+}
+ALLOWED_EXPORT_TYPES['xlsx'] = {
+    'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'writer': xlsxwriter
+}
+
+
+def related_lookups(model, fields):
+    """
+    Analyse `fields` (attribute names) of `model`.
+
+    Return a tuple of lists (select_related lookups, prefetch_related lookups):
+    forward ForeignKeys and OneToOneFields can be joined,
+    ManyToMany, reverse relations and generic foreign keys must be prefetched.
+    """
+    select, prefetch = [], []
+    attributes = model_attributes(model)
+    for name in fields:
+        f = attributes.get(name)
+        if f is None or not f.is_relation:
+            continue
+        if f.concrete and (f.many_to_one or f.one_to_one):
+            select.append(name)
+        elif f.one_to_one:  # reverse
+            select.append(name)
+        else:  # ManyToMany, reverse ForeignKey or GenericForeignKey
+            prefetch.append(name)
+    return select, prefetch
+
+
+def iterate_related(qs, fields, chunk_size):
+    """
+    Generator of the objects of `qs`, with all relations in `fields` loaded
+    in a fixed number of queries per chunk of `chunk_size` objects.
+
+    Keeps the order of `qs`; without prefetching, just uses `qs.iterator()`.
+    """
+    select, prefetch = related_lookups(qs.model, fields)
+    if not prefetch:
+        if select:
+            qs = qs.select_related(*select)
+        for item in qs.iterator():
+            yield item
+        return
+    related_qs = qs.model._base_manager.using(qs.db).prefetch_related(*prefetch)
+    if select:
+        related_qs = related_qs.select_related(*select)
+    pks = qs.values_list('pk', flat=True).iterator()
+    while True:
+        chunk = list(itertools.islice(pks, chunk_size))
+        if not chunk:
+            break
+        objs = related_qs.in_bulk(chunk)
+        for pk in chunk:
+            if pk in objs:
+                yield objs[pk]
+
+
+class Echo(object):
+    """
+    Pseudo file for `csv.writer`: `write` returns what it got.
+    """
+    def write(self, value):
+        return value
+
+
+def stream_rows(qs, prm):
+    """
+    Generator of CSV lines of `qs`, for `StreamingHttpResponse`.
+
+    Uses no result cache, related objects are loaded per chunk
+    (see `iterate_related`).
+    """
+    writer = ALLOWED_EXPORT_TYPES[prm.format]['writer'](Echo())
+    extract = get_extractor(qs.model, prm.fields, prm.format, prm.charset)
+    yield writer.writerow(prm.headers)
+    for item in iterate_related(qs, prm.fields, prm.chunk_size):
+        yield writer.writerow(extract(item))
+
+
+def stream_serialized(qs, prm):
+    """
+    Generator of JSON array fragments of `qs`, for `StreamingHttpResponse`.
+
+    Serializes `prm.chunk_size` objects at once, the result
+    is the same as from the (non-streaming) serializer.
+    """
+    serializer = serializers.get_serializer(
+        ALLOWED_EXPORT_TYPES[prm.format]['serializer'])()
+    items = qs.iterator()
+    yield '['
+    first = True
+    while True:
+        chunk = list(itertools.islice(items, prm.chunk_size))
+        if not chunk:
+            break
+        data = serializer.serialize(chunk, fields=prm.fields, ensure_ascii=False)
+        data = data.strip()[1:-1].strip()  # remove brackets
+        if data:
+            if not first:
+                data = ', ' + data
+            first = False
+            yield data
+    yield ']'
+
+
+def prepare_options(qs, **kwargs):
+    """
+    Return `ExportOptions` for exporting `qs` with keyword arguments
+    like `export`, with filename, fields and headers filled in.
+
+    Raise `Http404` for unsupported formats.
+    """
+    prm = export_options(**kwargs)
+    exformat = prm.format
+
+    if not exformat in ALLOWED_EXPORT_TYPES:
+        err = _(u'%s is not a supported format.') % exformat
+        logger.error(err)
+        raise Http404(err)
+
+    if prm.app_label and prm.model_name:
+        model = django_apps.get_model(prm.app_label, prm.model_name)
+    elif prm.model:
+        model = prm.model
+    else:
+        model = qs.model
+
+    if not prm.filename:
+        prm = prm._replace(filename='%s_%s.%s' % (
+            slugify(prm.model_name or model._meta.model_name),
+            date.today().strftime('%Y-%m-%d'),
+            exformat))
+    if not prm.fields:
+        prm = prm._replace(fields=tuple(f.name for f in model._meta.local_fields))
+    if not prm.headers:
+        headers = []
+        for f in prm.fields:
+            try:
+                headers.append(model._meta.get_field(f).verbose_name)
+            except FieldDoesNotExist:
+                headers.append(f)
+        prm = prm._replace(headers=tuple(headers))
+
+    return prm
+
+
+def write_export(target, qs, prm, progress=None):
+    """
+    Write the export of `qs` according to `prm` (`ExportOptions`)
+    into the file-like object `target`.
+
+    :progress: callable or None
+        gets called with the number of written rows
+        after every `prm.chunk_size` rows
+
+    Return the number of written rows (None for serializers).
+    """
+    exformat = prm.format
+    if 'writer' in ALLOWED_EXPORT_TYPES[exformat]:
+        writer = ALLOWED_EXPORT_TYPES[exformat]['writer'](target)
+        extract = get_extractor(qs.model, prm.fields, exformat, prm.charset)
+        writer.writerow(prm.headers)
+        rows = 0
+        for item in iterate_related(qs, prm.fields, prm.chunk_size):
+            writer.writerow(extract(item))
+            rows += 1
+            if progress and not rows % prm.chunk_size:
+                progress(rows)
+        if hasattr(writer, 'save'):
+            writer.save()
+        return rows
+    elif 'serializer' in ALLOWED_EXPORT_TYPES[exformat]:
+        serializer = serializers.get_serializer(
+            ALLOWED_EXPORT_TYPES[exformat]['serializer'])()
+        serializer.serialize(
+            qs.all(),
+            fields=prm.fields,
+            ensure_ascii=False,
+            stream=target)
+        return None
+    else:
+        err = _('Export type for %s must have value for writer or serializer') % exformat
+        logger.error(err)
+        raise Http404(err)
 
-    ALLOWED_EXPORT_TYPES['ods'] = {
-        'mimetype': 'application/vnd.oasis.opendocument.spreadsheet',
-        'writer': odswriter
-    }
-    
 
 def export(request, qs, **kwargs):
     """
     This view exports data in one of several formats.
 
-    Keyword arguments:
+    Keyword arguments (see `DEFAULT_PARAMS`, they become `ExportOptions`):
 
     :app_label:
         application name
@@ -196,7 +387,7 @@ def export(request, qs, **kwargs):
         replacement for app_label and model_name
     :format:
         str, defined by `ALLOWED_EXPORT_TYPES`
-        csv, json, xml, yaml, py, xls, ods
+        csv, json, xml, yaml, py, xls, xlsx, ods
         default: csv
     :fields:
         list of model fields
@@ -210,79 +401,35 @@ def export(request, qs, **kwargs):
     :filename:
         output filename
         default: <model_name>_<date>.<format>
+    :stream:
+        bool, return a `StreamingHttpResponse` (only csv and json),
+        memory use doesn’t depend on the number of rows
+        default: False
+    :chunk_size:
+        number of objects that are serialized or get their
+        related objects prefetched at once
+        default: 2000
     """
-    prm = DEFAULT_PARAMS
-    prm.update(kwargs)
-    exformat = prm['format']
-
-    if not exformat in ALLOWED_EXPORT_TYPES:
-        err = _(u'%s is not a supported format.') % exformat
-        logger.error(err)
-        raise Http404(err)
-
-    if prm['app_label'] and prm['model_name']:
-        model = django_apps.get_model(prm['app_label'], prm['model_name'])
-    elif prm['model']:
-        model = prm['model']
-    else:
-        model = None
-
-    if not prm['filename']:
-        prm['filename'] = '%s_%s.%s' % (
-            slugify(prm['model_name']),
-            date.today().strftime('%Y-%m-%d'),
-            exformat)
-    if model:
-        if not prm['fields']:
-            prm['fields'] = [f.name for f in model._meta.local_fields]
-        if not prm['headers']:
-            try:
-                prm['headers'] = [getattr(model, f).verbose_name for f in prm['fields']]
-            except Exception as e:
-                logger.error(e)
-                prm['headers'] = prm['fields']
+    prm = prepare_options(qs, **kwargs)
+    exformat = prm.format
 
     mimetype = ALLOWED_EXPORT_TYPES[exformat]['mimetype']
-    response = HttpResponse(mimetype=mimetype)
-    response['Content-Type'] = '%s; charset=%s' % (mimetype, prm['charset'])
-    response['Content-Disposition'] = 'attachment; filename=%s' % prm['filename']
+    streaming = prm.stream and ALLOWED_EXPORT_TYPES[exformat].get('streamable')
+    if streaming:
+        if 'writer' in ALLOWED_EXPORT_TYPES[exformat]:
+            content = stream_rows(qs, prm)
+        else:
+            content = stream_serialized(qs, prm)
+        response = StreamingHttpResponse(content, content_type=mimetype)
+    else:
+        response = HttpResponse(content_type=mimetype)
+    response['Content-Type'] = '%s; charset=%s' % (mimetype, prm.charset)
+    response['Content-Disposition'] = 'attachment; filename=%s' % prm.filename
     response['Cache-Control'] = 'must-revalidate'
     response['Pragma'] = 'must-revalidate'
 
-    if 'writer' in ALLOWED_EXPORT_TYPES[exformat]:
-        writer = ALLOWED_EXPORT_TYPES[exformat]['writer'](response)
-        writer.writerow(prm['headers'])
-        for item in qs:
-            row = []
-            for field in prm['fields']:
-                val = getattr(item, field)
-                if callable(val):
-                    val = val()
-                if isinstance(val, QuerySet):
-                    val = ', '.join(x.__unicode__() for x in val.all())
-                elif isinstance(val, Model):
-                    val = val.__unicode__()
-                elif isinstance(val, bool):
-                    val = {True:_('Yes'), False:_('No')}[val]
-                elif val == None:
-                    val = _('Unknown')
-                if type(val) is unicode and prm['format'] != 'ods':
-                    val = val.encode(prm['charset'])
-                row.append(val)
-            writer.writerow(row)
-        if hasattr(writer, 'save'):
-            writer.save()
-    elif 'serializer' in ALLOWED_EXPORT_TYPES[exformat]:
-        serializer = serializers.get_serializer(
-            ALLOWED_EXPORT_TYPES[exformat]['serializer'])()
-        serializer.serialize(
-            qs.all(),
-            fields=prm['fields'],
-            ensure_ascii=False,
-            stream=response)
-    else:
-        err = _('Export type for %s must have value for writer or serializer') % exformat
-        logger.error(err)
-        raise Http404(err)
+    if streaming:
+        return response
 
+    write_export(response, qs, prm)
     return response
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Export jobs: run `dorsale.export` writers in the background,
+write into a file, report progress and serve the result
+with HTTP Range support (resumable downloads).
+
+    job_id = start_export_job(qs, user=request.user, format='xls')
+    # poll export_job_status, then fetch export_job_download
+
+Backends (`settings.DORSALE_EXPORT_BACKEND`):
+
+:thread: local pool of `DORSALE_EXPORT_WORKERS` worker threads (default)
+:celery: celery task `dorsale.export_job`
+:sync: run in the calling thread (e.g. for debugging)
+
+Job state lives in Django’s cache, so status and download views
+work in every web worker; for the `celery` backend, `DORSALE_EXPORT_ROOT`
+must be shared between web and celery workers.
+
+Files of jobs older than `DORSALE_EXPORT_JOB_TIMEOUT` get removed
+whenever a job starts (`cleanup_export_files`, also the management
+command `dorsale_cleanup_exports`).
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import io
+import os
+import re
+import six
+import uuid
+import base64
+import pickle
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from django.apps import apps as django_apps
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db import connections
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse, Http404
+from django.utils.encoding import force_text
+from dorsale.conf import settings
+from dorsale.export import ALLOWED_EXPORT_TYPES, export_options, prepare_options, write_export
+import logging
+logger = logging.getLogger(settings.PROJECT_NAME)
+
+try:
+    from celery import shared_task
+    celery_active = True
+except ImportError:
+    celery_active = False
+
+JOB_CACHE_KEY = 'dorsale:exportjob:%s'
+BINARY_FORMATS = ('xls', 'xlsx', 'ods')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+JOB_FILE_RE = re.compile(r'^([0-9a-f]{32})\.\w+(\.part)?$')  # : job ID, format
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def export_root():
+    """
+    Directory for export files (`settings.DORSALE_EXPORT_ROOT`
+    or 'dorsale-exports' in the temp directory), created if necessary.
+    """
+    root = getattr(settings, 'DORSALE_EXPORT_ROOT', None) \
+        or os.path.join(tempfile.gettempdir(), 'dorsale-exports')
+    if not os.path.isdir(root):
+        try:
+            os.makedirs(root)
+        except OSError:  # another worker was faster
+            pass
+    return root
+
+
+def get_job(job_id):
+    """
+    Return the state dict of export job `job_id` or `None`:
+
+    :id: job ID
+    :status: 'pending', 'running', 'done' or 'failed'
+    :rows: number of written rows
+    :total: number of rows to write
+    :filename: download file name
+    :mimetype:
+    :charset:
+    :path: path of the finished file
+    :user_id: ID of the user that started the job
+    :error: error message, if failed
+    """
+    return cache.get(JOB_CACHE_KEY % job_id)
+
+
+def update_job(job_id, **kwargs):
+    """
+    Change the state of job `job_id`.
+    """
+    job = get_job(job_id) or {'id': job_id}
+    job.update(kwargs)
+    cache.set(JOB_CACHE_KEY % job_id, job, job_timeout())
+    return job
+
+
+def job_timeout():
+    return int(getattr(settings, 'DORSALE_EXPORT_JOB_TIMEOUT', 86400))
+
+
+def cleanup_export_files(max_age=None):
+    """
+    Remove export files (also unfinished ones) that are older than `max_age`
+    seconds (default: `DORSALE_EXPORT_JOB_TIMEOUT`) and whose job
+    isn’t known any more. Other files in the export directory stay.
+
+    Return the number of removed files.
+    """
+    root = export_root()
+    limit = time.time() - (job_timeout() if max_age is None else max_age)
+    count = 0
+    for name in os.listdir(root):
+        match = JOB_FILE_RE.match(name)
+        path = os.path.join(root, name)
+        try:
+            if not match or os.path.getmtime(path) > limit or get_job(match.group(1)):
+                continue
+            os.remove(path)
+            count += 1
+        except OSError:  # removed by another worker
+            pass
+    return count
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(int(getattr(settings, 'DORSALE_EXPORT_WORKERS', 2)))
+    return _pool
+
+
+def start_export_job(qs, user=None, **kwargs):
+    """
+    Start exporting `qs` in the background, return the job ID.
+
+    Keyword arguments like `dorsale.export.export` (`stream` is ignored).
+    """
+    prm = prepare_options(qs, **kwargs)
+    try:
+        cleanup_export_files()
+    except OSError as ex:
+        logger.warn('Couldn’t clean up export files: %s', ex)
+    job_id = uuid.uuid4().hex
+    options = prm._replace(
+        model=None, stream=False,
+        app_label=qs.model._meta.app_label,
+        model_name=qs.model._meta.model_name,
+        headers=tuple(force_text(h) for h in prm.headers),
+        sheet_title=force_text(prm.sheet_title),
+    )._asdict()
+    query = base64.b64encode(pickle.dumps(qs.query)).decode('ascii')
+    update_job(job_id, status='pending', rows=0, total=None,
+               filename=prm.filename,
+               mimetype=ALLOWED_EXPORT_TYPES[prm.format]['mimetype'],
+               charset=prm.charset, path=None, error=None,
+               user_id=getattr(user, 'pk', None))
+
+    backend = getattr(settings, 'DORSALE_EXPORT_BACKEND', 'thread')
+    if backend == 'celery' and celery_active:
+        run_export_task.delay(job_id, qs.db, query, options)
+    elif backend == 'sync':
+        run_export_job(job_id, qs.db, query, options)
+    else:
+        if backend != 'thread':
+            logger.warn('Export backend %s is not available, using threads.', backend)
+        get_pool().apply_async(run_export_thread, (job_id, qs.db, query, options))
+    return job_id
+
+
+def run_export_job(job_id, using, query, options):
+    """
+    Write the export file of job `job_id`.
+
+    :using: database alias
+    :query: base64 encoded pickle of the queryset’s `query`
+    :options: dict of `ExportOptions`
+    """
+    prm = export_options(**options)
+    path = os.path.join(export_root(), '%s.%s' % (job_id, prm.format))
+    partpath = path + '.part'
+    try:
+        model = django_apps.get_model(prm.app_label, prm.model_name)
+        qs = model._base_manager.using(using).all()
+        qs.query = pickle.loads(base64.b64decode(query))
+        update_job(job_id, status='running', total=qs.count())
+
+        if prm.format in BINARY_FORMATS \
+                or (six.PY2 and 'writer' in ALLOWED_EXPORT_TYPES[prm.format]):
+            target = open(partpath, 'wb')
+        else:
+            target = io.open(partpath, 'w', encoding=prm.charset, newline='')
+        with target:
+            rows = write_export(target, qs, prm,
+                                progress=lambda rows: update_job(job_id, rows=rows))
+        os.rename(partpath, path)  # never serve an incomplete file
+        update_job(job_id, status='done', path=path,
+                   **({'rows': rows} if rows is not None else {}))
+    except Exception as ex:
+        logger.exception(ex)
+        if os.path.exists(partpath):
+            os.remove(partpath)
+        update_job(job_id, status='failed', error=force_text(ex))
+
+
+def run_export_thread(*args):
+    """
+    `run_export_job` for the thread pool
+    """
+    try:
+        run_export_job(*args)
+    finally:
+        # worker threads shouldn’t keep connections open
+        connections.close_all()
+
+if celery_active:
+    run_export_task = shared_task(name='dorsale.export_job', ignore_result=True)(run_export_job)
+
+
+def get_own_job(request, job_id):
+    job = get_job(job_id)
+    if not job or (job.get('user_id') != request.user.pk and not request.user.is_superuser):
+        raise Http404('No such export job')
+    return job
+
+
+@login_required
+def export_job_status(request, job_id):
+    """
+    JSON view of the state of export job `job_id` (without `path`).
+    """
+    job = dict(get_own_job(request, job_id))
+    job.pop('path', None)
+    return JsonResponse(job)
+
+
+def file_range(fileobj, start, length, blocksize=65536):
+    """
+    Generator of `length` bytes of `fileobj`, starting at `start`.
+    """
+    try:
+        fileobj.seek(start)
+        while length > 0:
+            data = fileobj.read(min(blocksize, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fileobj.close()
+
+
+@login_required
+def export_job_download(request, job_id):
+    """
+    Serve the file of finished export job `job_id`;
+    supports single byte ranges (`Range: bytes=start-end`),
+    so broken downloads can be resumed.
+    """
+    job = get_own_job(request, job_id)
+    if job['status'] != 'done' or not job['path'] or not os.path.exists(job['path']):
+        return HttpResponse(status=409 if job['status'] in ('pending', 'running') else 404)
+    size = os.path.getsize(job['path'])
+    content_type = '%s; charset=%s' % (job['mimetype'], job['charset'])
+
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if match and any(match.groups()):
+        start, end = match.groups()
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:  # suffix range: last n bytes
+            start = max(size - int(end), 0)
+            end = size - 1
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        response = StreamingHttpResponse(
+            file_range(open(job['path'], 'rb'), start, end - start + 1),
+            status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(open(job['path'], 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'attachment; filename=%s' % job['filename']
+    return response
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Precompiled row extractors: get the values of a list of fields (or methods)
+from model instances, with one getter (and converter) per column
+that is chosen only once per model and field list.
+
+Extractors are cached on the model class.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import six
+import types
+from operator import attrgetter
+from django.db import models
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext as _
+import logging
+logger = logging.getLogger(__name__)
+
+TEXT_FORMATS = ('csv',)  # : export formats that get dates as ISO strings and encoded text
+CACHE_ATTRIBUTE = '_dorsale_extractors'
+
+
+def model_attributes(model):
+    """
+    dict {attribute name: field} of `model`’s fields and relations;
+    reverse relations are listed by their accessor name (like 'book_set').
+    """
+    attributes = {}
+    for f in model._meta.get_fields():
+        if f.is_relation and f.auto_created and not f.concrete:
+            attributes[f.get_accessor_name()] = f
+        else:
+            attributes[f.name] = f
+    return attributes
+
+
+def is_method(model, name):
+    """
+    Is `name` a method of `model` (and not a field or property)?
+    """
+    return isinstance(getattr(model, name, None), (types.FunctionType, types.MethodType))
+
+
+def is_manager_field(field):
+    """
+    Does the attribute for `field` return a related manager?
+    """
+    if field is None or not field.is_relation:
+        return False
+    return field.many_to_many or field.one_to_many
+
+
+def method_getter(name):
+    def getter(obj):
+        return getattr(obj, name)()
+    return getter
+
+
+def manager_getter(name):
+    getmanager = attrgetter(name)
+
+    def getter(obj):
+        return getmanager(obj).all()  # uses prefetched objects
+    return getter
+
+
+def joined(objs):
+    return ', '.join(force_text(x) for x in objs)
+
+
+def yes_no(val):
+    if val is None:
+        return _('Unknown')
+    return {True: _('Yes'), False: _('No')}[bool(val)]
+
+
+def text_or_unknown(val):
+    if val is None:
+        return _('Unknown')
+    return force_text(val)
+
+
+def iso_or_unknown(val):
+    if val is None:
+        return _('Unknown')
+    return val.isoformat()
+
+
+def plain(val):
+    """
+    Convert a value of unknown type (e.g. a method’s result).
+    """
+    if isinstance(val, models.Model):
+        return force_text(val)
+    if isinstance(val, (models.QuerySet, models.Manager)):
+        return joined(val.all())
+    if isinstance(val, bool):
+        return yes_no(val)
+    if val is None:
+        return _('Unknown')
+    return val
+
+
+def unknown_if_none(val):
+    if val is None:
+        return _('Unknown')
+    return val
+
+
+def encoder(convert, charset):
+    def encode(val):
+        val = convert(val)
+        if isinstance(val, six.text_type):
+            return val.encode(charset)
+        return val
+    return encode
+
+
+class RowExtractor(object):
+    """
+    Callable that returns the list of values of `fields` of a model instance.
+
+    Without `format`, values are raw (like `getattr`, methods get called).
+    With an export `format`, each value gets converted according to its
+    field type: booleans to Yes/No, related objects to text, dates to ISO
+    (for text formats), related managers to comma separated lists.
+    """
+    def __init__(self, model, fields, format=None, charset='utf-8'):
+        self.model = model
+        self.fields = tuple(fields)
+        self.format = format
+        self.charset = charset
+        attributes = model_attributes(model)
+        self.getters = []
+        self.converters = []
+        for name in self.fields:
+            field = attributes.get(name)
+            if format and is_manager_field(field):
+                self.getters.append(manager_getter(name))
+            elif field is None and is_method(model, name):
+                self.getters.append(method_getter(name))
+            else:
+                self.getters.append(attrgetter(name))
+            if format:
+                self.converters.append(self.converter(field))
+        self.columns = tuple(zip(self.getters, self.converters))
+
+    def converter(self, field):
+        """
+        Choose the converter for one column.
+        """
+        if is_manager_field(field):
+            convert = joined
+        elif isinstance(field, (models.BooleanField, models.NullBooleanField)):
+            convert = yes_no
+        elif field is not None and field.is_relation:
+            convert = text_or_unknown
+        elif isinstance(field, (models.DateField, models.TimeField)):  # incl. DateTimeField
+            if self.format in TEXT_FORMATS:
+                convert = iso_or_unknown
+            else:
+                convert = unknown_if_none
+        elif field is None:  # method or property
+            convert = plain
+        else:
+            convert = unknown_if_none
+        if six.PY2 and self.format in TEXT_FORMATS:
+            convert = encoder(convert, self.charset)
+        return convert
+
+    def __call__(self, obj):
+        if self.format:
+            return [convert(get(obj)) for get, convert in self.columns]
+        return [get(obj) for get in self.getters]
+
+
+def get_extractor(model, fields, format=None, charset='utf-8'):
+    """
+    Return the (cached) `RowExtractor` of `model` for `fields`.
+    """
+    cache = model.__dict__.get(CACHE_ATTRIBUTE)
+    if cache is None:
+        cache = {}
+        setattr(model, CACHE_ATTRIBUTE, cache)
+    key = (tuple(fields), format, charset)
+    try:
+        return cache[key]
+    except KeyError:
+        extractor = cache[key] = RowExtractor(model, fields, format, charset)
+        return extractor
+
+
+def is_plain_field(field):
+    """
+    Is `field` a concrete field without relation (can come from `values_list`)?
+    """
+    return field is not None and field.concrete and not field.is_relation
+
+
+def is_forward_relation(field):
+    """
+    Is `field` a foreign key or one-to-one field of the model itself?
+    """
+    return field is not None and field.concrete and field.is_relation \
+        and (field.many_to_one or field.one_to_one)
+
+
+def attach_related(objs, field):
+    """
+    Load the related objects of foreign key `field` of all `objs`
+    with one query.
+    """
+    ids = set(getattr(obj, field.attname) for obj in objs)
+    ids.discard(None)
+    related = field.related_model._base_manager.in_bulk(list(ids))
+    for obj in objs:
+        related_obj = related.get(getattr(obj, field.attname))
+        if related_obj is not None:
+            setattr(obj, field.name, related_obj)
+
+
+def table_rows(objects, fields):
+    """
+    Return a list of tuples (pk, values of `fields`) for `objects`
+    (queryset or list of instances), with a fixed number of queries:
+
+    - only plain fields: one `values_list` query
+    - foreign keys: `select_related` (lists: one query per foreign key)
+    - methods and properties: called per instance
+    """
+    if isinstance(objects, models.QuerySet):
+        model = objects.model
+    else:
+        objects = list(objects)
+        if not objects:
+            return []
+        model = type(objects[0])
+    attributes = model_attributes(model)
+    fields = tuple(fields)
+    if isinstance(objects, models.QuerySet):
+        if all(is_plain_field(attributes.get(name)) for name in fields):
+            return [(row[0], row[1:]) for row in objects.values_list('pk', *fields)]
+        related = [name for name in fields if is_forward_relation(attributes.get(name))]
+        if related:
+            objects = objects.select_related(*related)
+    else:
+        for name in fields:
+            if is_forward_relation(attributes.get(name)):
+                attach_related(objects, attributes[name])
+    extract = get_extractor(model, fields)
+    return [(obj.pk, tuple(extract(obj))) for obj in objects]
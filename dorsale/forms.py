@@ -10,6 +10,7 @@ try:
     coloree_active = True
 except ImportError:
     coloree_active = False
+from dorsale import local
 from dorsale.widgets import DatePickerWidget
 
 try:
@@ -46,8 +47,7 @@ class DorsaleBaseModelForm(ModelForm):
         if hasattr(obj, 'lastchangedon'):
             obj.lastchangedon = now()
         if hasattr(obj, 'site'):
-            from django.contrib.sites.models import Site
-            obj.site = Site.objects.get_current()
+            obj.site = local.get_current_site()
         if not obj.pk:  # new dataset
             if hasattr(obj, 'createdby'):
                 obj.createdby = self.user
@@ -61,27 +61,31 @@ class DorsaleBaseModelForm(ModelForm):
         return obj
 
 
-def ModelFormFactory(some_model, *args, **kwargs):
+_form_classes = {}  # : {(model, disabled): ModelForm class}, see `get_model_form_class`
+
+
+def get_model_form_class(some_model, disabled=False):
     """
-    Create a ModelForm for `some_model`.
+    Return the (cached) ModelForm class for `some_model`.
 
     `DateField` and `coloree.fields.HtmlColorCodeField` get their own widgets
-    assigned, if there’s NO keyword argument 'disabled'.
+    assigned, if not `disabled`.
 
     see also http://stackoverflow.com/questions/297383/dynamically-update-modelforms-meta-class
     """
+    key = (some_model, bool(disabled))
+    try:
+        return _form_classes[key]
+    except KeyError:
+        pass
     widdict = {}
-    if not('disabled' in kwargs and kwargs['disabled']):
+    if not disabled:
         # set some widgets for special fields
         for field in some_model._meta.local_fields:
             if type(field) is models.DateField:
                 widdict[field.name] = DatePickerWidget()
             elif coloree_active and type(field) is HtmlColorCodeField:
                 widdict[field.name] = ColorPickerWidget()
-    try:
-        del kwargs['disabled']
-    except KeyError:
-        pass
 
     class MyModelForm(DorsaleBaseModelForm):
         class Meta:
@@ -89,4 +93,18 @@ def ModelFormFactory(some_model, *args, **kwargs):
             widgets = widdict
             exclude = []
 
-    return MyModelForm(*args, **kwargs)
+    MyModelForm.__name__ = str('%sForm' % some_model.__name__)
+    # another thread might have been faster, that’s harmless
+    return _form_classes.setdefault(key, MyModelForm)
+
+
+def ModelFormFactory(some_model, *args, **kwargs):
+    """
+    Create a ModelForm for `some_model`,
+    i.e. an instance of `get_model_form_class(some_model, disabled)`.
+
+    `DateField` and `coloree.fields.HtmlColorCodeField` get their own widgets
+    assigned, if there’s NO keyword argument 'disabled'.
+    """
+    disabled = kwargs.pop('disabled', False)
+    return get_model_form_class(some_model, disabled)(*args, **kwargs)
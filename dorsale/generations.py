@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Generation counters per model, kept in Django’s cache.
+
+Every save, delete or soft delete of a dorsale model bumps its generation,
+so cache entries that contain the generation in their key
+(counts, rendered lists, trees) are never stale.
+
+Changes by `QuerySet.update()` and hard deletes of `FakeDeleteMixin` models
+by `QuerySet.delete()` don’t bump it; call `bump_generation` yourself after those.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import time
+from django.core.cache import cache
+from django.db.models.signals import class_prepared, post_save, post_delete
+from dorsale.deletion import is_fake_deletable, post_soft_delete
+import logging
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'dorsale:generation:%s'
+
+
+def new_generation():
+    """
+    start value of a generation counter: milliseconds since the epoch,
+    so a counter that got evicted never restarts at an old value
+    """
+    return int(time.time() * 1000)
+
+
+def get_generation(model):
+    """
+    Return the current generation of `model` (class or instance).
+    """
+    key = GENERATION_KEY % model._meta.label_lower
+    generation = cache.get(key)
+    if generation is None:
+        generation = new_generation()
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)  # another process was faster
+    return generation
+
+
+def bump_generation(model):
+    """
+    Start a new generation of `model` (class or instance).
+    """
+    key = GENERATION_KEY % model._meta.label_lower
+    try:
+        cache.incr(key)
+    except ValueError:  # not (any more) in cache
+        cache.add(key, new_generation(), None)
+
+
+def is_dorsale_model(model):
+    from dorsale.models import FakeDeleteMixin, FieldInfoMixin  # avoid circular import
+    return issubclass(model, (FakeDeleteMixin, FieldInfoMixin))
+
+
+def model_changed(sender, **kwargs):
+    bump_generation(sender)
+
+
+def connect_receivers(sender, **kwargs):
+    """
+    `class_prepared` receiver: bump the generation of dorsale models on changes.
+
+    Connected per model, since any `post_delete` receiver switches off
+    Django’s fast deletes for its models. `FakeDeleteMixin` models get none:
+    `SoftDeleteCollector` and the archive bump their generations themselves,
+    so `QuerySet.soft_delete()` keeps its set-based path.
+    """
+    if not is_dorsale_model(sender):
+        return
+    uid = sender._meta.label_lower
+    post_save.connect(model_changed, sender=sender, dispatch_uid='dorsale.generations.saved:' + uid)
+    if not is_fake_deletable(sender):
+        post_delete.connect(model_changed, sender=sender, dispatch_uid='dorsale.generations.deleted:' + uid)
+    post_soft_delete.connect(model_changed, sender=sender, dispatch_uid='dorsale.generations.soft_deleted:' + uid)
+
+class_prepared.connect(connect_receivers, dispatch_uid='dorsale.generations.connect_receivers')
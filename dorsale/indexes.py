@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Default indexes for the filter path of dorsale models.
+
+Every query of `DorsaleSiteManager` filters on `site_id = X AND deleted = false`
+and orders by `id` or `get_latest_by` (MPTT trees: `tree_id, lft`).
+Concrete subclasses of `DorsaleBaseModel` get composite indexes on
+(site, deleted, ...) added to their `Meta.indexes` (Django ≥ 1.11),
+so `makemigrations` picks them up. Set `dorsale_indexes = False`
+on a model to opt out, or `dorsale_group_index = 'group'` (name of a foreign key
+of the model) to add (site, deleted, group, id) for `DorsaleGroupSiteManager`.
+
+Partial indexes (`... WHERE deleted = false`) need `Index(condition=...)`,
+i.e. Django ≥ 2.2. To get them on PostgreSQL until then, set
+`DORSALE_PARTIAL_INDEXES = True`: the default indexes are then *not* declared
+in `Meta.indexes`, and `dorsale_indexes --create` creates them with raw SQL
+(partial where the database supports them). Either way, every column set
+gets indexed by one mechanism only.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import hashlib
+from django.db import models
+from django.db.models.signals import class_prepared
+from dorsale.conf import settings
+import logging
+logger = logging.getLogger(__name__)
+
+#: databases where `dorsale_indexes --create` makes partial indexes
+PARTIAL_INDEX_VENDORS = ('postgresql',)
+MAX_NAME_LENGTH = 30  # Index.max_name_length
+
+
+def declares_indexes():
+    """
+    Are the default indexes declared in `Meta.indexes` (i.e. made by migrations)?
+    """
+    return hasattr(models, 'Index') and not getattr(settings, 'DORSALE_PARTIAL_INDEXES', False)
+
+
+def has_field(model, name):
+    # not `_meta.fields`: that would get cached before mptt adds its fields
+    return name in [f.name for f in model._meta.local_fields]
+
+
+def is_indexed_model(model):
+    """
+    Is `model` a concrete dorsale model with `site` and `deleted`?
+    """
+    return getattr(model, 'dorsale_indexes', None) is not None \
+        and not model._meta.abstract \
+        and not model._meta.proxy \
+        and has_field(model, 'site') and has_field(model, 'deleted')
+
+
+def default_index_fields(model):
+    """
+    list of field name tuples that should be indexed for `model`
+    (without `deleted` for partial indexes, see `partial_index_fields`)
+    """
+    orderings = [('id',)]
+    latest = model._meta.get_latest_by
+    if latest and not isinstance(latest, (list, tuple)):
+        latest = [latest]
+    if latest and tuple(latest) != ('id',):
+        orderings.append(tuple(f.lstrip('-') for f in latest))
+    group_field = getattr(model, 'dorsale_group_index', None)
+    if group_field:
+        orderings.append((group_field, 'id'))
+    mptt_meta = getattr(model, '_mptt_meta', None)
+    if mptt_meta is not None:
+        orderings.append((mptt_meta.tree_id_attr, mptt_meta.left_attr))
+    return [('site', 'deleted') + ordering for ordering in orderings]
+
+
+def partial_index_fields(fields):
+    return tuple(f for f in fields if f != 'deleted')
+
+
+def index_name(model, fields, suffix='idx'):
+    """
+    stable name (max. 30 chars) of an index of `model` on `fields`
+    """
+    digest = hashlib.md5(('%s:%s' % (model._meta.db_table, ','.join(fields))).encode('utf-8')).hexdigest()[:8]
+    prefix = model._meta.db_table[:MAX_NAME_LENGTH - len(digest) - len(suffix) - 2]
+    return '%s_%s_%s' % (prefix, digest, suffix)
+
+
+def add_default_indexes(sender, **kwargs):
+    """
+    `class_prepared` receiver: add the default indexes to `Meta.indexes`
+    """
+    if not declares_indexes() or not is_indexed_model(sender) \
+            or not sender.dorsale_indexes:
+        return
+    existing = [tuple(index.fields) for index in sender._meta.indexes] \
+        + [tuple(fields) for fields in sender._meta.index_together]
+    added = [models.Index(fields=list(fields), name=index_name(sender, fields))
+             for fields in default_index_fields(sender) if fields not in existing]
+    if added:
+        # a new list: models may share the list of an inherited `Meta`
+        sender._meta.indexes = list(sender._meta.indexes) + added
+
+class_prepared.connect(add_default_indexes, dispatch_uid='dorsale.indexes.add_default_indexes')
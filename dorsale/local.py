@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Request-local storage for the current user and site
+(set by `dorsale.middleware.CurrentUserMiddleware` and `RequestSiteMiddleware`).
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+from django.contrib.auth.models import Group, User
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.db.models.signals import m2m_changed, pre_delete
+from dorsale.conf import settings
+import logging
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def set_current_user(user):
+    """Remember `user` for the current request (thread)."""
+    _local.user = user
+
+
+def get_current_user():
+    """Return the user of the current request or `None`."""
+    return getattr(_local, 'user', None)
+
+
+def clear():
+    """Forget everything about the current request."""
+    _local.__dict__.clear()
+
+
+def get_user(user_or_id):
+    """
+    Return a `contrib.auth.models.User` for `user_or_id` (user object or ID),
+    or `None` if there’s no such user.
+
+    Takes the current request’s user if the ID matches,
+    so there’s no query for the logged in user.
+    """
+    if user_or_id is None:
+        return None
+    if hasattr(user_or_id, 'pk'):
+        if user_or_id.pk is None:  # AnonymousUser
+            return None
+        return user_or_id
+    current = get_current_user()
+    if current is not None and current.pk == user_or_id:
+        return current
+    try:
+        return User.objects.get(pk=user_or_id)
+    except User.DoesNotExist:
+        return None
+
+
+GROUP_IDS_KEY = 'dorsale:groupids:%s'
+NO_GROUPS_WARNED_KEY = 'dorsale:nogroups:%s'
+
+
+def is_shared_cache():
+    """
+    Do all processes see the same Django cache (not a per-process local memory cache)?
+    """
+    from django.core.cache.backends.dummy import DummyCache
+    from django.core.cache.backends.locmem import LocMemCache
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (DummyCache, LocMemCache))
+
+
+def get_group_ids(user):
+    """
+    Return a frozenset of the IDs of `user`’s groups.
+
+    The result is cached on the user object (i.e. for the current request)
+    and, with a cache backend that all processes share (memcached, redis,
+    database…), in Django’s cache for `DORSALE_GROUP_CACHE_TIMEOUT` seconds,
+    until the user’s groups change (`evict_group_ids`). A per-process cache
+    can’t be evicted in other workers, so then every request queries once.
+    """
+    try:
+        return user._dorsale_group_ids
+    except AttributeError:
+        pass
+    timeout = int(getattr(settings, 'DORSALE_GROUP_CACHE_TIMEOUT', 3600))
+    shared = timeout and is_shared_cache()
+    key = GROUP_IDS_KEY % user.pk
+    group_ids = cache.get(key) if shared else None
+    if group_ids is None:
+        group_ids = frozenset(user.groups.values_list('id', flat=True))
+        if shared:
+            cache.set(key, group_ids, timeout)
+    user._dorsale_group_ids = group_ids
+    return group_ids
+
+
+def evict_group_ids(*user_ids):
+    """
+    Forget the cached group IDs of the users with `user_ids`.
+    """
+    if user_ids:
+        cache.delete_many([GROUP_IDS_KEY % pk for pk in user_ids]
+                          + [NO_GROUPS_WARNED_KEY % pk for pk in user_ids])  # warn again
+    current = get_current_user()
+    if current is not None and current.pk in user_ids:
+        try:
+            del current._dorsale_group_ids
+        except AttributeError:
+            pass
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:  # user.groups changed
+        instance.__dict__.pop('_dorsale_group_ids', None)
+        evict_group_ids(instance.pk)
+    elif pk_set:  # group.user_set changed
+        evict_group_ids(*pk_set)
+    elif action == 'pre_clear':  # group.user_set.clear(), before the rows are gone
+        evict_group_ids(*instance.user_set.values_list('pk', flat=True))
+
+
+def group_deleted(sender, instance, **kwargs):
+    evict_group_ids(*instance.user_set.values_list('pk', flat=True))
+
+m2m_changed.connect(user_groups_changed, sender=User.groups.through, dispatch_uid='dorsale.local.user_groups_changed')
+pre_delete.connect(group_deleted, sender=Group, dispatch_uid='dorsale.local.group_deleted')
+
+
+def set_current_site(site):
+    """Remember `site` (`contrib.sites.models.Site`) for the current request (thread)."""
+    _local.site = site
+
+
+def get_current_site():
+    """
+    Return the `Site` of the current request,
+    or `Site.objects.get_current()` (i.e. `settings.SITE_ID`) if none was set.
+    """
+    site = getattr(_local, 'site', None)
+    if site is None:
+        from django.contrib.sites.models import Site
+        site = Site.objects.get_current()
+    return site
+
+
+def get_current_site_id():
+    """
+    Return the ID of the current request’s `Site`, or `settings.SITE_ID`.
+    Never causes a query.
+    """
+    site = getattr(_local, 'site', None)
+    if site is None:
+        from django.conf import settings
+        return settings.SITE_ID
+    return site.id
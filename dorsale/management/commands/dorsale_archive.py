@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Archive soft-deleted rows older than their retention period and purge them,
+or restore an archived object (see `dorsale.archive`).
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.encoding import force_text
+from dorsale.archive import ArchiveError, archive_model, is_archivable, restore, retention_days
+
+
+class Command(BaseCommand):
+    help = 'Move soft-deleted rows older than their retention period to archive files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('label', nargs='*',
+                            help='app_label or app_label.ModelName (default: all models)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='database alias (default: "default")')
+        parser.add_argument('--days', type=int, default=None,
+                            help='retention period in days, overrides models and settings')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='objects per batch (default: DORSALE_ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='stop after this many batches per model')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='only count the objects that are due')
+        parser.add_argument('--restore', metavar='PK', default=None,
+                            help='restore archived object PK of the one given model')
+
+    def handle(self, *labels, **options):
+        labels = options.get('label') or labels
+        try:
+            models = self.get_models(labels)
+        except LookupError as ex:
+            raise CommandError(force_text(ex))
+        try:
+            if options['restore'] is not None:
+                if len(models) != 1:
+                    raise CommandError('--restore needs exactly one app_label.ModelName')
+                count = restore(models[0], options['restore'], using=options['database'])
+                self.stdout.write('Restored %d rows.' % count)
+                return
+
+            for model in models:
+                days = options['days'] if options['days'] is not None else retention_days(model)
+                if days is None:
+                    if int(options.get('verbosity', 1)) > 1:
+                        self.stdout.write('%s: no retention period' % model._meta.label)
+                    continue
+                count = archive_model(model, days=days, batch_size=options['batch_size'],
+                                      max_batches=options['max_batches'],
+                                      using=options['database'], dry_run=options['dry_run'])
+                if options['dry_run']:
+                    self.stdout.write('%s: %d objects due (older than %d days)' % (model._meta.label, count, days))
+                else:
+                    self.stdout.write('%s: archived %d rows' % (model._meta.label, count))
+        except (ImproperlyConfigured, ArchiveError) as ex:
+            raise CommandError(force_text(ex))
+
+    def get_models(self, labels):
+        if not labels:
+            return [m for m in apps.get_models() if is_archivable(m)]
+        models = []
+        for label in labels:
+            if '.' in label:
+                model = apps.get_model(label)
+                if not is_archivable(model):
+                    raise CommandError('%s has no soft-deleted rows to archive' % label)
+                models.append(model)
+            else:
+                models.extend(m for m in apps.get_app_config(label).get_models() if is_archivable(m))
+        return models
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the per-row time of `dorsale.extractors.RowExtractor` with the
+former per-cell getattr/isinstance path, on rows of a model that are
+loaded into memory first (no database time in the measurement):
+
+    ./manage.py dorsale_benchmark_extractors myapp.Item --rows 5000 --fields name,group,createdon
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import types
+from timeit import default_timer
+import six
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Model, Manager
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext as _
+from dorsale.export import related_lookups
+from dorsale.extractors import RowExtractor
+
+
+def legacy_export_value(val, format, charset):
+    """
+    per-cell conversion of `dorsale.export` before `RowExtractor`
+    """
+    if isinstance(val, (QuerySet, Manager)):
+        val = ', '.join(force_text(x) for x in val.all())
+    elif callable(val):
+        val = val()
+    if isinstance(val, Model):
+        val = force_text(val)
+    elif isinstance(val, bool):
+        val = {True: _('Yes'), False: _('No')}[val]
+    elif val is None:
+        val = _('Unknown')
+    if six.PY2 and type(val) is six.text_type and format != 'ods':
+        val = val.encode(charset)
+    return val
+
+
+def legacy_export_row(item, fields, format, charset):
+    return [legacy_export_value(getattr(item, field), format, charset) for field in fields]
+
+
+def legacy_fieldvalues(item, fields):
+    """
+    `FieldInfoMixin.fieldvalues` before `RowExtractor`
+    """
+    values = []
+    for f in fields:
+        r = getattr(item, f)
+        if type(r) is types.MethodType:
+            r = r()
+        values.append(r)
+    return values
+
+
+class Command(BaseCommand):
+    help = 'Benchmark RowExtractor against the former per-cell value conversion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--fields', default=None,
+                            help='comma separated field names (default: list_display or all fields)')
+        parser.add_argument('--rows', type=int, default=1000, help='rows to load (default: 1000)')
+        parser.add_argument('--repeat', type=int, default=5, help='runs, the best counts (default: 5)')
+        parser.add_argument('--format', default='csv', help='export format (default: csv)')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as ex:
+            raise CommandError(force_text(ex))
+        if options['fields']:
+            fields = [f.strip() for f in options['fields'].split(',') if f.strip()]
+        else:
+            fields = list(getattr(model, 'list_display', None)
+                          or [f.name for f in model._meta.concrete_fields])
+        select, prefetch = related_lookups(model, fields)
+        rows = list(model._base_manager.select_related(*select).prefetch_related(*prefetch)[:options['rows']])
+        if not rows:
+            raise CommandError('%s has no rows to benchmark' % model._meta.label)
+        format, charset = options['format'], 'utf-8'
+
+        export_extractor = RowExtractor(model, fields, format, charset)
+        raw_extractor = RowExtractor(model, fields)
+        cases = [
+            ('export, per cell', lambda: [legacy_export_row(row, fields, format, charset) for row in rows]),
+            ('export, RowExtractor', lambda: [export_extractor(row) for row in rows]),
+            ('list, per cell', lambda: [legacy_fieldvalues(row, fields) for row in rows]),
+            ('list, RowExtractor', lambda: [raw_extractor(row) for row in rows]),
+        ]
+        self.stdout.write('%s: %d rows, fields %s' % (model._meta.label, len(rows), ', '.join(fields)))
+        results = {}
+        for name, run in cases:
+            run()  # warm up (translations, prefetch caches)
+            best = None
+            for _i in range(max(1, options['repeat'])):
+                start = default_timer()
+                run()
+                elapsed = default_timer() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = best
+            self.stdout.write('%-22s %8.2f us/row' % (name, best * 1e6 / len(rows)))
+        for kind in ('export', 'list'):
+            new = results['%s, RowExtractor' % kind]
+            if new:
+                self.stdout.write('%s speedup: %.2fx' % (kind, results['%s, per cell' % kind] / new))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Remove files of expired export jobs (see `dorsale.exportjobs`).
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand
+from dorsale.exportjobs import cleanup_export_files, export_root
+
+
+class Command(BaseCommand):
+    help = 'Remove export files whose jobs expired.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='seconds (default: DORSALE_EXPORT_JOB_TIMEOUT)')
+
+    def handle(self, *args, **options):
+        count = cleanup_export_files(options['max_age'])
+        self.stdout.write('Removed %d export files from %s.' % (count, export_root()))
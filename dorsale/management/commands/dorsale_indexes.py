@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Report dorsale models that lack the default (site, deleted, ...) indexes,
+optionally create them and show query plans before and after.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.encoding import force_text
+from dorsale.conf import settings
+from dorsale.indexes import (PARTIAL_INDEX_VENDORS, declares_indexes, default_index_fields,
+                             index_name, is_indexed_model, partial_index_fields)
+
+EXPLAIN = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'mysql': 'EXPLAIN ',
+}
+
+
+class Command(BaseCommand):
+    help = 'Report dorsale models without indexes on (site, deleted, ...), optionally create them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='*',
+                            help='only models of these apps')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='database alias (default: "default")')
+        parser.add_argument('--create', action='store_true', default=False,
+                            help='create missing indexes that Meta.indexes doesn’t declare (partial where supported)')
+        parser.add_argument('--explain', action='store_true', default=False,
+                            help='show query plans (before and after --create)')
+
+    def handle(self, *app_labels, **options):
+        app_labels = options.get('app_label') or app_labels
+        self.connection = connections[options['database']]
+        self.using = options['database']
+        self.verbosity = int(options.get('verbosity', 1))
+        self.partial = self.connection.vendor in PARTIAL_INDEX_VENDORS
+        try:
+            app_configs = [apps.get_app_config(label) for label in app_labels] \
+                if app_labels else apps.get_app_configs()
+        except LookupError as ex:
+            raise CommandError(force_text(ex))
+
+        missing_models = 0
+        for app_config in app_configs:
+            for model in app_config.get_models():
+                if not is_indexed_model(model):
+                    continue
+                missing = self.missing_indexes(model)
+                if not missing:
+                    if self.verbosity > 1:
+                        self.stdout.write('%s: ok' % model._meta.label)
+                    continue
+                missing_models += 1
+                self.stdout.write(self.style.NOTICE('%s: missing index on %s' % (
+                    model._meta.label, '; '.join(', '.join(fields) for fields in missing))))
+                if options['explain']:
+                    self.explain(model, missing, 'before')
+                if options['create']:
+                    for fields in missing:
+                        self.create_index(model, fields)
+                    if options['explain']:
+                        self.explain(model, missing, 'after')
+        if not missing_models:
+            self.stdout.write('All dorsale models have their default indexes.')
+        elif not options['create']:
+            self.stdout.write('Run with --create or add the indexes to your migrations.')
+
+    def columns(self, model, fields):
+        return [model._meta.get_field(name).column for name in fields]
+
+    def missing_indexes(self, model):
+        """
+        list of default index field tuples of `model` without a matching index
+        """
+        with self.connection.cursor() as cursor:
+            constraints = self.connection.introspection.get_constraints(cursor, model._meta.db_table)
+        indexed = [list(c['columns']) for c in constraints.values() if c.get('index') or c.get('unique')]
+        missing = []
+        for fields in default_index_fields(model):
+            columns = self.columns(model, fields)
+            partial_columns = self.columns(model, partial_index_fields(fields))
+            if [cols for cols in indexed
+                    if cols[:len(columns)] == columns or cols == partial_columns]:
+                continue
+            missing.append(fields)
+        return missing
+
+    def create_index(self, model, fields):
+        """
+        Create an index that isn’t declared in `Meta.indexes` (see `dorsale.indexes`):
+        a partial index (`WHERE deleted = false`) if the database supports it,
+        otherwise a composite index.
+        """
+        qn = self.connection.ops.quote_name
+        if declares_indexes():
+            self.stdout.write('  %s is declared in Meta.indexes, run makemigrations and migrate.'
+                              % index_name(model, fields))
+            return
+        if self.partial:
+            name = index_name(model, fields, 'live')
+            columns = self.columns(model, partial_index_fields(fields))
+            where = ' WHERE %s = false' % qn(model._meta.get_field('deleted').column)
+        else:
+            name = index_name(model, fields)
+            columns = self.columns(model, fields)
+            where = ''
+
+        sql = 'CREATE INDEX %s ON %s (%s)%s' % (
+            qn(name), qn(model._meta.db_table), ', '.join(qn(c) for c in columns), where)
+        if self.verbosity > 1:
+            self.stdout.write('  ' + sql)
+        with self.connection.schema_editor() as editor:
+            editor.execute(sql)
+        self.stdout.write('  created %s' % name)
+
+    def explain(self, model, missing, label):
+        prefix = EXPLAIN.get(self.connection.vendor)
+        if prefix is None:
+            self.stdout.write('  no query plans for %s' % self.connection.vendor)
+            return
+        for fields in missing:
+            qs = model._base_manager.using(self.using) \
+                .filter(site_id=settings.SITE_ID, deleted=False) \
+                .order_by(*fields[2:])[:getattr(settings, 'ITEMS_PER_PAGE', 10)]
+            sql, params = qs.query.sql_with_params()
+            with self.connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                rows = cursor.fetchall()
+            self.stdout.write('  plan %s (order by %s):' % (label, ', '.join(fields[2:])))
+            for row in rows:
+                self.stdout.write('    ' + ' '.join(force_text(col) for col in row))
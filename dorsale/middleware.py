@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from django.conf import settings
 from django.contrib.sites.models import Site
+from dorsale import local, sites
 # from django.http import HttpResponsePermanentRedirect
 
 
@@ -10,6 +11,9 @@ class MultiSiteMiddleware:
     Change SITE_ID according to the calling host.
 
     from http://groups.google.de/group/django-users/msg/157d6d1334a2e72b?pli=1
+
+    Deprecated: this changes the global `settings.SITE_ID` and thus isn’t
+    thread safe; use `RequestSiteMiddleware`.
     """
     def process_request(self, request):
         if request.path.startswith('/admin/'):
@@ -22,3 +26,44 @@ class MultiSiteMiddleware:
         except Site.DoesNotExist:
             pass  # default SITE_ID
             # return HttpResponsePermanentRedirect(settings.NO_SITE_REDIRECT)
+
+
+class RequestSiteMiddleware:
+    """
+    Set the current site according to the calling host,
+    only for the current request (see `dorsale.local`).
+
+    Hosts are resolved by an in-process map (see `dorsale.sites`),
+    so there’s no query per request. Unknown hosts get `settings.SITE_ID`.
+    """
+    def __init__(self):
+        sites.load_sites()  # warm up the host map
+
+    def process_request(self, request):
+        host = request.get_host().rsplit(':', 1)[0]  # strip port from hostname
+        local.set_current_site(sites.get_site_for_host(host))
+
+    def process_response(self, request, response):
+        local.set_current_site(None)
+        return response
+
+    def process_exception(self, request, exception):
+        local.set_current_site(None)
+
+
+class CurrentUserMiddleware:
+    """
+    Remember the request’s user in `dorsale.local`,
+    so that e.g. `DorsaleSiteManager.mine()` needs no user query.
+
+    Must come after `AuthenticationMiddleware`.
+    """
+    def process_request(self, request):
+        local.set_current_user(getattr(request, 'user', None))
+
+    def process_response(self, request, response):
+        local.clear()
+        return response
+
+    def process_exception(self, request, exception):
+        local.clear()
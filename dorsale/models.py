@@ -1,22 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
-import six
-import types
-from operator import attrgetter
 # from django.conf import settings
-from collections import Counter, OrderedDict
 from django.contrib.auth.models import User
 # from django.contrib.contenttypes.models import ContentType
 # from django.contrib.sites.models import Site
-from django.db import models, router, transaction
-from django.db.models import signals, sql
-from django.db.models.fields.related import RECURSIVE_RELATIONSHIP_CONSTANT
-from django.db.models.deletion import Collector
+from django.db import models, router
+from django.db.models.signals import class_prepared
 from django.utils.translation import ugettext_lazy as _
 # from south.modelsinspector import add_introspection_rules
 from dorsale.conf import settings
+from dorsale import generations  # connects signal receivers
+from dorsale.deletion import SoftDeleteCollector
+from dorsale.extractors import get_extractor, table_rows
 # from managers import DorsaleSiteManager
+from collections import namedtuple
 import logging
 logger = logging.getLogger(settings.PROJECT_NAME)  # __name__)
 
@@ -27,7 +25,57 @@ except ImportError:
     now = datetime.now
 
 
-class AuthorMixin(models.Model):
+class DirtyFieldsMixin(models.Model):
+    """
+    Remember the field values as loaded from the database,
+    so that `save()` can write only changed fields (see `changed_fields`).
+
+    Changes within mutable values (e.g. a dict) aren’t detected,
+    assign a new value instead.
+    """
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DirtyFieldsMixin, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def snapshot(self):
+        """
+        Remember the current values of all loaded fields as saved.
+        """
+        self._loaded_values = dict(
+            (f.attname, getattr(self, f.attname))
+            for f in self._meta.concrete_fields if f.attname in self.__dict__)
+
+    def changed_fields(self):
+        """
+        Return a list of the attnames of fields that changed since loading
+        (or the last save), or `None` if nothing was loaded (new objects).
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            attname = field.attname
+            if attname in loaded:
+                if getattr(self, attname) != loaded[attname]:
+                    changed.append(attname)
+            elif attname in self.__dict__:  # was deferred, but got set
+                changed.append(attname)
+        return changed
+
+    def is_dirty(self):
+        changed = self.changed_fields()
+        return changed is None or bool(changed)
+
+
+class AuthorMixin(DirtyFieldsMixin):
     """
     Provide some automatic administration fields:
 
@@ -69,23 +117,41 @@ class AuthorMixin(models.Model):
         abstract = True
         get_latest_by = 'createdon'
 
+    audit_fields = ('lastchangedon', 'lastchangedby_id')  # : always saved with changes
+
     def save(self, *args, **kwargs):
         """
         Automatically save time of creation and change;
         can’t save the user, you must do that in your view
         (or use dorsale’s generic views)
 
+        Existing objects only save changed fields (plus `audit_fields`),
+        and nothing at all if nothing changed (see `DirtyFieldsMixin`).
+
         calls `super`
         """
-        if self.id:
+        user = kwargs.pop('user', None)  # not allowed in super
+        update_fields = kwargs.get('update_fields')
+        adding = self._state.adding or not self.pk
+        if adding:
             self.createdon = now()
-            if 'user' in kwargs:
-                self.createdby = kwargs['user']
+            if user is not None:
+                self.createdby = user
+        elif update_fields is None and not kwargs.get('force_insert'):
+            changed = self.changed_fields()
+            if changed is not None:
+                update_fields = [f for f in changed if f not in self.audit_fields]
+                if not update_fields:
+                    return
         self.lastchangedon = now()
-        if 'user' in kwargs:
-            self.lastchangedby = kwargs['user']
-            del kwargs['user'] # not allowed in super
+        if user is not None:
+            self.lastchangedby = user
+        if not adding and update_fields:
+            # deferred audit fields that weren’t set would get loaded first
+            kwargs['update_fields'] = set(update_fields) | set(
+                f for f in self.audit_fields if f in self.__dict__)
         super(AuthorMixin, self).save(*args, **kwargs)
+        self.snapshot()
 
     def original_save(self, *args, **kwargs):
         """
@@ -100,7 +166,12 @@ class AuthorMixin(models.Model):
 class FakeDeleteMixin(models.Model):
     """
     Add a `deleted` field and prohibit real deletion.
+
+    Rows that are deleted for longer than `archive_after_days`
+    (default: `settings.DORSALE_ARCHIVE_AFTER_DAYS`, `None`: never)
+    can be moved to archive files, see `dorsale.archive`.
     """
+    archive_after_days = None
     deleted = models.BooleanField(
         verbose_name=_('deleted?'),
         editable=False,
@@ -111,108 +182,90 @@ class FakeDeleteMixin(models.Model):
     class Meta:
         abstract = True
 
-    def delete(self, using=None, keep_parents=False, **kwargs):
+    def delete(self, using=None, keep_parents=False, bulk_signals=False, **kwargs):
         """
-        Mark this instance as deleted and call `delete()` on all related objects.
+        Mark this instance and all related objects as deleted.
+
+        The cascade is collected once and marked with one UPDATE per model
+        and batch (see `dorsale.deletion.SoftDeleteCollector`);
+        related models that aren’t `FakeDeleteMixin`s get really deleted.
+
+        :bulk_signals: send `dorsale.deletion.pre_soft_delete`/`post_soft_delete`
+            once per model and batch instead of `pre_delete`/`post_delete`
+            per related instance
 
         Don’t call `super`!
         """
         logger.info('DELETE %s' % self)
-        self.deleted = True
-        self.save(**kwargs)
-
-        # the following is copied from django.db.models.base.Model
-
         using = using or router.db_for_write(self.__class__, instance=self)
         assert self._get_pk_val() is not None, (
             "%s object can't be deleted because its %s attribute is set to None." %
             (self._meta.object_name, self._meta.pk.attname)
         )
+        self.deleted = True
+        self.save(**kwargs)
 
-        # Find all the related objects that need to be deleted.
-        collector = Collector(using=using)
+        collector = SoftDeleteCollector(using=using,
+                                        bulk_signals=bulk_signals,
+                                        user=kwargs.get('user'))
         collector.collect([self], keep_parents=keep_parents)
-        #return collector.delete()
+        # we’re already saved
+        collector.discard(self)
+        return collector.delete()
 
-        # remove self from deletion collection
-        myself_and_friends = collector.data[type(self)].remove(self)
-        if myself_and_friends:
-            collector.data[type(self)] = myself_and_friends
+
+Column = namedtuple('Column', ['name', 'field', 'verbose_name', 'help_text'])  # : header of `FieldInfoMixin.tabulate`
+Table = namedtuple('Table', ['columns', 'rows'])  # : result of `FieldInfoMixin.tabulate`
+
+
+class FieldInfo(object):
+    """
+    Field metadata of a `FieldInfoMixin` model, built once per class
+    (see `get_field_info`).
+    """
+    def __init__(self, model):
+        self.fields = model._meta.fields  # : to notice changes of the model’s fields
+        self.field_info = dict((f.name, f) for f in self.fields)
+        self.list_display = tuple(model.list_display)
+        if self.list_display:
+            self.columns = tuple((n, self.field_info.get(n)) for n in self.list_display)
         else:
-            del collector.data[type(self)]
-
-        # Problem: collector.delete() doesn’t call object’s delete method, but deletes!
-
-        # The following is copied from collector.delete() (db.models.deletion)
-        
-        # sort instance collections
-        for model, instances in collector.data.items():
-            collector.data[model] = sorted(instances, key=attrgetter("pk"))
-
-        # if possible, bring the models in an order suitable for databases that
-        # don't support transactions or cannot defer constraint checks until the
-        # end of a transaction.
-        collector.sort()
-        # number of objects deleted for each model label
-        deleted_counter = Counter()
-
-        with transaction.atomic(using=collector.using, savepoint=False):
-            # send pre_delete signals
-            for model, obj in collector.instances_with_model():
-                if not model._meta.auto_created:
-                    signals.pre_delete.send(
-                        sender=model, instance=obj, using=collector.using
-                    )
-
-            ## fast deletes
-            #for qs in collector.fast_deletes:
-            #    count = qs._raw_delete(using=collector.using)
-            #    deleted_counter[qs.model._meta.label] += count
-
-            # update fields
-            for model, instances_for_fieldvalues in six.iteritems(collector.field_updates):
-                query = sql.UpdateQuery(model)
-                for (field, value), instances in six.iteritems(instances_for_fieldvalues):
-                    query.update_batch([obj.pk for obj in instances],
-                                       {field.name: value}, collector.using)
-
-            # reverse instance collections
-            for instances in six.itervalues(collector.data):
-                instances.reverse()
-
-            # delete instances
-            for model, instances in six.iteritems(collector.data):
-                if not issubclass(model, FakeDeleteMixin):
-                # handle non-cerebrale models as usual
-                    query = sql.DeleteQuery(model)
-                    pk_list = [obj.pk for obj in instances]
-                    count = query.delete_batch(pk_list, collector.using)
-                    deleted_counter[model._meta.label] += count
-                else:
-                    for inst in instances:
-                        inst.delete()  # expensive operation!
-
-                if not model._meta.auto_created:
-                    for obj in instances:
-                        signals.post_delete.send(
-                            sender=model, instance=obj, using=collector.using
-                        )
-
-        # update collected instances
-        for model, instances_for_fieldvalues in six.iteritems(collector.field_updates):
-            for (field, value), instances in six.iteritems(instances_for_fieldvalues):
-                for obj in instances:
-                    setattr(obj, field.attname, value)
-        for model, instances in six.iteritems(collector.data):
-            for instance in instances:
-                setattr(instance, model._meta.pk.attname, None)
-        return sum(deleted_counter.values()), dict(deleted_counter)
+            self.columns = tuple((f.name, f) for f in self.fields if f.editable)
+        self.fieldnames = [n for n, f in self.columns]
+        self.verbose_names = tuple(
+            f.verbose_name if f is not None else self.attribute_verbose_name(model, n)
+            for n, f in self.columns)
+        self.table_columns = tuple(
+            Column(n, f, v, getattr(f, 'help_text', ''))
+            for (n, f), v in zip(self.columns, self.verbose_names))
+
+    @staticmethod
+    def attribute_verbose_name(model, name):
+        attr = getattr(model, name, None)
+        return getattr(attr, 'verbose_name', None) \
+            or getattr(attr, 'short_description', None) \
+            or name
+
+
+def get_field_info(model):
+    """
+    Return the (cached) `FieldInfo` of `model`;
+    rebuilt if the model’s fields changed (e.g. on app registry reload).
+    """
+    info = model.__dict__.get('_dorsale_field_info')
+    if info is None or info.fields is not model._meta.fields \
+            or info.list_display != tuple(model.list_display):
+        info = FieldInfo(model)
+        setattr(model, '_dorsale_field_info', info)
+    return info
 
 
 class FieldInfoMixin(models.Model):
 
     items_per_page = int(getattr(settings, 'ITEMS_PER_PAGE', 10))  # : used in list views, overwrite in your models
     list_display = []  # : for list views, ignore if empty
+    count_strategy = None  # : list views: 'exact', 'cached', 'estimate' or 'none' (default: settings.DORSALE_COUNT_STRATEGY)
+    keyset_pagination = False  # : list views page with ?after=/?before= cursors instead of ?page=, for large tables
 
     class Meta:
         abstract = True
@@ -224,69 +277,64 @@ class FieldInfoMixin(models.Model):
 
         {name:field,}
         """
-        try:
-            return self._field_info
-        except:
-            self._field_info = {}
-            for n in self._meta.fields:
-                if hasattr(n, 'name'):
-                    self._field_info[n.name] = n
-            return self._field_info
+        return get_field_info(type(self)).field_info
 
     def fields(self):
         """
         generator of the model’s (editable) fields,
         as defined by its `list_display` attribute
         """
-        if self.list_display:
-            for n in self.list_display:
-                if n in self.field_info():
-                    yield self.field_info()[n]
-                else:
-                    yield getattr(self, n, '')
-        else:
-            for n in self._meta.fields:
-                if not n.editable:
-                    continue
-                yield n
+        for n, f in get_field_info(type(self)).columns:
+            if f is None:
+                yield getattr(self, n, '')
+            else:
+                yield f
 
     def fieldnames_verbose(self):
         """
         generator of verbose (translated) names of the model’s fields,
         as defined by its `list_display` attribute
         """
-        if self.list_display:
-            for n in self.list_display:
-                r = self.getattr(n)
-                if hasattr(r, 'verbose_name'):
-                    r = r.verbose_name
-                yield r
-        else:
-            for f in self._meta.fields:
-                if not f.editable:
-                    continue
-                yield f.verbose_name
+        for r in get_field_info(type(self)).verbose_names:
+            yield r
 
     def fieldnames(self):
         """
         list of raw names of the model’s fields,
         as defined by its `list_display` attribute
         """
-        if self.list_display:
-            return self.list_display
-        return [f.name for f in self._meta.fields if f.editable]
+        return list(get_field_info(type(self)).fieldnames)
+
+    @classmethod
+    def tabulate(cls, queryset, fields=None):
+        """
+        Return a `Table` of `queryset` (or list of instances, e.g. a page):
+        `columns` (list of `Column`: name, field, verbose_name, help_text)
+        and `rows` (list of tuples (pk, values)), with a fixed number
+        of queries (see `dorsale.extractors.table_rows`).
+
+        :fields: list of field (or method) names, default: `fieldnames()`
+        """
+        info = get_field_info(cls)
+        if fields is None:
+            columns = info.table_columns
+        else:
+            columns = []
+            for n in fields:
+                f = info.field_info.get(n)
+                v = f.verbose_name if f is not None else FieldInfo.attribute_verbose_name(cls, n)
+                columns.append(Column(n, f, v, getattr(f, 'help_text', '')))
+        return Table(list(columns), table_rows(queryset, [c.name for c in columns]))
 
     def fieldvalues(self):
         """
         generator of the instance’s field (or method) values,
         dependent of `fieldnames`
+
+        uses the model’s cached `dorsale.extractors.RowExtractor`
         """
-        for f in self.fieldnames():
-            r = getattr(self, f)
-            if type(r) is types.MethodType:
-                r = r()
+        for r in get_extractor(type(self), get_field_info(type(self)).fieldnames)(self):
             yield r
-        # return (getattr(self, f) for f in self.fieldnames())
 
     def classname(self):
         """
@@ -299,3 +347,10 @@ class FieldInfoMixin(models.Model):
         verbose (translated) plural name of this model
         """
         return self._meta.verbose_name_plural
+
+
+def prepare_field_info(sender, **kwargs):
+    if issubclass(sender, FieldInfoMixin):
+        get_field_info(sender)
+
+class_prepared.connect(prepare_field_info, dispatch_uid='dorsale.models.prepare_field_info')
@@ -1,9 +1,99 @@
 # -*- coding: utf-8 -*-
-from dorsale.managers import DorsaleSiteManager, DorsaleGroupSiteManager
+from __future__ import absolute_import
+from __future__ import unicode_literals
 from mptt.managers import TreeManager
+from dorsale.generations import bump_generation
+from dorsale.mptt.trees import get_tree
+from siteprofile.managers import DorsaleQuerySet, DorsaleSiteManager, DorsaleGroupSiteManager
+try:
+    from mptt.querysets import TreeQuerySet
+except ImportError:  # django-mptt < 0.7
+    from django.db.models.query import QuerySet as TreeQuerySet
 
-class DorsaleMPTTSiteManager(TreeManager, DorsaleSiteManager):
-    pass
 
-class DorsaleMPTTGroupSiteManager(TreeManager, DorsaleGroupSiteManager):
-    pass
+class DorsaleMPTTQuerySet(TreeQuerySet, DorsaleQuerySet):
+    """
+    QuerySet for dorsale MPTT models: tree methods and `soft_delete`.
+    """
+    def without_deleted_subtrees(self):
+        """
+        Exclude deleted nodes; `DorsaleMPTTBaseModel.delete` marks
+        whole subtrees, so their descendants are excluded as well.
+        """
+        return self.filter(deleted=False)
+
+
+class CachedTreeMixin(object):
+    """
+    Manager methods for cached trees (see `dorsale.mptt.trees`).
+    """
+    def cached_tree(self, user=None, fields=()):
+        """
+        Return a `CachedTree` of the current site’s not deleted nodes,
+        with `user`: of `mine(user)`, shared by users with the same `mine_fingerprint`
+        (anonymous and inactive users share an empty tree; managers with their own
+        `mine_queryset` cache one tree per user).
+
+        :fields: names of fields whose values get cached, e.g. ('name',)
+        """
+        if user is None:
+            return get_tree(self.get_queryset(), 'all', fields)
+        return get_tree(self.mine(user), self.mine_fingerprint(user), fields)
+
+    def all_nodes(self):
+        """
+        plain `TreeManager` of all rows: tree IDs are shared by
+        all sites and deleted subtrees, so tree operations need them all
+        """
+        manager = TreeManager()
+        manager.model = self.model
+        manager.tree_model = self.tree_model
+        manager._base_manager = None
+        manager._db = self._db
+        return manager
+
+    def rebuild(self):
+        """
+        Rebuild the trees of all sites; deleted subtrees have no parent,
+        so they stay trees of their own.
+        """
+        self.all_nodes().rebuild()
+        bump_generation(self.model)
+    rebuild.alters_data = True
+
+    def partial_rebuild(self, tree_id):
+        self.all_nodes().partial_rebuild(tree_id)
+        bump_generation(self.model)
+    partial_rebuild.alters_data = True
+
+    def _create_tree_space(self, target_tree_id, num_trees=1):
+        self.all_nodes()._create_tree_space(target_tree_id, num_trees)
+
+    def _get_next_tree_id(self):
+        return self.all_nodes()._get_next_tree_id()
+
+
+class DorsaleMPTTSiteManager(CachedTreeMixin, TreeManager, DorsaleSiteManager):
+    """
+    `DorsaleSiteManager` for MPTT trees; querysets are `DorsaleMPTTQuerySet`s.
+
+    `cached_tree(user)` reads the whole tree from cache.
+    """
+    _queryset_class = DorsaleMPTTQuerySet
+    use_in_migrations = False  # migrations can’t build MPTT managers
+
+    def without_deleted_subtrees(self):
+        return self.get_queryset().without_deleted_subtrees()
+
+
+class DorsaleMPTTGroupSiteManager(CachedTreeMixin, TreeManager, DorsaleGroupSiteManager):
+    """
+    `DorsaleGroupSiteManager` for MPTT trees; querysets are `DorsaleMPTTQuerySet`s.
+
+    `cached_tree(user)` reads the tree of the user’s groups from cache.
+    """
+    _queryset_class = DorsaleMPTTQuerySet
+    use_in_migrations = False  # migrations can’t build MPTT managers
+
+    def without_deleted_subtrees(self):
+        return self.get_queryset().without_deleted_subtrees()
@@ -1,25 +1,80 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
-from dorsale.models import DorsaleBaseModel
+from django.core import checks
+from django.db import router, transaction
+from django.db.models import Max
+from dorsale.deletion import SoftDeleteCollector, pre_soft_delete, post_soft_delete
+from dorsale.generations import bump_generation
+from mptt.models import MPTTModel
+from siteprofile.models import DorsaleBaseModel
+import logging
+logger = logging.getLogger(__name__)
 
 
-class DorsaleMPTTBaseModel(DorsaleBaseModel): 
+class SubtreeCollector(SoftDeleteCollector):
+    """
+    `SoftDeleteCollector` that marks a whole MPTT subtree as deleted
+    with one UPDATE on its `tree_id`/`lft`/`rght` range,
+    instead of batches of primary keys.
+    Other collected nodes (e.g. by cascades) get marked by primary key.
+    """
+    def __init__(self, node, **kwargs):
+        super(SubtreeCollector, self).__init__(**kwargs)
+        self.node = node
+        self.tree_model = node._meta.concrete_model
+        self.subtree_pks = set()
+
+    def subtree(self):
+        opts = self.node._mptt_meta
+        return self.tree_model._base_manager.using(self.using).filter(**{
+            opts.tree_id_attr: getattr(self.node, opts.tree_id_attr),
+            opts.left_attr + '__gte': getattr(self.node, opts.left_attr),
+            opts.right_attr + '__lte': getattr(self.node, opts.right_attr),
+        })
+
+    def collect_subtree(self, keep_parents=False):
+        """
+        Collect the node, its descendants and their related objects.
+        """
+        nodes = list(self.subtree())
+        self.subtree_pks = set(node.pk for node in nodes)
+        self.collect(nodes, keep_parents=keep_parents)
+
+    def mark_deleted(self, model, pk_list):
+        if model is not self.tree_model:
+            return super(SubtreeCollector, self).mark_deleted(model, pk_list)
+        in_subtree = [pk for pk in pk_list if pk in self.subtree_pks]
+        count = super(SubtreeCollector, self).mark_deleted(
+            model, [pk for pk in pk_list if pk not in self.subtree_pks])
+        if in_subtree:
+            if self.bulk_signals:
+                pre_soft_delete.send(sender=model, pk_set=in_subtree, using=self.using)
+            count += self.subtree().update(**self.soft_values(model))
+            if self.bulk_signals:
+                post_soft_delete.send(sender=model, pk_set=in_subtree, using=self.using)
+        return count
+
+
+class DorsaleMPTTBaseModel(DorsaleBaseModel):
     """
     Base model for multiple inheritance from `DorsaleBaseModel` and `MPTTModel`.
-    
+
     i.e.:
 
         from mptt.models import MPTTModel
 
-        class MyModel(MPTTModel, DorsaleBaseModel):
+        class MyModel(DorsaleMPTTBaseModel, MPTTModel):
             name = models.CharField(verbose_name=_('Name'), max_length=63, unique=True)
-            parent = models.ForeignKey('self', null=True, blank=True, related_name='children')
-            tree = DorsaleMPTTSiteManager()
-        
-        mptt.register(MyModel)
-    
+            parent = TreeForeignKey('self', null=True, blank=True, related_name='children')
+            objects = DorsaleMPTTSiteManager()
+
     Like with MPTTModel, you must define a 'parent' field which is a ForeignKey to 'self', see django-mptt docs!
+
+    `DorsaleMPTTBaseModel` must come before `MPTTModel` (checked by `manage.py check`),
+    else `MPTTModel.delete` closes the gap of the subtree before it gets marked.
+
+    Default indexes (see `dorsale.indexes`) include (site, deleted, tree_id, lft).
     """
     class Meta:
         abstract = True
@@ -30,18 +85,67 @@ class DorsaleMPTTBaseModel(DorsaleBaseModel):
         """
         super(DorsaleMPTTBaseModel, self).save(*args, **kwargs)
 
-    def delete(self, using=None, *args, **kwargs):
+    @classmethod
+    def check(cls, **kwargs):
+        errors = super(DorsaleMPTTBaseModel, cls).check(**kwargs)
+        mro = cls.__mro__
+        if MPTTModel in mro and mro.index(MPTTModel) < mro.index(DorsaleMPTTBaseModel):
+            errors.append(checks.Error(
+                'DorsaleMPTTBaseModel must come before MPTTModel in the bases of %s.' % cls.__name__,
+                hint='Else deleting a node corrupts the tree.',
+                obj=cls, id='dorsale.E001'))
+        return errors
+
+    def delete(self, using=None, keep_parents=False, bulk_signals=False, **kwargs):
         """
-        mark this instance as deleted and call delete() on all related objects
-        
+        Mark this node, all its descendants and their related objects as deleted
+        (see `soft_delete_subtree`).
+
         doesn’t call `super`!
         """
-        # copied from MPTTModel (we need the same behaviour, just without calling super)
-        tree_width = (self._mpttfield('right') -
-                      self._mpttfield('left') + 1)
-        target_right = self._mpttfield('right')
-        tree_id = self._mpttfield('tree_id')
-        self._tree_manager._close_gap(tree_width, target_right, tree_id)
-        
-        # mark as deleted and delete all children
-        DorsaleBaseModel.delete(self, using, *args, **kwargs)
+        return self.soft_delete_subtree(using=using, keep_parents=keep_parents,
+                                        bulk_signals=bulk_signals, user=kwargs.get('user'))
+
+    def soft_delete_subtree(self, using=None, keep_parents=False, bulk_signals=False, user=None):
+        """
+        Mark this node and all its descendants as deleted with one UPDATE
+        on the node’s `lft`/`rght` range; related objects of all nodes
+        get (soft) deleted like by `FakeDeleteMixin.delete`.
+
+        The deleted subtree becomes a tree of its own (its root loses its
+        `parent`), so the gap in the live tree gets closed once, the deleted
+        nodes don’t overlap with live ones and rebuilds keep them apart.
+
+        Return a tuple (number of affected rows, {model label: number}).
+        """
+        opts = self._mptt_meta
+        using = using or router.db_for_write(self.__class__, instance=self)
+        assert self._get_pk_val() is not None, (
+            "%s object can't be deleted because its %s attribute is set to None." %
+            (self._meta.object_name, self._meta.pk.attname)
+        )
+        logger.info('DELETE subtree of %s' % self)
+
+        parent_id = getattr(self, self._meta.get_field(opts.parent_attr).attname)
+        with transaction.atomic(using=using):
+            collector = SubtreeCollector(self, using=using, bulk_signals=bulk_signals, user=user)
+            collector.collect_subtree(keep_parents=keep_parents)
+            result = collector.delete()
+
+            if parent_id is not None:
+                # move the deleted subtree out of the live tree, closing the gap once
+                left = getattr(self, opts.left_attr)
+                level = getattr(self, opts.level_attr)
+                new_tree_id = (self.__class__._base_manager.using(using)
+                               .aggregate(m=Max(opts.tree_id_attr))['m'] or 0) + 1
+                self.__class__._tree_manager._inter_tree_move_and_close_gap(
+                    self, level, left - 1, new_tree_id)
+                setattr(self, opts.parent_attr, None)
+                setattr(self, opts.right_attr, getattr(self, opts.right_attr) - left + 1)
+                setattr(self, opts.left_attr, 1)
+                setattr(self, opts.level_attr, 0)
+                setattr(self, opts.tree_id_attr, new_tree_id)
+        if parent_id is not None:
+            bump_generation(self.__class__)  # the live tree changed
+        self.deleted = True
+        return result
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Cached, compact copies of dorsale MPTT trees.
+
+    tree = Category.objects.cached_tree(request.user, fields=('name',))
+    for pk in tree.children(pk):
+        tree.values(pk)  # ('name',)
+
+A `CachedTree` holds the visible nodes of one site (and group set) in tree
+order as parallel arrays of (pk, parent index, level, tree_id, lft, rght),
+plus optional field values; ancestors, descendants and children get looked
+up in memory, without queries and without model instances.
+
+Trees are kept in Django’s cache under a key with the model’s generation
+(see `dorsale.generations`), so saves, soft deletes, moves and rebuilds
+invalidate them. Changes by `QuerySet.update()` need `bump_generation`.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import hashlib
+from array import array
+from django.core.cache import cache
+from dorsale import local
+from dorsale.conf import settings
+from dorsale.generations import bump_generation, get_generation
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from mptt.signals import node_moved
+except ImportError:  # django-mptt < 0.6
+    node_moved = None
+
+TREE_KEY = 'dorsale:tree:%s:%s:%s'
+
+
+class CachedTree(object):
+    """
+    Nodes of a tree queryset in tree order; all lookups take and return primary keys.
+
+    A node whose parent isn’t visible (e.g. other group) hangs below its nearest
+    visible ancestor, or is a root.
+    """
+    def __init__(self, rows, fields=()):
+        """
+        :rows: iterable of (pk, tree_id, lft, rght, level, *values), ordered by tree_id, lft
+        :fields: names of the values
+        """
+        self.fields = tuple(fields)
+        self.pks = []
+        self.parents = array('l')
+        self.levels = array('l')
+        self.tree_ids = array('l')
+        self.lefts = array('l')
+        self.rights = array('l')
+        self.rows = []
+        stack = []  # indexes of the open ancestors of the current row
+        for i, row in enumerate(rows):
+            pk, tree_id, left, right, level = row[:5]
+            while stack and (self.tree_ids[stack[-1]] != tree_id or self.rights[stack[-1]] < left):
+                stack.pop()
+            self.pks.append(pk)
+            self.parents.append(stack[-1] if stack else -1)
+            self.levels.append(level)
+            self.tree_ids.append(tree_id)
+            self.lefts.append(left)
+            self.rights.append(right)
+            if self.fields:
+                self.rows.append(tuple(row[5:]))
+            stack.append(i)
+        self.pks = tuple(self.pks)
+        self._index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_index'] = None  # rebuilt on demand, smaller pickles
+        return state
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __contains__(self, pk):
+        return pk in self.index
+
+    @property
+    def index(self):
+        """
+        {pk: position}
+        """
+        if self._index is None:
+            self._index = dict((pk, i) for i, pk in enumerate(self.pks))
+        return self._index
+
+    def end(self, i):
+        """
+        position after the last descendant of position `i`
+        """
+        tree_id, right = self.tree_ids[i], self.rights[i]
+        j = i + 1
+        while j < len(self.pks) and self.tree_ids[j] == tree_id and self.lefts[j] < right:
+            j += 1
+        return j
+
+    def roots(self):
+        return [pk for pk, parent in zip(self.pks, self.parents) if parent == -1]
+
+    def parent(self, pk):
+        """
+        pk of the (visible) parent of `pk`, or `None`
+        """
+        parent = self.parents[self.index[pk]]
+        return self.pks[parent] if parent >= 0 else None
+
+    def children(self, pk):
+        i = self.index[pk]
+        return [self.pks[j] for j in range(i + 1, self.end(i)) if self.parents[j] == i]
+
+    def descendants(self, pk, include_self=False):
+        i = self.index[pk]
+        return list(self.pks[i if include_self else i + 1:self.end(i)])
+
+    def ancestors(self, pk, include_self=False):
+        """
+        pks from the root down to `pk`’s parent (or `pk`)
+        """
+        i = self.index[pk]
+        result = []
+        if include_self:
+            result.append(pk)
+        i = self.parents[i]
+        while i >= 0:
+            result.append(self.pks[i])
+            i = self.parents[i]
+        result.reverse()
+        return result
+
+    def level(self, pk):
+        return self.levels[self.index[pk]]
+
+    def values(self, pk):
+        """
+        tuple of the cached field values of `pk`
+        """
+        return self.rows[self.index[pk]]
+
+
+def tree_cache_key(model, fingerprint, fields=()):
+    """
+    Key of the cached tree of `model` for the current site, users with
+    `fingerprint` (see `mine_fingerprint`) and cached `fields`.
+    """
+    key = '%s:%s:%s' % (local.get_current_site_id(), fingerprint, ','.join(fields))
+    return TREE_KEY % (model._meta.label_lower, get_generation(model),
+                       hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def build_tree(queryset, fields=()):
+    """
+    `CachedTree` of `queryset` (of an MPTT model) with the values of `fields`, one query.
+    """
+    opts = queryset.model._mptt_meta
+    rows = queryset.order_by(opts.tree_id_attr, opts.left_attr).values_list(
+        'pk', opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr, *fields)
+    return CachedTree(rows.iterator(), fields)
+
+
+def get_tree(queryset, fingerprint, fields=()):
+    """
+    cached `CachedTree` of `queryset`, that must be the same
+    for all users with `fingerprint` on the current site
+    """
+    timeout = int(getattr(settings, 'DORSALE_TREE_CACHE_TIMEOUT', 3600))
+    if not timeout:
+        return build_tree(queryset, fields)
+    key = tree_cache_key(queryset.model, fingerprint, fields)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree(queryset, fields)
+        cache.set(key, tree, timeout)
+    return tree
+
+
+def tree_changed(sender, **kwargs):
+    bump_generation(sender)
+
+if node_moved is not None:
+    # `TreeManager.move_node` doesn’t save
+    node_moved.connect(tree_changed, dispatch_uid='dorsale.mptt.trees.moved')
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Paginators for large tables.
+
+Keyset (seek) pagination: instead of `COUNT(*)` and `OFFSET n`,
+pages are found by comparing with the ordering values of the last
+(or first) row of the previous page, so deep pages cost the same as the first.
+
+Cursors are opaque, signed tokens for `?after=` and `?before=`.
+The ordering columns should be indexed and shouldn’t contain NULLs.
+
+Count strategies for page number pagination (see `get_paginator_class`):
+
+:exact: `django.core.paginator.Paginator`, `COUNT(*)` per request
+:cached: `CachedCountPaginator`, exact count, cached until the model changes
+:estimate: `EstimatedCountPaginator`, the database’s estimate for huge tables
+:none: `NoCountPaginator`, no count at all, just "is there a next page?"
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import six
+import json
+import hashlib
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
+from django.db import connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.sql import Query
+from django.utils.functional import cached_property
+from dorsale.conf import settings
+from dorsale.generations import get_generation
+from dorsale.tools import class_from_name
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:  # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+CURSOR_SALT = 'dorsale.pagination'
+
+
+class KeysetPage(object):
+    """
+    One page of a `KeysetPaginator`, similar to `django.core.paginator.Page`.
+    """
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<KeysetPage of %d items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.make_cursor(self.object_list[-1])
+        return ''
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.make_cursor(self.object_list[0])
+        return ''
+
+
+class KeysetPaginator(object):
+    """
+    Paginate `queryset` by `ordering` (list of field names, optionally
+    with '-'; the primary key gets added as tie breaker).
+
+    Foreign keys are ordered by their ID (not by the related model’s ordering),
+    fields without a column (many-to-many, reverse relations) raise `FieldError`.
+    """
+    def __init__(self, queryset, ordering, per_page):
+        self.model = queryset.model
+        self.per_page = int(per_page)
+        self.ordering = [self.seek_name(o) for o in ordering if o]
+        pk_name = self.model._meta.pk.name
+        if not [o for o in self.ordering if o.lstrip('-') in (pk_name, 'pk', 'id')]:
+            self.ordering.append(pk_name)
+        self.columns = [(o.lstrip('-'), o.startswith('-')) for o in self.ordering]
+        self.queryset = queryset.order_by(*self.ordering)
+
+    def seek_name(self, name):
+        """
+        ordering `name` as column to compare with: foreign keys by their ID
+        """
+        field = self.field(name.lstrip('-'))
+        if field is None:
+            return name
+        if field.many_to_many or not field.concrete:
+            raise FieldError("Can’t paginate by '%s' with cursors." % name.lstrip('-'))
+        return name[:len(name) - len(name.lstrip('-'))] + field.attname
+
+    def field(self, name):
+        """
+        model field of ordering column `name` or `None` (for lookups like 'a__b')
+        """
+        if name == 'pk':
+            return self.model._meta.pk
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def value(self, obj, name):
+        """
+        value of ordering column `name` of `obj`, like the database compares it
+        """
+        field = self.field(name)
+        if field is not None:
+            return getattr(obj, field.attname)  # FK: ID
+        for part in name.split('__'):
+            obj = getattr(obj, part, None)
+        return obj
+
+    def make_cursor(self, obj):
+        values = []
+        for name, desc in self.columns:
+            val = self.value(obj, name)
+            if val is not None and not isinstance(val, six.integer_types + (float,) + six.string_types):
+                val = six.text_type(val)
+            values.append(val)
+        return signing.dumps([self.ordering, values], salt=CURSOR_SALT, compress=True)
+
+    def read_cursor(self, cursor):
+        """
+        list of values from `cursor`, or `None` if it’s invalid
+        or was made for another ordering
+        """
+        try:
+            ordering, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, ValueError, TypeError):
+            logger.info('Invalid pagination cursor')
+            return None
+        if ordering != self.ordering or len(values) != len(self.columns):
+            return None
+        result = []
+        for (name, desc), val in zip(self.columns, values):
+            field = self.field(name)
+            if val is not None and field is not None:
+                if field.is_relation:
+                    field = field.target_field
+                val = field.to_python(val)
+            result.append(val)
+        return result
+
+    def seek_filter(self, values, forward):
+        """
+        Q object for rows after (`forward`) or before the row with `values`
+        """
+        condition = Q()
+        equal = Q()
+        for (name, desc), val in zip(self.columns, values):
+            if val is None:
+                equal &= Q(**{name + '__isnull': True})
+                continue
+            lookup = 'gt' if forward != desc else 'lt'
+            condition |= equal & Q(**{'%s__%s' % (name, lookup): val})
+            equal &= Q(**{name: val})
+        return condition
+
+    def page(self, after=None, before=None):
+        """
+        Return the `KeysetPage` after cursor `after` or before cursor `before`,
+        or the first page.
+        """
+        cursor = after or before
+        values = self.read_cursor(cursor) if cursor else None
+        if values is None:
+            objs = list(self.queryset[:self.per_page + 1])
+            return KeysetPage(objs[:self.per_page], self, len(objs) > self.per_page, False)
+        if after:
+            objs = list(self.queryset.filter(self.seek_filter(values, True))[:self.per_page + 1])
+            return KeysetPage(objs[:self.per_page], self, len(objs) > self.per_page, True)
+        reverse = [o[1:] if o.startswith('-') else '-' + o for o in self.ordering]
+        objs = list(self.queryset.filter(self.seek_filter(values, False))
+                    .order_by(*reverse)[:self.per_page + 1])
+        has_previous = len(objs) > self.per_page
+        objs = objs[:self.per_page]
+        objs.reverse()
+        return KeysetPage(objs, self, True, has_previous)
+
+
+def split_ordering(orderby):
+    """
+    list of ordering names from "country,-city" (or a list)
+    """
+    if isinstance(orderby, six.string_types):
+        return orderby.split(',')
+    return list(orderby)
+
+
+def check_ordering(model, ordering):
+    """
+    Raise `FieldError` if a name of `ordering` isn’t a field (lookup) of `model`;
+    `order_by` would raise only when the query runs.
+    """
+    query = Query(model)
+    for name in ordering:
+        name = name.lstrip('-')
+        if name != '?':
+            query.names_to_path(name.split(LOOKUP_SEP), model._meta, fail_on_missing=True)
+
+
+def query_sql(queryset):
+    """
+    Return (sql, params) of `queryset` or `None` if it can’t match anything.
+    """
+    try:
+        return queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that caches the exact count per model and SQL query
+    (which includes site, the user’s groups and all filters).
+    Entries are invalidated by the model’s generation counter
+    (see `dorsale.generations`).
+    """
+    @cached_property
+    def count(self):
+        sql = query_sql(self.object_list)
+        if sql is None:
+            return 0
+        model = self.object_list.model
+        key = 'dorsale:count:%s:%s:%s' % (
+            model._meta.label_lower, get_generation(model),
+            hashlib.md5(repr(sql).encode('utf-8')).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, int(getattr(settings, 'DORSALE_COUNT_CACHE_TIMEOUT', 3600)))
+        return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the database’s row estimate instead of `COUNT(*)`:
+
+    :PostgreSQL: planner estimate of the filtered query (EXPLAIN)
+    :SQLite: table size from `sqlite_stat1` (needs ANALYZE)
+
+    Small estimates (below `settings.DORSALE_COUNT_ESTIMATE_THRESHOLD`)
+    and other databases get an exact count.
+    """
+    @cached_property
+    def count(self):
+        estimate = None
+        try:
+            estimate = self.estimate()
+        except Exception as ex:
+            logger.info('Count estimate failed: %s', ex)
+        if estimate is None or estimate < int(getattr(settings, 'DORSALE_COUNT_ESTIMATE_THRESHOLD', 10000)):
+            return self.object_list.count()
+        return estimate
+
+    def estimate(self):
+        queryset = self.object_list
+        sql = query_sql(queryset.order_by())
+        if sql is None:
+            return 0
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql[0], sql[1])
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, six.string_types):
+                    plan = json.loads(plan)
+                return int(plan[0]['Plan']['Plan Rows'])
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+        return None
+
+
+class NoCountPage(Page):
+    """
+    Page of a `NoCountPaginator`: knows only if there’s a next page.
+    """
+    def __init__(self, object_list, number, paginator, has_next):
+        super(NoCountPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+
+class NoCountPaginator(Paginator):
+    """
+    Paginator without `COUNT(*)`: fetches one row more than a page
+    to know if there’s a next page. `count` and `num_pages` are `None`.
+    """
+    count = None
+    num_pages = None
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objs = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objs and number > 1:
+            raise EmptyPage('That page contains no results')
+        return NoCountPage(objs[:self.per_page], number, self, len(objs) > self.per_page)
+
+    @property
+    def page_range(self):
+        return []
+
+
+PAGINATORS = {
+    'exact': Paginator,
+    'cached': CachedCountPaginator,
+    'estimate': EstimatedCountPaginator,
+    'none': NoCountPaginator,
+}
+
+
+def get_paginator_class(strategy):
+    """
+    Return the paginator class for count `strategy`:
+    a key of `PAGINATORS`, a dotted class name or a class.
+    """
+    if not isinstance(strategy, six.string_types):
+        return strategy
+    try:
+        return PAGINATORS[strategy]
+    except KeyError:
+        return class_from_name(strategy)
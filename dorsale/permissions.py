@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Row-level permissions for dorsale models, checked for a whole page at once.
+
+    perms = object_permissions(request.user, Model, page_of_objects_or_pks)
+    if 'change' in perms[obj.pk]: ...
+
+Allowed actions ('view', 'change', 'delete') of an object are
+
+- everything for superusers,
+- 'view' for every object the user gets from `mine()`,
+- 'change'/'delete' if the user has the model permission
+  (with `owner_only`: only for objects they created, like `DorsaleBaseAdmin`),
+- plus object permissions of django-guardian, if installed
+  ('change_model'/'edit_item' → 'change', 'view_item' → 'view' etc.).
+
+Model permissions come from Django’s auth backend (cached per user object),
+object permissions with one query for the user and one for their groups.
+Results are memoised on the user object, i.e. for the current request.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import six
+from django.contrib.auth import get_permission_codename
+from dorsale import local
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    from guardian.models import UserObjectPermission, GroupObjectPermission
+    guardian_active = True
+except ImportError:
+    guardian_active = False
+
+ACTIONS = ('view', 'change', 'delete')
+ACTION_ALIASES = {'edit': 'change', 'show': 'view'}  # : first part of object permission codenames
+MEMO_ATTRIBUTE = '_dorsale_object_permissions'
+
+
+def memoised(user, attribute):
+    """
+    dict stored as `attribute` of `user` (also through `request.user`’s lazy object)
+    """
+    memo = getattr(user, attribute, None)
+    if memo is None:
+        memo = {}
+        setattr(user, attribute, memo)
+    return memo
+
+
+def model_actions(user, model):
+    """
+    frozenset of actions `user` may do with all (visible) objects of `model`
+    """
+    memo = memoised(user, '_dorsale_model_permissions')
+    label = model._meta.label_lower
+    if label not in memo:
+        opts = model._meta
+        memo[label] = frozenset(['view'] + [
+            action for action in ACTIONS[1:]
+            if user.has_perm('%s.%s' % (opts.app_label, get_permission_codename(action, opts)))])
+    return memo[label]
+
+
+def guardian_actions(user, model, pks):
+    """
+    {pk: set of actions} from django-guardian’s object permissions
+    of `user` and their groups, two queries
+    """
+    from django.contrib.contenttypes.models import ContentType
+    content_type = ContentType.objects.get_for_model(model)
+    object_pks = dict((six.text_type(pk), pk) for pk in pks)
+    rows = list(UserObjectPermission.objects.filter(
+        user=user, content_type=content_type, object_pk__in=list(object_pks)
+    ).values_list('object_pk', 'permission__codename'))
+    group_ids = local.get_group_ids(user)
+    if group_ids:
+        rows += list(GroupObjectPermission.objects.filter(
+            group__in=sorted(group_ids), content_type=content_type, object_pk__in=list(object_pks)
+        ).values_list('object_pk', 'permission__codename'))
+    actions = {}
+    for object_pk, codename in rows:
+        action = codename.split('_', 1)[0]
+        action = ACTION_ALIASES.get(action, action)
+        if action in ACTIONS and object_pk in object_pks:
+            actions.setdefault(object_pks[object_pk], set()).add(action)
+    return actions
+
+
+def object_permissions(user, model, objs, owner_only=False):
+    """
+    Return {pk: frozenset of allowed actions} for `objs`
+    (instances or primary keys of `model`), memoised for `user`.
+
+    :owner_only: model permissions to change/delete apply only to objects
+        the user created (needs instances or one query for `createdby_id`)
+    """
+    user = local.get_user(user)
+    objs = list(objs)
+    pks = [getattr(obj, 'pk', obj) for obj in objs]
+    if user is None or not user.is_active:
+        return dict((pk, frozenset()) for pk in pks)
+    if user.is_superuser:
+        return dict((pk, frozenset(ACTIONS)) for pk in pks)
+
+    memo = memoised(user, MEMO_ATTRIBUTE)
+    label = model._meta.label_lower
+    missing = [obj for obj, pk in zip(objs, pks) if (label, pk, owner_only) not in memo]
+    if missing:
+        missing_pks = [getattr(obj, 'pk', obj) for obj in missing]
+        actions = model_actions(user, model)
+        owners = {}
+        if owner_only and hasattr(model, 'createdby'):
+            if all(hasattr(obj, 'createdby_id') for obj in missing):
+                owners = dict((obj.pk, obj.createdby_id) for obj in missing)
+            else:
+                owners = dict(model._base_manager.filter(pk__in=missing_pks)
+                              .values_list('pk', 'createdby_id'))
+        extra = guardian_actions(user, model, missing_pks) if guardian_active else {}
+        for pk in missing_pks:
+            allowed = set(actions)
+            if owner_only and pk in owners and owners[pk] != user.pk:
+                allowed -= {'change', 'delete'}
+            allowed |= extra.get(pk, set())
+            memo[(label, pk, owner_only)] = frozenset(allowed)
+    return dict((pk, memo[(label, pk, owner_only)]) for pk in pks)
+
+
+def permissions_fingerprint(user, model):
+    """
+    string that’s the same for users with the same permissions on `model`,
+    e.g. for cache keys (object permissions make it per user)
+    """
+    user = local.get_user(user)
+    if user is None:
+        return 'none'
+    if user.is_superuser:
+        return 'superuser'
+    if guardian_active:
+        return 'user:%s' % user.pk
+    return ','.join(sorted(model_actions(user, model)))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+In-process map of host names to `contrib.sites.models.Site` objects,
+used by `dorsale.middleware.RequestSiteMiddleware`.
+
+The map gets refreshed whenever a Site is saved or deleted in this process,
+and in every process after `settings.DORSALE_SITES_RELOAD_INTERVAL` seconds
+(for changes made by other workers). Unknown hosts aren’t remembered,
+so new sites are found at once.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+import time
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, post_delete
+from django.db.utils import DatabaseError
+from dorsale.conf import settings
+import logging
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sites_by_host = {}  # : {domain: Site}
+_loaded_at = None  # : time.time() of the last load
+
+
+def load_sites():
+    """
+    (Re)load all sites into the host map.
+    """
+    global _sites_by_host, _loaded_at
+    try:
+        sites = dict((s.domain, s) for s in Site.objects.all())
+    except DatabaseError as ex:
+        # e.g. before migrations ran
+        logger.info('Couldn’t load sites: %s', ex)
+        return
+    with _lock:
+        _sites_by_host = sites
+        _loaded_at = time.time()
+
+
+def is_stale():
+    interval = getattr(settings, 'DORSALE_SITES_RELOAD_INTERVAL', 300)
+    return _loaded_at is None or (interval is not None and time.time() - _loaded_at > interval)
+
+
+def get_site_for_host(host):
+    """
+    Return the `Site` for `host` (without port) or `None`.
+
+    Unknown hosts are looked up every time (one query), known hosts
+    come from the map, which gets reloaded when it’s older than
+    `settings.DORSALE_SITES_RELOAD_INTERVAL`.
+    """
+    if is_stale():
+        load_sites()
+    try:
+        return _sites_by_host[host]
+    except KeyError:
+        pass
+    try:
+        site = Site.objects.get(domain=host)
+    except Site.DoesNotExist:
+        return None  # don’t remember, the site might get added in another process
+    with _lock:
+        _sites_by_host[host] = site
+    return site
+
+
+def reload_sites(sender, **kwargs):
+    load_sites()
+
+post_save.connect(reload_sites, sender=Site, dispatch_uid='dorsale.sites.reload_sites')
+post_delete.connect(reload_sites, sender=Site, dispatch_uid='dorsale.sites.reload_sites_delete')
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-bounded spreadsheet writers (XLSX and ODS) as drop-in replacements
+for `csv.writer`, without external dependencies.
+
+Rows are written as XML into temporary files as they come,
+`save` packs them into the spreadsheet (zip) file.
+Styles are defined once per workbook. When a sheet reaches the format’s
+row limit, the writer starts a new sheet (repeating the header row).
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import re
+import six
+import shutil
+import zipfile
+import decimal
+import datetime
+import tempfile
+import threading
+from xml.sax.saxutils import escape, quoteattr
+from django.utils import timezone
+import logging
+logger = logging.getLogger(__name__)
+
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+
+def xml_text(val, charset='utf-8', entities={}):
+    """
+    Escaped XML text of `val`.
+
+    :entities: additional replacements, e.g. quotes for attribute values
+    """
+    if isinstance(val, six.binary_type):
+        val = val.decode(charset)
+    return escape(ILLEGAL_XML_CHARS.sub('', six.text_type(val)), entities)
+
+
+def local_datetime(val):
+    """
+    naive `val` in the current time zone; spreadsheets have no time zones
+    """
+    if timezone.is_aware(val):
+        val = timezone.make_naive(val)
+    return val
+
+
+class StreamingSpreadsheetWriter(object):
+    """
+    Base class of the streaming spreadsheet writers.
+
+    :targetfile: file-like object or file name, used by `save()`
+    :sheet_title: title of the first sheet; further sheets get numbers
+    :charset: encoding of byte strings in rows
+    :max_rows: rows per sheet (default: the format’s limit)
+    :repeat_header: repeat the first row on each new sheet
+    """
+    max_rows = 1048576
+
+    def __init__(self, targetfile, sheet_title='Export', charset='utf-8',
+                 max_rows=None, repeat_header=True, **kwargs):
+        self.stream = targetfile
+        self.sheet_title = six.text_type(sheet_title)
+        self.charset = charset
+        if max_rows:
+            self.max_rows = max_rows
+        self.repeat_header = repeat_header
+        self.header = None
+        self.lock = threading.Lock()
+        self.sheets = []  # : [(title, tempfile),]
+        self.rowcounter = 0  # : rows in current sheet
+        self.new_sheet()
+
+    def new_sheet(self):
+        """
+        Finish the current sheet (if any) and start a new one.
+        """
+        if self.sheets:
+            self.end_sheet(self.sheets[-1][1])
+            title = '%s (%d)' % (self.sheet_title, len(self.sheets) + 1)
+        else:
+            title = self.sheet_title
+        sheetfile = tempfile.TemporaryFile()
+        self.sheets.append((title, sheetfile))
+        self.start_sheet(sheetfile, title)
+        self.rowcounter = 0
+        if self.header is not None and self.repeat_header:
+            self.write_xml(self.row_xml(self.header))
+
+    def write_xml(self, xml):
+        self.sheets[-1][1].write(xml.encode('utf-8'))
+        self.rowcounter += 1
+
+    def writerow(self, fields, style=None):
+        with self.lock:
+            if self.header is None:
+                self.header = list(fields)
+            elif self.rowcounter >= self.max_rows:
+                self.new_sheet()
+            self.write_xml(self.row_xml(fields))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def save(self, filename=None):
+        """
+        Write the spreadsheet file into `filename` or the target file.
+        """
+        with self.lock:
+            self.end_sheet(self.sheets[-1][1])
+            if filename:
+                self.write_package(filename)
+            else:
+                # zipfile needs a seekable file
+                with tempfile.TemporaryFile() as package:
+                    self.write_package(package)
+                    package.seek(0)
+                    shutil.copyfileobj(package, self.stream)
+            for title, sheetfile in self.sheets:
+                sheetfile.close()
+            self.sheets = []
+            self.rowcounter = 0
+
+    def copy_sheet(self, archive, arcname, sheetfile, prefix='', suffix=''):
+        """
+        Store a temporary sheet file in the zip `archive`.
+        """
+        sheetfile.seek(0)
+        with tempfile.NamedTemporaryFile() as tmp:
+            tmp.write(prefix.encode('utf-8'))
+            shutil.copyfileobj(sheetfile, tmp)
+            tmp.write(suffix.encode('utf-8'))
+            tmp.flush()
+            archive.write(tmp.name, arcname)
+
+    # to be implemented by subclasses
+
+    def start_sheet(self, sheetfile, title):
+        pass
+
+    def end_sheet(self, sheetfile):
+        pass
+
+    def row_xml(self, fields):
+        raise NotImplementedError
+
+    def write_package(self, target):
+        raise NotImplementedError
+
+
+class xlsxwriter(StreamingSpreadsheetWriter):
+    """
+    Streaming XLSX (Office Open XML) creator as drop-in replacement for csv.writer
+    """
+    STYLE_DEFAULT, STYLE_DATE, STYLE_DATETIME = 0, 1, 2
+
+    def __init__(self, *args, **kwargs):
+        self.columns = []  # : cached column letters
+        self.rownumber = 0  # : row number in current sheet (1-based)
+        super(xlsxwriter, self).__init__(*args, **kwargs)
+
+    def column(self, index):
+        while len(self.columns) <= index:
+            n = len(self.columns) + 1
+            letters = ''
+            while n:
+                n, r = divmod(n - 1, 26)
+                letters = chr(65 + r) + letters
+            self.columns.append(letters)
+        return self.columns[index]
+
+    def start_sheet(self, sheetfile, title):
+        self.rownumber = 0
+
+    def cell_xml(self, ref, val):
+        if val is None:
+            return ''
+        if isinstance(val, bool):
+            return '<c r="%s" t="b"><v>%d</v></c>' % (ref, val)
+        if isinstance(val, six.integer_types + (float, decimal.Decimal)):
+            return '<c r="%s"><v>%s</v></c>' % (ref, val)
+        if isinstance(val, datetime.datetime):
+            delta = local_datetime(val) - EXCEL_EPOCH
+            return '<c r="%s" s="%d"><v>%r</v></c>' % (
+                ref, self.STYLE_DATETIME, delta.days + delta.seconds / 86400.0)
+        if isinstance(val, datetime.date):
+            return '<c r="%s" s="%d"><v>%d</v></c>' % (
+                ref, self.STYLE_DATE, (val - EXCEL_EPOCH.date()).days)
+        text = xml_text(val, self.charset)
+        if text.startswith('='):
+            return '<c r="%s"><f>%s</f></c>' % (ref, text[1:])
+        return '<c r="%s" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % (ref, text)
+
+    def row_xml(self, fields):
+        self.rownumber += 1
+        cells = ''.join(self.cell_xml('%s%d' % (self.column(x), self.rownumber), val)
+                        for x, val in enumerate(fields))
+        return '<row r="%d">%s</row>' % (self.rownumber, cells)
+
+    def write_package(self, target):
+        sheets = ''.join(
+            '<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (quoteattr(title[:31]), n, n)
+            for n, (title, sheetfile) in enumerate(self.sheets, 1))
+        sheet_rels = ''.join(
+            '<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet%d.xml"/>' % (n, n)
+            for n in range(1, len(self.sheets) + 1))
+        sheet_types = ''.join(
+            '<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' % n
+            for n in range(1, len(self.sheets) + 1))
+        n = len(self.sheets) + 1
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            archive.writestr('[Content_Types].xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                '%s</Types>' % sheet_types).encode('utf-8'))
+            archive.writestr('_rels/.rels', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>').encode('utf-8'))
+            archive.writestr('xl/workbook.xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<sheets>%s</sheets></workbook>' % sheets).encode('utf-8'))
+            archive.writestr('xl/_rels/workbook.xml.rels', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '%s<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+                '</Relationships>' % (sheet_rels, n)).encode('utf-8'))
+            archive.writestr('xl/styles.xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+                '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+                '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+                '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+                '<cellXfs count="3">'
+                '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+                '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+                '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+                '</cellXfs></styleSheet>').encode('utf-8'))
+            for n, (title, sheetfile) in enumerate(self.sheets, 1):
+                self.copy_sheet(archive, 'xl/worksheets/sheet%d.xml' % n, sheetfile,
+                    prefix='<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                           '<sheetData>',
+                    suffix='</sheetData></worksheet>')
+
+
+class odsstreamwriter(StreamingSpreadsheetWriter):
+    """
+    Streaming ODS (OpenDocument spreadsheet) creator as drop-in replacement
+    for csv.writer; it needs no odfpy and builds no document tree in memory.
+
+    All sheets are tables in one content.xml, so there’s only one temporary file.
+    """
+    def new_sheet(self):
+        if self.sheets:
+            self.end_sheet(self.sheets[-1][1])
+            title = '%s (%d)' % (self.sheet_title, len(self.sheets) + 1)
+            sheetfile = self.sheets[-1][1]
+            self.sheets.append((title, sheetfile))
+            self.start_sheet(sheetfile, title)
+            self.rowcounter = 0
+            if self.header is not None and self.repeat_header:
+                self.write_xml(self.row_xml(self.header))
+        else:
+            super(odsstreamwriter, self).new_sheet()
+
+    def start_sheet(self, sheetfile, title):
+        sheetfile.write(('<table:table table:name=%s>' % quoteattr(title)).encode('utf-8'))
+        self.table_open = True
+
+    def end_sheet(self, sheetfile):
+        if self.table_open:
+            sheetfile.write('</table:table>'.encode('utf-8'))
+            self.table_open = False
+
+    def cell_xml(self, val):
+        if val is None:
+            return '<table:table-cell/>'
+        if isinstance(val, bool):
+            return '<table:table-cell office:value-type="boolean" office:boolean-value="%s"/>' % (
+                'true' if val else 'false')
+        if isinstance(val, decimal.Decimal):
+            return '<table:table-cell office:value-type="currency" office:currency="EUR" office:value="%s"/>' % val
+        if isinstance(val, six.integer_types + (float,)):
+            return '<table:table-cell office:value-type="float" office:value="%r"/>' % val
+        if isinstance(val, datetime.datetime):
+            return '<table:table-cell office:value-type="date" office:date-value="%s" table:style-name="datetime"/>' % (
+                local_datetime(val).isoformat())
+        if isinstance(val, datetime.date):
+            return '<table:table-cell office:value-type="date" office:date-value="%s" table:style-name="date"/>' % (
+                val.isoformat())
+        if isinstance(val, datetime.time):
+            return '<table:table-cell office:value-type="time" office:time-value="PT%02dH%02dM%02dS"/>' % (
+                val.hour, val.minute, val.second)
+        text = xml_text(val, self.charset, {'"': '&quot;'})  # also used as attribute
+        if text.startswith('='):
+            return '<table:table-cell table:formula="of:%s"/>' % text
+        return '<table:table-cell office:value-type="string"><text:p>%s</text:p></table:table-cell>' % text
+
+    def row_xml(self, fields):
+        return '<table:table-row>%s</table:table-row>' % ''.join(
+            self.cell_xml(val) for val in fields)
+
+    def write_package(self, target):
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            # mimetype must be first and uncompressed
+            archive.writestr(zipfile.ZipInfo('mimetype'),
+                             'application/vnd.oasis.opendocument.spreadsheet'.encode('ascii'))
+            archive.writestr('META-INF/manifest.xml', (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+                '<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+                '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+                '</manifest:manifest>').encode('utf-8'))
+            self.copy_sheet(archive, 'content.xml', self.sheets[0][1],
+                prefix='<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<office:document-content'
+                       ' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+                       ' xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0"'
+                       ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+                       ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+                       ' xmlns:number="urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0"'
+                       ' xmlns:of="urn:oasis:names:tc:opendocument:xmlns:of:1.2"'
+                       ' office:version="1.2">'
+                       '<office:automatic-styles>'
+                       '<number:date-style style:name="N1"><number:year number:style="long"/><number:text>-</number:text>'
+                       '<number:month number:style="long"/><number:text>-</number:text><number:day number:style="long"/></number:date-style>'
+                       '<number:date-style style:name="N2"><number:year number:style="long"/><number:text>-</number:text>'
+                       '<number:month number:style="long"/><number:text>-</number:text><number:day number:style="long"/>'
+                       '<number:text> </number:text><number:hours number:style="long"/><number:text>:</number:text>'
+                       '<number:minutes number:style="long"/></number:date-style>'
+                       '<style:style style:name="date" style:family="table-cell" style:data-style-name="N1"/>'
+                       '<style:style style:name="datetime" style:family="table-cell" style:data-style-name="N2"/>'
+                       '</office:automatic-styles>'
+                       '<office:body><office:spreadsheet>',
+                suffix='</office:spreadsheet></office:body></office:document-content>')
+
+    def save(self, filename=None):
+        super(odsstreamwriter, self).save(filename)
+        self.table_open = False
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of dorsale and siteprofile with a small test app (`dorsale.tests.models`):
+
+    ./manage.py test dorsale.tests --settings=dorsale.tests.settings
+"""
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Models of the test app.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import Group
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from mptt.fields import TreeForeignKey
+from mptt.models import MPTTModel
+from dorsale.mptt.managers import DorsaleMPTTSiteManager
+from dorsale.mptt.models import DorsaleMPTTBaseModel
+from siteprofile.managers import DorsaleGroupSiteManager, DorsaleSiteManager
+from siteprofile.models import DorsaleBaseModel
+
+
+@python_2_unicode_compatible
+class Tag(DorsaleBaseModel):
+    name = models.CharField(max_length=63)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Category(DorsaleBaseModel):
+    name = models.CharField(max_length=63)
+
+    def __str__(self):
+        return self.name
+
+
+@python_2_unicode_compatible
+class Item(DorsaleBaseModel):
+    name = models.CharField(max_length=63)
+    number = models.IntegerField(default=0)
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.CASCADE)
+    group = models.ForeignKey(Group, null=True, blank=True, on_delete=models.SET_NULL)
+    tags = models.ManyToManyField(Tag, blank=True)
+
+    list_display = ['name', 'number', 'category']
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.name
+
+
+class GroupItem(DorsaleBaseModel):
+    name = models.CharField(max_length=63)
+    group = models.ForeignKey(Group, null=True, on_delete=models.SET_NULL)
+
+    objects = DorsaleGroupSiteManager()
+
+
+class OwnItemManager(DorsaleSiteManager):
+    """
+    `mine` are the objects the user created
+    """
+    def mine_queryset(self, user):
+        return super(OwnItemManager, self).mine_queryset(user).filter(createdby=user)
+
+
+class OwnItem(DorsaleBaseModel):
+    name = models.CharField(max_length=63)
+
+    objects = OwnItemManager()
+
+
+@python_2_unicode_compatible
+class Node(DorsaleMPTTBaseModel, MPTTModel):
+    name = models.CharField(max_length=63)
+    parent = TreeForeignKey('self', null=True, blank=True, related_name='children', on_delete=models.CASCADE)
+    group = models.ForeignKey(Group, null=True, blank=True, on_delete=models.SET_NULL)
+    # cascades to nodes elsewhere in the tree
+    alias_of = models.ForeignKey('self', null=True, blank=True, related_name='aliases', on_delete=models.CASCADE)
+
+    objects = DorsaleMPTTSiteManager()
+
+    def __str__(self):
+        return self.name
+
+
+class Note(models.Model):
+    """
+    not soft-deletable, gets really deleted with its item
+    """
+    item = models.ForeignKey(Item, related_name='notes', on_delete=models.CASCADE)
+    text = models.CharField(max_length=63)
+
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from dorsale import archive
+from dorsale.tests.models import Category, Item, Note, Tag
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(DORSALE_ARCHIVE_ROOT=self.root)
+        self.settings.enable()
+        self.tag = Tag.objects.create(name='tag')
+        self.category = Category.objects.create(name='category')
+        self.items = [Item.objects.create(name='item %d' % i, category=self.category) for i in range(2)]
+        self.items[0].tags.add(self.tag)
+        self.kept = Category.objects.create(name='kept')
+        self.category.delete()
+        Category.really_all_objects.filter(pk=self.category.pk).update(lastchangedon=now() - timedelta(days=10))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.root)
+
+    def checkpoint(self):
+        return archive.read_checkpoint(Category).get('pending')
+
+    def interrupted(self):
+        """
+        archive run that wrote its batch, but died before purging it
+        """
+        with mock.patch('dorsale.archive.purge', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                archive.archive_model(Category, days=1)
+        self.assertTrue(os.path.exists(self.checkpoint()))
+        self.assertEqual(Item.really_all_objects.count(), 2)
+
+    def test_round_trip(self):
+        self.assertEqual(archive.archive_model(Category, days=1, dry_run=True), 1)
+        # category, 2 items, 1 tag row
+        self.assertEqual(archive.archive_model(Category, days=1), 4)
+        self.assertEqual(list(Category.really_all_objects.all()), [self.kept])
+        self.assertFalse(Item.really_all_objects.exists())
+        self.assertEqual(Item.tags.through.objects.count(), 0)
+        self.assertIsNone(self.checkpoint())
+        self.assertEqual(len(archive.archive_files(Category)), 1)
+
+        self.assertEqual(archive.restore(Category, self.category.pk), 4)
+        category = Category.really_all_objects.get(pk=self.category.pk)
+        self.assertTrue(category.deleted)
+        self.assertEqual(sorted(Item.really_all_objects.filter(category=category).values_list('name', flat=True)),
+                         ['item 0', 'item 1'])
+        self.assertEqual(list(Item.really_all_objects.get(pk=self.items[0].pk).tags.all()), [self.tag])
+        self.assertEqual(archive.archive_files(Category), [])
+        self.assertEqual(archive.restore(Category, self.category.pk), 0)
+
+    def test_resume(self):
+        self.interrupted()
+        # nothing else is due, the pending batch gets purged
+        Category.really_all_objects.filter(pk=self.category.pk).update(lastchangedon=now())
+        self.assertEqual(archive.archive_model(Category, days=1), 0)
+        self.assertIsNone(self.checkpoint())
+        self.assertFalse(Item.really_all_objects.exists())
+        self.assertEqual(list(Category.really_all_objects.all()), [self.kept])
+
+    def test_resume_undeleted_rows(self):
+        self.interrupted()
+        Item.really_all_objects.filter(pk=self.items[1].pk).update(deleted=False)
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_model(Category, days=1)
+        self.assertTrue(self.checkpoint())
+        self.assertEqual(Item.really_all_objects.count(), 2)
+
+    def test_resume_unarchived_rows(self):
+        self.interrupted()
+        Note.objects.create(item=self.items[1], text='new')
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_model(Category, days=1)
+        self.assertTrue(self.checkpoint())
+        self.assertEqual(Note.objects.count(), 1)
+        self.assertTrue(Category.really_all_objects.filter(pk=self.category.pk).exists())
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from dorsale.generations import get_generation
+from dorsale.tests.models import Item
+
+
+class BulkTests(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@example.com', 'secret')
+        self.editor = User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.other_site = Site.objects.create(domain='other.example.com', name='other')
+
+    def test_bulk_create_stamps(self):
+        generation = get_generation(Item)
+        with self.assertNumQueries(2):  # two batches
+            created = Item.objects.bulk_create_for(
+                self.creator, None, (Item(name='item %d' % i) for i in range(5)), batch_size=3)
+        self.assertEqual(len(created), 5)
+        self.assertNotEqual(get_generation(Item), generation)
+        items = Item.objects.all()
+        self.assertEqual(len(items), 5)
+        for item in items:
+            self.assertEqual((item.createdby_id, item.lastchangedby_id), (self.creator.pk, self.creator.pk))
+            self.assertEqual(item.site_id, Site.objects.get_current().pk)
+            self.assertFalse(item.deleted)
+            self.assertIsNotNone(item.createdon)
+            self.assertIsNotNone(item.lastchangedon)
+
+    def test_bulk_create_other_site(self):
+        Item.objects.bulk_create_for(self.creator.pk, self.other_site, [Item(name='elsewhere')])
+        self.assertFalse(Item.objects.exists())
+        self.assertEqual(Item.really_all_objects.get().site_id, self.other_site.pk)
+
+    def test_bulk_update_stamps(self):
+        Item.objects.bulk_create_for(self.creator, None, [Item(name='item %d' % i) for i in range(3)])
+        Item.objects.bulk_create_for(self.creator, self.other_site, [Item(name='elsewhere')])
+        items = list(Item.objects.all())
+        elsewhere = Item.really_all_objects.get(name='elsewhere')
+        for i, item in enumerate(items + [elsewhere]):
+            item.number = 10 + i
+        with CaptureQueriesContext(connection) as queries:
+            count = Item.objects.bulk_update_for(self.editor, items + [elsewhere], ['number'], batch_size=2)
+        self.assertEqual(count, 3)  # not the other site’s row
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]), 2)
+        for i, item in enumerate(Item.objects.all()):
+            self.assertEqual(item.number, 10 + i)
+            self.assertEqual((item.createdby_id, item.lastchangedby_id), (self.creator.pk, self.editor.pk))
+        self.assertEqual(Item.really_all_objects.get(name='elsewhere').number, 0)
+
+    def test_bulk_update_rejects_primary_key(self):
+        with self.assertRaises(ValueError):
+            Item.objects.bulk_update_for(self.editor, [], ['id'])
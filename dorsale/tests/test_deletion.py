@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from dorsale.deletion import post_soft_delete
+from dorsale.tests.models import Category, Item, Note, Tag
+
+
+def updates(queries, table):
+    return [q for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE "%s"' % table)]
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.category = Category.objects.create(name='category')
+        self.items = [Item.objects.create(name='item %d' % i, category=self.category) for i in range(3)]
+        for item in self.items:
+            Note.objects.create(item=item, text='note')
+        self.other = Item.objects.create(name='other')
+        Note.objects.create(item=self.other, text='other note')
+
+    def test_delete_marks_cascade(self):
+        self.category.delete(user=self.user)
+        self.assertTrue(self.category.deleted)
+        self.assertFalse(Category.objects.exists())
+        self.assertTrue(Category.really_all_objects.get(pk=self.category.pk).deleted)
+        self.assertEqual(list(Item.objects.all()), [self.other])
+        self.assertEqual(Item.really_all_objects.filter(deleted=True, category=self.category).count(), 3)
+        self.assertEqual(set(Item.really_all_objects.filter(deleted=True).values_list('lastchangedby', flat=True)),
+                         {self.user.pk})
+        # notes aren’t soft-deletable: really deleted
+        self.assertEqual(list(Note.objects.values_list('item', flat=True)), [self.other.pk])
+
+    def test_keeps_many_to_many_rows(self):
+        tag = Tag.objects.create(name='tag')
+        self.items[0].tags.add(tag)
+        self.other.tags.add(tag)
+        self.category.delete()
+        self.assertEqual(Item.tags.through.objects.count(), 2)
+        self.assertEqual(list(Item.really_all_objects.get(pk=self.items[0].pk).tags.all()), [tag])
+        tag.delete()
+        self.assertEqual(Item.tags.through.objects.count(), 2)
+
+    def test_one_update_per_model(self):
+        with CaptureQueriesContext(connection) as queries:
+            count, counter = Category.objects.all().soft_delete()
+        self.assertEqual(len(updates(queries, 'tests_category')), 1)
+        self.assertEqual(len(updates(queries, 'tests_item')), 1)
+        self.assertEqual(counter['tests.Category'], 1)
+        self.assertEqual(counter['tests.Item'], 3)
+        self.assertEqual(counter['tests.Note'], 3)
+        self.assertEqual(Note.objects.count(), 1)
+
+    def test_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            Item.objects.filter(category=self.category).soft_delete(batch_size=2)
+        self.assertEqual(len(updates(queries, 'tests_item')), 2)
+        self.assertEqual(Item.objects.count(), 1)
+
+    def test_bulk_signals(self):
+        instance_signals, bulk_signals = [], []
+
+        def on_delete(sender, instance, **kwargs):
+            instance_signals.append((sender, instance.pk))
+
+        def on_soft_delete(sender, pk_set, **kwargs):
+            bulk_signals.append((sender, sorted(pk_set)))
+
+        post_delete.connect(on_delete, sender=Item)
+        post_soft_delete.connect(on_soft_delete, sender=Item)
+        try:
+            Item.objects.filter(category=self.category).soft_delete(bulk_signals=True)
+            self.assertEqual(instance_signals, [])
+            self.assertEqual(bulk_signals, [(Item, sorted(item.pk for item in self.items))])
+
+            del bulk_signals[:]
+            self.other.delete()
+            self.assertEqual(bulk_signals, [])
+        finally:
+            post_delete.disconnect(on_delete, sender=Item)
+            post_soft_delete.disconnect(on_soft_delete, sender=Item)
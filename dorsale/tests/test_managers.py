@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.test import TestCase
+from dorsale.views import list_cache_key
+from dorsale.tests.models import GroupItem, Item, OwnItem
+from siteprofile.managers import DorsaleGroupSiteManager
+
+
+class MineTests(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='group')
+        self.member = User.objects.create_user('member', 'member@example.com', 'secret')
+        self.member.groups.add(self.group)
+        self.stranger = User.objects.create_user('stranger', 'stranger@example.com', 'secret')
+        self.item = Item.objects.create(name='item')
+        self.group_item = GroupItem.objects.create(name='group item', group=self.group)
+
+    def test_mine(self):
+        self.assertEqual(list(Item.objects.mine(self.member)), [self.item])
+        self.assertEqual(list(Item.objects.mine(self.member.pk)), [self.item])
+        self.assertEqual(list(Item.objects.mine(AnonymousUser())), [])
+        self.stranger.is_active = False
+        self.assertEqual(list(Item.objects.mine(self.stranger)), [])
+
+    def test_group_mine(self):
+        self.assertEqual(list(GroupItem.objects.mine(self.member)), [self.group_item])
+        self.assertEqual(list(GroupItem.objects.mine(self.stranger)), [])
+
+    def test_no_shared_user(self):
+        Item.objects.mine(self.member)
+        with self.assertRaises(AttributeError):
+            Item.objects.user
+
+    def test_anonymous_user_logs_nothing(self):
+        with self.assertLogs('siteprofile.managers', 'ERROR') as logs:
+            Item.objects.mine(AnonymousUser())
+            Item.objects.mine(-12345)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('-12345', logs.output[0])
+
+
+class OwnGroupItemManager(DorsaleGroupSiteManager):
+    def mine_queryset(self, user):
+        return super(OwnGroupItemManager, self).mine_queryset(user).filter(createdby=user)
+
+
+class FingerprintTests(TestCase):
+    def setUp(self):
+        self.group = Group.objects.create(name='group')
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'secret')
+        for user in (self.alice, self.bob):
+            user.groups.add(self.group)
+            OwnItem.objects.create(name=user.username, createdby=user)
+
+    def test_stock_managers_share(self):
+        self.assertEqual(Item.objects.mine_fingerprint(self.alice), 'active')
+        self.assertEqual(Item.objects.mine_fingerprint(self.bob), 'active')
+        self.assertEqual(GroupItem.objects.mine_fingerprint(self.alice),
+                         GroupItem.objects.mine_fingerprint(self.bob))
+        self.assertEqual(Item.objects.mine_fingerprint(AnonymousUser()), 'none')
+
+    def test_overridden_mine_queryset(self):
+        self.assertEqual([item.name for item in OwnItem.objects.mine(self.alice)], ['alice'])
+        self.assertNotEqual(OwnItem.objects.mine_fingerprint(self.alice),
+                            OwnItem.objects.mine_fingerprint(self.bob))
+        self.assertEqual(OwnItem.objects.mine_fingerprint(AnonymousUser()), 'none')
+        self.assertNotEqual(list_cache_key(OwnItem, self.alice, 1, 'id'),
+                            list_cache_key(OwnItem, self.bob, 1, 'id'))
+        self.assertEqual(list_cache_key(Item, self.alice, 1, 'id'),
+                         list_cache_key(Item, self.bob, 1, 'id'))
+
+    def test_overridden_group_mine_queryset(self):
+        manager = OwnGroupItemManager()
+        manager.model = GroupItem
+        self.assertNotEqual(manager.mine_fingerprint(self.alice), manager.mine_fingerprint(self.bob))
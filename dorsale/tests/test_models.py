@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from dorsale.tests.models import Category, Item
+
+
+class DirtySaveTests(TestCase):
+    def setUp(self):
+        self.editor = User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.category = Category.objects.create(name='category')
+        self.pk = Item.objects.create(name='item', number=1, category=self.category).pk
+        Site.objects.get_current()  # warm the site cache
+
+    def saved_columns(self, item, **kwargs):
+        """
+        columns in the SET clause of the one UPDATE that `item.save()` runs
+        """
+        with CaptureQueriesContext(connection) as queries:
+            item.save(**kwargs)
+        self.assertEqual(len(queries.captured_queries), 1, queries.captured_queries)
+        sql = queries.captured_queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'), sql)
+        assignments = sql.split(' SET ', 1)[1].split(' WHERE ', 1)[0]
+        return sorted(part.split('=')[0].strip().strip('"') for part in assignments.split(', '))
+
+    def test_unchanged_no_query(self):
+        item = Item.objects.get(pk=self.pk)
+        with self.assertNumQueries(0):
+            item.save()
+            item.save(user=self.editor)
+        item.name = 'item'  # same value
+        with self.assertNumQueries(0):
+            item.save()
+
+    def test_changed_fields_only(self):
+        item = Item.objects.get(pk=self.pk)
+        item.name = 'renamed'
+        self.assertEqual(self.saved_columns(item, user=self.editor), ['lastchangedby_id', 'lastchangedon', 'name'])
+        # saved values are the new baseline
+        with self.assertNumQueries(0):
+            item.save()
+        item = Item.objects.get(pk=self.pk)
+        self.assertEqual((item.name, item.number, item.lastchangedby_id), ('renamed', 1, self.editor.pk))
+
+    def test_deferred_fields(self):
+        item = Item.objects.only('name').get(pk=self.pk)
+        item.number = 2
+        # no SELECT of deferred fields; `site` gets set by every save
+        self.assertEqual(self.saved_columns(item), ['lastchangedon', 'number', 'site_id'])
+        item.number = 3
+        self.assertEqual(self.saved_columns(item, user=self.editor), ['lastchangedby_id', 'lastchangedon', 'number'])
+        item = Item.objects.get(pk=self.pk)
+        self.assertEqual((item.name, item.number, item.category_id, item.lastchangedby_id),
+                         ('item', 3, self.category.pk, self.editor.pk))
+
+    def test_update_fields(self):
+        item = Item.objects.get(pk=self.pk)
+        item.name, item.number = 'renamed', 3
+        self.assertEqual(self.saved_columns(item, update_fields=['number']),
+                         ['lastchangedby_id', 'lastchangedon', 'number'])
+        self.assertEqual(Item.objects.get(pk=self.pk).name, 'item')
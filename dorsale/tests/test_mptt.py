@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.db import connection, models
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from mptt.fields import TreeForeignKey
+from mptt.models import MPTTModel
+from dorsale.deletion import post_soft_delete
+from dorsale.mptt.managers import DorsaleMPTTSiteManager
+from dorsale.mptt.models import DorsaleMPTTBaseModel
+from dorsale.tests.models import Node
+
+
+@isolate_apps('dorsale.tests')
+class BaseOrderCheckTests(SimpleTestCase):
+    def test_mptt_model_first(self):
+        class WrongNode(MPTTModel, DorsaleMPTTBaseModel):
+            parent = TreeForeignKey('self', null=True, on_delete=models.CASCADE)
+
+        self.assertIn('dorsale.E001', [error.id for error in WrongNode.check()])
+        self.assertNotIn('dorsale.E001', [error.id for error in Node.check()])
+
+
+class SubtreeDeleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = Node.objects.create(name='root')
+        self.branch = Node.objects.create(name='branch', parent=self.root)
+        self.leaves = [Node.objects.create(name='leaf %d' % i, parent=self.branch) for i in range(2)]
+        self.other = Node.objects.create(name='other', parent=self.root)
+        self.second = Node.objects.create(name='second')
+
+    def node(self, node):
+        return Node.really_all_objects.get(pk=node.pk)
+
+    def assertContiguous(self, tree_id):
+        """
+        live nodes of tree `tree_id` use lft/rght 1..2n without gaps
+        """
+        nodes = Node.objects.filter(tree_id=tree_id)
+        values = sorted(sum(([node.lft, node.rght] for node in nodes), []))
+        self.assertEqual(values, list(range(1, 2 * len(nodes) + 1)))
+
+    def test_delete_subtree(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.branch.delete()
+        marks = [q for q in queries.captured_queries
+                 if q['sql'].startswith('UPDATE "tests_node"') and '"deleted"' in q['sql']]
+        self.assertEqual(len(marks), 1)
+        self.assertEqual([node.name for node in Node.objects.all()], ['root', 'other', 'second'])
+        self.assertContiguous(self.root.tree_id)
+        self.assertEqual(self.node(self.root).rght, 4)
+
+        branch = self.node(self.branch)
+        self.assertTrue(branch.deleted)
+        self.assertIsNone(branch.parent_id)
+        self.assertEqual((branch.lft, branch.rght, branch.level), (1, 6, 0))
+        self.assertNotIn(branch.tree_id, (self.root.tree_id, self.second.tree_id))
+        self.assertEqual((self.branch.tree_id, self.branch.parent_id), (branch.tree_id, None))
+        for leaf in self.leaves:
+            leaf = self.node(leaf)
+            self.assertTrue(leaf.deleted)
+            self.assertEqual((leaf.tree_id, leaf.parent_id, leaf.level), (branch.tree_id, branch.pk, 1))
+
+    def test_rebuild_keeps_deleted_apart(self):
+        self.branch.delete()
+        deleted_tree_id = self.node(self.branch).tree_id
+        Node.objects.rebuild()
+        self.assertContiguous(self.node(self.root).tree_id)
+        self.assertEqual(self.node(self.root).rght, 4)
+        branch = self.node(self.branch)
+        self.assertIsNone(branch.parent_id)
+        self.assertEqual((branch.lft, branch.rght), (1, 6))
+        self.assertEqual(len(set(Node.really_all_objects.filter(parent=None).values_list('tree_id', flat=True))), 3)
+        # new roots don’t share the deleted tree
+        self.assertNotIn(Node.objects.create(name='third').tree_id,
+                         (deleted_tree_id, self.node(self.root).tree_id, self.node(self.second).tree_id))
+
+    def test_cascade_outside_subtree(self):
+        alias = Node.objects.create(name='alias', parent=self.other, alias_of=self.leaves[0])
+        pk_sets = []
+
+        def on_soft_delete(sender, pk_set, **kwargs):
+            pk_sets.append(sorted(pk_set))
+
+        post_soft_delete.connect(on_soft_delete, sender=Node)
+        try:
+            self.branch.delete(bulk_signals=True)
+        finally:
+            post_soft_delete.disconnect(on_soft_delete, sender=Node)
+        self.assertEqual(sorted(pk_sets), sorted([[alias.pk], sorted([self.branch.pk] + [n.pk for n in self.leaves])]))
+        alias = self.node(alias)
+        self.assertTrue(alias.deleted)
+        self.assertEqual(alias.parent_id, self.other.pk)
+        self.assertEqual([node.name for node in Node.objects.without_deleted_subtrees()],
+                         ['root', 'other', 'second'])
+
+    def test_cached_tree(self):
+        tree = Node.objects.cached_tree(fields=('name',))
+        self.assertEqual(tree.descendants(self.root.pk), [self.branch.pk] + [n.pk for n in self.leaves] + [self.other.pk])
+        self.branch.delete()
+        tree = Node.objects.cached_tree(fields=('name',))
+        self.assertEqual(tree.children(self.root.pk), [self.other.pk])
+        self.assertNotIn(self.branch.pk, tree)
+
+
+class OwnNodeManager(DorsaleMPTTSiteManager):
+    def mine_queryset(self, user):
+        return super(OwnNodeManager, self).mine_queryset(user).filter(createdby=user)
+
+
+class CachedTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'secret')
+        self.root = Node.objects.create(name='root', createdby=self.alice)
+        self.mine = Node.objects.create(name='alice', parent=self.root, createdby=self.alice)
+        self.theirs = Node.objects.create(name='bob', parent=self.root, createdby=self.bob)
+
+    def test_shared_by_stock_manager(self):
+        self.assertEqual(len(Node.objects.cached_tree(self.alice)), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(Node.objects.cached_tree(self.bob)), 3)
+        self.assertEqual(len(Node.objects.cached_tree(AnonymousUser())), 0)
+
+    def test_per_user_with_own_mine(self):
+        manager = OwnNodeManager()
+        manager.model = Node
+        self.assertEqual(manager.cached_tree(self.alice).descendants(self.root.pk), [self.mine.pk])
+        self.assertEqual(manager.cached_tree(self.bob).roots(), [self.theirs.pk])
+        self.assertNotIn(self.root.pk, manager.cached_tree(self.bob))
+        self.assertEqual(len(manager.cached_tree(AnonymousUser())), 0)
+        # user=None: all nodes of the site
+        self.assertEqual(len(manager.cached_tree()), 3)
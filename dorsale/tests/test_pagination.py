@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.core.cache import cache
+from django.core.exceptions import FieldError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connection
+from django.test import TestCase, override_settings
+from dorsale.pagination import (
+    CachedCountPaginator, EstimatedCountPaginator, KeysetPaginator, NoCountPaginator,
+    check_ordering, get_paginator_class)
+from dorsale.tests.models import Category, Item
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        # category names order the other way round than their IDs
+        self.categories = [Category.objects.create(name=name) for name in 'cba']
+        for i in range(7):
+            Item.objects.create(name='item %d' % (i % 3), number=i, category=self.categories[i % 3])
+
+    def walk(self, ordering, per_page=3):
+        """
+        numbers of all pages forward, then all pages backward from the last one
+        """
+        paginator = KeysetPaginator(Item.objects.all(), ordering, per_page)
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        forward = [[item.number for item in page]]
+        while page.has_next():
+            page = paginator.page(after=page.next_cursor)
+            forward.append([item.number for item in page])
+        backward = [[item.number for item in page]]
+        while page.has_previous():
+            page = paginator.page(before=page.previous_cursor)
+            backward.insert(0, [item.number for item in page])
+        return forward, backward
+
+    def test_both_directions(self):
+        for ordering in (['name'], ['-name'], ['-number'], ['name', '-number']):
+            expected = list(Item.objects.order_by(*ordering + ['pk']).values_list('number', flat=True))
+            forward, backward = self.walk(ordering)
+            self.assertEqual(sum(forward, []), expected, ordering)
+            self.assertEqual(forward, backward, ordering)
+            self.assertEqual([len(numbers) for numbers in forward], [3, 3, 1])
+
+    def test_foreign_key_by_id(self):
+        # not by the name ordering of Category
+        paginator = KeysetPaginator(Item.objects.all(), ['-category'], 3)
+        self.assertEqual(paginator.ordering, ['-category_id', 'id'])
+        forward, backward = self.walk(['-category'])
+        self.assertEqual(sum(forward, []), [2, 5, 1, 4, 0, 3, 6])
+        self.assertEqual(forward, backward)
+
+    def test_no_column(self):
+        with self.assertRaises(FieldError):
+            KeysetPaginator(Item.objects.all(), ['tags'], 3)
+        with self.assertRaises(FieldError):
+            KeysetPaginator(Item.objects.all(), ['notes'], 3)
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Item.objects.all(), ['name'], 3)
+        cursor = paginator.page().next_cursor
+        page = KeysetPaginator(Item.objects.all(), ['number'], 3).page(after=cursor)
+        self.assertEqual([item.number for item in page], [0, 1, 2])
+        page = paginator.page(after=cursor + 'x')
+        self.assertFalse(page.has_previous())
+
+    def test_check_ordering(self):
+        check_ordering(Item, ['-name', 'category__name', 'pk', '?'])
+        for ordering in (['nope'], ['name', 'category__nope'], ['']):
+            with self.assertRaises(FieldError):
+                check_ordering(Item, ordering)
+
+
+class CountPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            Item.objects.create(name='item %d' % i, number=i)
+        self.queryset = Item.objects.order_by('pk')
+
+    def test_get_paginator_class(self):
+        self.assertIs(get_paginator_class('exact'), Paginator)
+        self.assertIs(get_paginator_class('none'), NoCountPaginator)
+        self.assertIs(get_paginator_class('dorsale.pagination.CachedCountPaginator'), CachedCountPaginator)
+        self.assertIs(get_paginator_class(NoCountPaginator), NoCountPaginator)
+
+    def test_cached_count(self):
+        self.assertEqual(CachedCountPaginator(self.queryset, 2).count, 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(self.queryset, 2).count, 5)
+        # other filters, other entry
+        self.assertEqual(CachedCountPaginator(self.queryset.filter(number__lt=2), 2).count, 2)
+        Item.objects.create(name='new')  # bumps the generation
+        self.assertEqual(CachedCountPaginator(self.queryset, 2).count, 6)
+        self.assertEqual(CachedCountPaginator(Item.objects.none(), 2).count, 0)
+
+    @override_settings(DORSALE_COUNT_ESTIMATE_THRESHOLD=3)
+    def test_estimated_count(self):
+        # without statistics: exact count
+        self.assertEqual(EstimatedCountPaginator(self.queryset, 2).count, 5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        for i in range(3):
+            Item.objects.create(name='new %d' % i)
+        # the estimate stays until the next ANALYZE
+        self.assertEqual(EstimatedCountPaginator(self.queryset, 2).count, 5)
+        with override_settings(DORSALE_COUNT_ESTIMATE_THRESHOLD=10000):
+            self.assertEqual(EstimatedCountPaginator(self.queryset, 2).count, 8)
+
+    def test_no_count(self):
+        paginator = NoCountPaginator(self.queryset, 2)
+        with self.assertNumQueries(1):
+            page = paginator.page(1)
+            self.assertEqual([item.number for item in page], [0, 1])
+        self.assertTrue(page.has_next())
+        self.assertEqual(page.end_index(), 2)
+        page = paginator.page(3)
+        self.assertEqual([item.number for item in page], [4])
+        self.assertFalse(page.has_next())
+        self.assertEqual(page.end_index(), 5)
+        self.assertIsNone(paginator.count)
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+        with self.assertRaises(EmptyPage):
+            paginator.page(0)
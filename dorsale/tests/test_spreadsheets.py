@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import datetime
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from dorsale.spreadsheets import odsstreamwriter, xlsxwriter
+
+
+@override_settings(USE_TZ=True, TIME_ZONE='Europe/Berlin')
+class DatetimeCellTests(SimpleTestCase):
+    def setUp(self):
+        # 12:00 UTC is 14:00 in Berlin
+        self.aware = datetime.datetime(2017, 7, 1, 12, 0, tzinfo=timezone.utc)
+
+    def test_xlsx_local_time(self):
+        xml = xlsxwriter(None).cell_xml('A1', self.aware)
+        self.assertIn('<v>%r</v>' % (42917 + 14 / 24.0), xml)
+
+    def test_ods_local_time(self):
+        xml = odsstreamwriter(None).cell_xml(self.aware)
+        self.assertIn('office:date-value="2017-07-01T14:00:00"', xml)
+
+    def test_naive_unchanged(self):
+        xml = odsstreamwriter(None).cell_xml(datetime.datetime(2017, 7, 1, 12, 0))
+        self.assertIn('office:date-value="2017-07-01T12:00:00"', xml)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from dorsale import views
+from dorsale.tests.models import Item
+
+
+class GetModelTests(TestCase):
+    """
+    `views.get_model` resolves models without the former ContentType query.
+    """
+    def setUp(self):
+        self.registry = dict(views._models)
+
+    def tearDown(self):
+        views._models.clear()
+        views._models.update(self.registry)
+
+    def test_get_model_without_queries(self):
+        with self.assertNumQueries(0):
+            for _i in range(2):
+                self.assertIs(views.get_model('tests', 'Item'), Item)
+                self.assertIs(views.get_model('auth', 'Group'), Group)
+            self.assertIsNone(views.get_model('auth', 'nosuchmodel'))
+
+    def test_registered_model(self):
+        views.register_model('things', Group, 'Thing')
+        with self.assertNumQueries(0):
+            self.assertIs(views.get_model('Things', 'thing'), Group)
+
+    def test_list_items_queries(self):
+        cache.clear()
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        for i in range(3):
+            Item.objects.create(name='item %d' % i)
+        self.client.force_login(user)
+        # session, user, count, page; no ContentType
+        with self.assertNumQueries(4):
+            response = self.client.get('/item/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'item 2')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/item/')
+        self.assertFalse([q for q in queries.captured_queries if 'django_content_type' in q['sql']])
+
+    def test_list_items_invalid_ordering(self):
+        cache.clear()
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        Item.objects.create(name='item')
+        self.client.force_login(user)
+        response = self.client.get('/item/', {'orderby': 'name,nope'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['orderby'], 'id')
+        self.assertEqual(response.context['l_orderby'], ['id'])
+        response = self.client.get('/item/', {'orderby': '-name'})
+        self.assertEqual(response.context['l_orderby'], ['-name'])
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from dorsale.tests.models import Item
+from dorsale.urls import makepatterns
+
+urlpatterns = makepatterns('tests', [Item])
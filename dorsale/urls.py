@@ -9,11 +9,16 @@ import dorsale.views as dv
 
 
 def makepatterns(mymodule, mymodels, urlpatterns=None):
+    """
+    Append URL patterns for dorsale’s generic views of `mymodels`
+    to `urlpatterns` and register the models for `dorsale.views.get_model`.
+    """
     if not urlpatterns:
         urlpatterns = []
 
     for mymodel in mymodels:
         name = mymodel.__name__.lower()
+        dv.register_model(mymodule, mymodel, name)
 #         eco = {
 #             'object_example': mymodel(),
 #         }
@@ -4,27 +4,96 @@ from __future__ import unicode_literals
 from django.shortcuts import render, redirect
 from django.http import HttpResponse, HttpResponseRedirect
 # from django.template import RequestContext
+from django.apps import apps as django_apps
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import FieldError, ObjectDoesNotExist
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
-from django.utils.translation import ugettext_lazy as _
+from django.core.paginator import InvalidPage, EmptyPage
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import ugettext_lazy as _, get_language
+from dorsale import local
 from dorsale.conf import settings
 from dorsale.forms import ModelFormFactory
+from dorsale.generations import get_generation
+from dorsale.pagination import KeysetPaginator, check_ordering, get_paginator_class, split_ordering
+from dorsale.permissions import object_permissions, permissions_fingerprint
 # from adhesive.models import Note
+import hashlib
+from functools import partial
 import logging
 logger = logging.getLogger(settings.PROJECT_NAME)
 
+try:
+    from django.urls import reverse, NoReverseMatch
+except ImportError:  # Django < 1.10
+    from django.core.urlresolvers import reverse, NoReverseMatch
+
+
+_models = {}  # : {(app_name, model_name): model}, filled by `register_model`
+
+
+def register_model(app_name, model, model_name=None):
+    """
+    Remember `model` for `get_model(app_name, model_name)`;
+    `dorsale.urls.makepatterns` registers all models it makes URLs for.
+    """
+    _models[(app_name.lower(), (model_name or model.__name__).lower())] = model
+
 
 def get_model(app_name, model_name):
     """
     Find a Model or ModelForm (not a view).
 
+    Looks into the registry (see `register_model`) first,
+    then asks the app registry; no database queries.
+    Return `None` if there’s no such model.
+
     :app_name: name of the application, e.g. 'edition' for `dorsale.edition`
     :model_name: name of the model, e.g. 'Issue' for `dorsale.edition.models.Issue`
     """
-    return ContentType.objects.get(app_label=app_name.lower(), model=model_name.lower()).model_class()
+    key = (app_name.lower(), model_name.lower())
+    try:
+        return _models[key]
+    except KeyError:
+        pass
+    try:
+        model = django_apps.get_model(*key)
+    except LookupError:
+        return None
+    _models[key] = model
+    return model
+
+
+def list_cache_key(model, user, page_key, orderby):
+    """
+    Key of the rendered item table of `model` for `user`
+    (site, the user’s groups and permissions, language, page and ordering);
+    contains the model’s generation, so saves and deletions
+    invalidate it (see `dorsale.generations`).
+
+    Managers without `mine_fingerprint` vary by user.
+    """
+    manager = model.objects
+    if hasattr(manager, 'mine_fingerprint'):
+        fingerprint = manager.mine_fingerprint(user)
+    else:
+        fingerprint = 'user:%s' % user.pk
+    key = '%s:%s:%s:%s:%s:%s' % (local.get_current_site_id(), fingerprint,
+                                 permissions_fingerprint(user, model), get_language(),
+                                 page_key, orderby)
+    return 'dorsale:list:%s:%s:%s' % (model._meta.label_lower, get_generation(model),
+                                      hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def permitted_table(model, objects, user):
+    """
+    `model.tabulate(objects)` with rows of (pk, values, allowed actions),
+    see `dorsale.permissions.object_permissions`
+    """
+    table = model.tabulate(objects)
+    perms = object_permissions(user, model, [row[0] for row in table.rows])
+    return table._replace(rows=[(pk, values, perms[pk]) for pk, values in table.rows])
 
 
 def render_404(request, params):
@@ -36,14 +105,10 @@ def render_404(request, params):
 @login_required
 def home(request, **kwargs):
     """Render an index view with the root.html template."""
-    try:
-        from django.contrib.sites.models import Site
-        site = Site.objects.get_current()
-    except ImportError:
-        logger.warn(_('Module django.contrib.sites is not installed'))
+    site = local.get_current_site()
     try:
         from siteprofile.models import SiteProfile
-        profile = SiteProfile.objects.get(pk=site)
+        profile = SiteProfile.objects.get_cached(site)
         if profile and profile.homeurl and profile.homeurl != '/':
             return redirect(profile.homeurl)
     except ImportError:
@@ -52,22 +117,36 @@ def home(request, **kwargs):
 
 
 @login_required
-def list_items(request, app_name='', model_name='', template='dorsale/list_items.html'):
+def list_items(request, app_name='', model_name='', template='dorsale/list_items.html', keyset=None, count=None):
     """
     List all (allowed) items of `app_name.model_name` (e.g. edition.issue), with pagination.
     Render 404 if model doesn't exist. Allow customization by `template`.
 
+    :keyset: bool, use keyset pagination (`?after=`/`?before=` cursors instead of `?page=`),
+        e.g. for large tables (default: model’s `keyset_pagination` attribute)
+    :count: count strategy for page numbers: 'exact', 'cached', 'estimate', 'none'
+        or a paginator class (name), see `dorsale.pagination`
+        (default: model’s `count_strategy` attribute)
+
     Available variables in the template:
     :object_example: empty object of the requested type (e.g. for table titles)
     :paginator: Paginator object
     :page: current page number of paginator
     :page_obj: page of Paginator, iterate over this to get items
+    :keyset: True if keyset pagination is used
+    :table: `Table` of the page (columns and rows of (pk, values, allowed actions)),
+        see `FieldInfoMixin.tabulate` and `dorsale.permissions`; evaluated only if not cached
+    :display_url_name: URL name of `show_item` for this model, see `dorsale.urls.makepatterns`
+        (`None` if there is none)
+    :cache_key: key of the rendered item table, `None` if not cached
+    :cache_timeout: seconds to cache the rendered item table
+        (`settings.DORSALE_LIST_CACHE_TIMEOUT`, 0 to switch off)
     """
     object_model = get_model(app_name, model_name)
     if object_model:
         object_example = object_model()
 
-        qs = object_model.objects.mine(request.user.id)
+        qs = object_model.objects.mine(request.user)
         default_orderby = 'id'
         try:
             # if the model has a default ordering defined, use it
@@ -76,29 +155,60 @@ def list_items(request, app_name='', model_name='', template='dorsale/list_items
             pass
         # set order (works also with several fields like "country,city", even if that's not supported by the UI)
         orderby = request.GET.get('orderby', default_orderby)
+        l_orderby = split_ordering(orderby)
         try:
-            l_orderby = orderby.split(',')
-        except AttributeError:
-            # is already a list
-            l_orderby = orderby
-        try:
-            qs = qs.order_by(*l_orderby)
-        except FieldError as e:
+            check_ordering(object_model, l_orderby)
+        except FieldError:
             orderby = default_orderby
-        del default_orderby  # don’t bloat locals()
+            l_orderby = split_ordering(orderby)
+        qs = qs.order_by(*l_orderby)
 
-        paginator = Paginator(qs, int(getattr(object_model, 'items_per_page', getattr(settings, 'DORSALE_ITEMS_PER_PAGE', 10))), orphans=2)
-        # check if a valid number was requested as page, otherwise 1
-        try:
-            page = int(request.GET.get('page', '1'))
-        except ValueError:
-            page = 1
+        per_page = int(getattr(object_model, 'items_per_page', getattr(settings, 'DORSALE_ITEMS_PER_PAGE', 10)))
+        if keyset is None:
+            keyset = getattr(object_model, 'keyset_pagination', False)
+        if keyset:
+            try:
+                paginator = KeysetPaginator(qs, l_orderby, per_page)
+            except FieldError:
+                # e.g. a many-to-many field
+                orderby = default_orderby
+                l_orderby = split_ordering(orderby)
+                paginator = KeysetPaginator(qs, l_orderby, per_page)
+            page_obj = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+        else:
+            if count is None:
+                count = getattr(object_model, 'count_strategy', None) \
+                    or getattr(settings, 'DORSALE_COUNT_STRATEGY', 'exact')
+            paginator = get_paginator_class(count)(qs, per_page, orphans=2)
+            # check if a valid number was requested as page, otherwise 1
+            try:
+                page = int(request.GET.get('page', '1'))
+            except ValueError:
+                page = 1
 
-        # check if the page exists, otherwise last
+            # check if the page exists, otherwise last
+            try:
+                page_obj = paginator.page(page)
+            except (EmptyPage, InvalidPage):
+                page_obj = paginator.page(paginator.num_pages or 1)
+        del per_page, count, default_orderby  # don’t bloat locals()
+
+        cache_timeout = int(getattr(settings, 'DORSALE_LIST_CACHE_TIMEOUT', 300))
+        cache_key = None
+        if cache_timeout:
+            if keyset:
+                page_key = 'after:%s:before:%s' % (request.GET.get('after', ''), request.GET.get('before', ''))
+            else:
+                page_key = page_obj.number
+            cache_key = list_cache_key(object_model, request.user, page_key, orderby)
+            del page_key
+
+        table = SimpleLazyObject(partial(permitted_table, object_model, page_obj.object_list, request.user))
+        display_url_name = '%s-%s-display' % (app_name, model_name)
         try:
-            page_obj = paginator.page(page)
-        except (EmptyPage, InvalidPage):
-            page_obj = paginator.page(paginator.num_pages)
+            reverse(display_url_name, kwargs={'object_id': 0})
+        except NoReverseMatch:
+            display_url_name = None
 
         del object_model
         return render(request, template, locals())
@@ -107,7 +217,7 @@ def list_items(request, app_name='', model_name='', template='dorsale/list_items
 
 
 @login_required
-def show_item(request, app_name='', model_name='', object_id=None, template='dorsale/show_item.html', _c=0):
+def show_item(request, app_name='', model_name='', object_id=None, template='dorsale/show_item.html'):
     """
     Display one object: `app_name.model_name(id=object_id)`.
     Render 404 if object is not available. Allow customization by `template`.
@@ -117,12 +227,13 @@ def show_item(request, app_name='', model_name='', object_id=None, template='dor
     :item_type: ContentType of the requested object
     :form: ModelForm for this object
     :notes: Notes on this object
+    :item_perms: allowed actions ('view', 'change', 'delete'), see `dorsale.permissions`
     """
     if not object_id:
         return render_404(request, locals())
     object_model = get_model(app_name, model_name)
     try:
-        item = object_model.objects.mine(request.user.id).get(pk=object_id)
+        item = object_model.objects.mine(request.user).get(pk=object_id)
         item_type = ContentType.objects.get_for_model(item)
         if hasattr(item, 'notes'):
             notes = item.notes.all()
@@ -130,9 +241,10 @@ def show_item(request, app_name='', model_name='', object_id=None, template='dor
         #    notes = Note.objects.filter(content_type__pk=item_type.id, object_id=object_id)
     except:
         return render_404(request, locals())
+    item_perms = object_permissions(request.user, object_model, [item])[item.pk]
+    if 'view' not in item_perms:
+        return render_404(request, locals())
     form = ModelFormFactory(object_model, user=request.user, instance=item, disabled=True)
-    if not form.visible_fields() and _c < 3:  # sometimes it works only in the second try, why?
-        return show_item(request, app_name, model_name, object_id, template, _c + 1)
     return render(request, template, locals())
 
 
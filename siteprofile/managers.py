@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
+import six
 from django.db import models
 from django.contrib.messages import constants
 from django.contrib.sites.managers import CurrentSiteManager
-from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db.models.query import QuerySet
 from django.utils.translation import ugettext_lazy as _
+from dorsale import local
+from dorsale.conf import settings
 import logging
 logger = logging.getLogger(__name__)
 try:
@@ -17,55 +20,169 @@ except ImportError:
     logger.warn('django-async-messages is not installed (suggested for DorsaleGroupSiteManager)')
 
 
-class DorsaleSiteManager(CurrentSiteManager):
+class DorsaleQuerySet(QuerySet):
+    """
+    QuerySet for dorsale models
+    """
+    def soft_delete(self, batch_size=None, bulk_signals=True, user=None):
+        """
+        Mark all objects of this queryset and their cascade as deleted,
+        without calling `delete()` per instance
+        (see `dorsale.deletion.SoftDeleteCollector`).
+
+        Return a tuple (number of affected rows, {model label: number}).
+        """
+        from dorsale.deletion import soft_delete  # avoid circular import
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with soft_delete."
+        return soft_delete(self, using=self.db, batch_size=batch_size,
+                           bulk_signals=bulk_signals, user=user)
+    soft_delete.queryset_only = True
+
+
+class DorsaleSiteManager(CurrentSiteManager.from_queryset(DorsaleQuerySet)):
     """
     Model manager, based on `contrib.sites.managers.CurrentSiteManager`
 
     Limit objects to
-    - belonging to current site (via model.site.id==settings.SITE_ID)
+    - belonging to current site (via model.site.id==`dorsale.local.get_current_site_id()`,
+      i.e. the request’s site or settings.SITE_ID)
     - not deleted (model.deleted==False)
 
-    with `mine(userid)`:
+    with `mine(user)`:
     - user <> -1 (i.e. a user is logged in, like `is_authenticated`)
     - user exists and is active
 
+    Querysets are `DorsaleQuerySet`s, i.e. you can call
+    `Model.objects.filter(...).soft_delete()`.
+
+    For imports, use `bulk_create_for(user, site, objs)`
+    and `bulk_update_for(user, objs, fields)`.
+
     `site_field_name` is the name of the model’s field
     that's a foreign key to `django.contrib.sites.models.Site`
     """
     def __init__(self, site_field_name='site'):
         super(DorsaleSiteManager, self).__init__(site_field_name)
+        self.site_field_name = site_field_name
+
+    def get_site_queryset(self):
+        """Return all objects that belong to the current request’s site"""
+        # skip CurrentSiteManager, it uses the global settings.SITE_ID
+        return super(CurrentSiteManager, self).get_queryset().filter(
+            **{self.site_field_name + '_id': local.get_current_site_id()})
 
     def get_queryset(self):
         """Return all objects that belong to the current site and are not deleted"""
-        return super(DorsaleSiteManager, self).get_queryset().filter(deleted=False)
+        return self.get_site_queryset().filter(deleted=False)
 
     def get_deleted_query_set(self):
         """Return all objects that belong to the current site and *are* deleted"""
-        return super(DorsaleSiteManager, self).get_queryset().filter(deleted=True)
+        return self.get_site_queryset().filter(deleted=True)
 
-    def mine(self, userid):
+    def mine(self, user):
         """
         Filter by authenticated (existing, active) user,
         return an empty queryset if not authenticated.
 
+        `user` may be a user object (e.g. `request.user`) or a user ID;
+        IDs of the current request’s user (see `dorsale.local`)
+        don’t cause a query.
         Requires user ID < 0 for unauthenticated users
         (e.g. from `django-registration`).
 
         We can’t expect a request object and take the user from there,
         since `mine` might also get called in creation of forms.
 
-        If you inherit this method, you can access `self.user`
-        (`contrib.auth.models.User` or `None`).
+        To filter further, override `mine_queryset(user)`
+        (`self.user` is gone: managers are shared by all threads).
+        """
+        user = self.mine_user(user)
+        if user is None:
+            return self.none()
+        return self.mine_queryset(user)
+
+    def mine_user(self, user):
+        """
+        Return the user object of `user` (object or ID)
+        if they may get objects from `mine`, else `None`.
+        """
+        resolved = local.get_user(user)
+        if resolved is None and user is not None and not hasattr(user, 'pk'):
+            # an ID that doesn’t resolve; AnonymousUser is no error
+            logger.error(_('User %s doesn’t exist!') % user)
+        if not resolved or resolved.pk < 0 or not resolved.is_active:
+            return None
+        return resolved
+
+    def mine_queryset(self, user):
+        """
+        Return the objects of authenticated, active `user` (a user object).
         """
-        try:
-            self.user = User.objects.get(pk=userid)
-        except:
-            logger.error(_('User #%d doesn’t exist!') % userid)
-            self.user = None
-        if userid < 0 or not self.user or not self.user.is_active:
-            return QuerySet(self.model).none()
         return self.get_queryset()
 
+    @property
+    def user(self):
+        """
+        removed: managers are shared by all threads,
+        so it would belong to any request
+        """
+        raise AttributeError('%s.user was removed, it is not thread safe; '
+                             'override mine_queryset(user) instead.' % self.__class__.__name__)
+
+    def bulk_create_for(self, user, site, objs, batch_size=None):
+        """
+        Create `objs` (iterable of unsaved instances) as `user` on `site`
+        (`None` for the current site) with `bulk_create` in batches;
+        audit, site and deleted fields get filled once per batch
+        (see `dorsale.bulk`). No `save()`, no signals.
+
+        Return the list of created objects.
+        """
+        from dorsale.bulk import bulk_create_for  # avoid circular import
+        return bulk_create_for(self.model, user, site, objs, batch_size=batch_size,
+                               using=self.db, site_field_name=self.site_field_name)
+
+    def bulk_update_for(self, user, objs, fields, site=None, batch_size=None):
+        """
+        Save `fields` (list of field names) of `objs` as changed by `user`,
+        with one UPDATE per batch; only not deleted rows of `site`
+        (`None` for the current site) get changed (see `dorsale.bulk`).
+        No `save()`, no signals.
+
+        Return the number of changed rows.
+        """
+        from dorsale.bulk import bulk_update_for  # avoid circular import
+        queryset = self.get_queryset()
+        if site is not None:
+            queryset = super(CurrentSiteManager, self).get_queryset().filter(
+                deleted=False, **{self.site_field_name + '_id': getattr(site, 'pk', site)})
+        return bulk_update_for(queryset, user, objs, fields, batch_size=batch_size)
+
+    def mine_fingerprint(self, user):
+        """
+        Return a string that’s the same for all users
+        that get the same objects from `mine(user)`,
+        e.g. for cache keys (see `dorsale.views.list_cache_key`).
+
+        Managers that override `mine` or `mine_queryset` get one per user,
+        unless they override this as well.
+        """
+        user = self.mine_user(user)
+        if user is None:  # anonymous or inactive: `mine` is empty
+            return 'none'
+        if self._stock_mine(DorsaleSiteManager):
+            return 'active'
+        return 'user:%s' % user.pk
+
+    def _stock_mine(self, cls):
+        """
+        True if `mine` and `mine_queryset` are those of manager class `cls`
+        """
+        return all(six.get_unbound_function(getattr(type(self), name)) is
+                   six.get_unbound_function(getattr(cls, name))
+                   for name in ('mine', 'mine_queryset'))
+
 
 class DorsaleGroupSiteManager(DorsaleSiteManager):
     """
@@ -75,7 +192,7 @@ class DorsaleGroupSiteManager(DorsaleSiteManager):
     - belonging to current site (via model.site.id==settings.SITE_ID)
     - not deleted (model.deleted==False)
 
-    with `mine(userid)`:
+    with `mine(user)`:
     - user <> -1 (i.e. a user is logged in, like is_authenticated)
     - owned by a grop the user is a member of
 
@@ -85,34 +202,47 @@ class DorsaleGroupSiteManager(DorsaleSiteManager):
     `group_field_name` is the name of the model's field
     that's a foreign key to `django.contrib.auth.models.Group`;
     may be a foreign key lookup like 'product__group'
+    (for an index on it, see `DorsaleBaseModel.dorsale_group_index`)
     """
     def __init__(self, site_field_name='site', group_field_name='group'):
         super(DorsaleGroupSiteManager, self).__init__(site_field_name)
-        self.__group_field_name = group_field_name
-        self.__group_is_checked = False
-
-    def mine(self, userid):
-        """
-        This filters by the user's group
-        """
-        qs = super(DorsaleGroupSiteManager, self).mine(userid)  # : queryset
-        if not self.user:
-            return qs
-        # user = User.objects.get(pk=userid)
-        # check the group field
-        if self.user.is_active \
-                and not self.user.is_superuser \
-                and qs.count() > 0 \
-                and self.__group_field_name:
-            if not self.__group_is_checked:
-                # We don't check if group_field exists to allow chains like 'product__group'
-                group_count = self.user.groups.count()
-                if group_count == 0:
-                    logger.error(_("User %s doesn’t belong to any group!") % self.user.username)
-                    if ASYNC_MESSAGES:
-                        message_user(self.user, _("You do not yet belong to any groups. Ask your administrator to add you to one."), constants.ERROR)
-                self.__group_is_checked = True
+        self.group_field_name = group_field_name
+
+    def mine_queryset(self, user):
+        """
+        This filters by the user's group IDs
+        (cached, see `dorsale.local.get_group_ids`), without extra queries
+        """
+        qs = super(DorsaleGroupSiteManager, self).mine_queryset(user)
+        if not user.is_superuser and self.group_field_name:
+            group_ids = local.get_group_ids(user)
+            if not group_ids:
+                self.warn_no_groups(user)
             # filter on the user's groups
-            qs = qs.filter(**{self.__group_field_name + '__in':self.user.groups.all()})
+            qs = qs.filter(**{self.group_field_name + '__in': sorted(group_ids)})
         return qs
 
+    def warn_no_groups(self, user):
+        """
+        Tell `user` (once per group cache period) that they don’t belong to any group.
+        """
+        # We don't check if group_field exists to allow chains like 'product__group'
+        if not cache.add(local.NO_GROUPS_WARNED_KEY % user.pk, True,
+                         int(getattr(settings, 'DORSALE_GROUP_CACHE_TIMEOUT', 3600))):
+            return
+        logger.error(_("User %s doesn’t belong to any group!") % user.username)
+        if ASYNC_MESSAGES:
+            message_user(user, _("You do not yet belong to any groups. Ask your administrator to add you to one."), constants.ERROR)
+
+    def mine_fingerprint(self, user):
+        """
+        superusers or the user’s group IDs; per user if `mine` or `mine_queryset` are overridden
+        """
+        user = self.mine_user(user)
+        if user is None:  # anonymous or inactive: `mine` is empty
+            return 'none'
+        if not self._stock_mine(DorsaleGroupSiteManager):
+            return 'user:%s' % user.pk
+        if user.is_superuser or not self.group_field_name:
+            return 'all'
+        return 'groups:' + ','.join('%s' % pk for pk in sorted(local.get_group_ids(user)))
@@ -4,10 +4,14 @@ from __future__ import unicode_literals
 from django.utils.translation import ugettext as _
 from django.utils.encoding import python_2_unicode_compatible
 from django.db import models
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import Group
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
+from dorsale import local
+from dorsale import indexes  # connects class_prepared receiver
 from dorsale.models import AuthorMixin, FakeDeleteMixin, FieldInfoMixin
 from siteprofile.managers import DorsaleSiteManager
 
@@ -60,6 +64,35 @@ class Module(models.Model):
         return dict(AVAILABILITY)[self.available]
 
 
+SITEPROFILE_CACHE_KEY = 'siteprofile:%s'
+SITEPROFILE_CACHE_TIMEOUT = getattr(settings, 'SITEPROFILE_CACHE_TIMEOUT', 3600)
+
+
+class SiteProfileManager(models.Manager):
+
+    def get_cached(self, site):
+        """
+        Return the `SiteProfile` of `site` (Site or site ID)
+        including its `modlist`, from the cache if possible.
+
+        Raises `SiteProfile.DoesNotExist` like `get`.
+        """
+        site_id = getattr(site, 'pk', site)
+        key = SITEPROFILE_CACHE_KEY % site_id
+        profile = cache.get(key)
+        if profile is None:
+            profile = self.get(pk=site_id)
+            profile.modlist()  # fill before caching
+            cache.set(key, profile, SITEPROFILE_CACHE_TIMEOUT)
+        return profile
+
+    def evict(self, *site_ids):
+        """
+        Remove the profiles of `site_ids` from the cache.
+        """
+        cache.delete_many([SITEPROFILE_CACHE_KEY % site_id for site_id in site_ids])
+
+
 @python_2_unicode_compatible
 class SiteProfile(models.Model):
     site = models.OneToOneField(
@@ -94,6 +127,8 @@ class SiteProfile(models.Model):
         verbose_name=_('Modules'),
         help_text=_('The site has access to these modules.'))
 
+    objects = SiteProfileManager()
+
     class Meta(object):
         verbose_name = _('Site Profile')
         verbose_name_plural = _('Site Profiles')
@@ -124,12 +159,43 @@ class SiteProfile(models.Model):
 
     def modlist(self):
         """
-        list of module codes, to use in templates like
+        frozenset of module codes, to use in templates like
 
         {% if "mymod" in site_profile.modlist %}
 
+        Queried only once per instance, cached with the profile
+        (see `SiteProfileManager.get_cached`).
         """
-        return [m.code for m in self.modules.all()]
+        try:
+            return self._modlist
+        except AttributeError:
+            self._modlist = frozenset(self.modules.values_list('code', flat=True))
+            return self._modlist
+
+
+def evict_siteprofile(sender, instance, **kwargs):
+    SiteProfile.objects.evict(instance.pk)
+
+
+def evict_siteprofile_modules(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:  # siteprofile.modules changed
+        SiteProfile.objects.evict(instance.pk)
+    elif pk_set:  # module.siteprofile_set changed
+        SiteProfile.objects.evict(*pk_set)
+    else:  # module.siteprofile_set.clear(), before the rows are gone
+        SiteProfile.objects.evict(*instance.siteprofile_set.values_list('pk', flat=True))
+
+
+def evict_module(sender, instance, **kwargs):
+    SiteProfile.objects.evict(*instance.siteprofile_set.values_list('pk', flat=True))
+
+post_save.connect(evict_siteprofile, sender=SiteProfile, dispatch_uid='siteprofile.evict_siteprofile')
+post_delete.connect(evict_siteprofile, sender=SiteProfile, dispatch_uid='siteprofile.evict_siteprofile_delete')
+m2m_changed.connect(evict_siteprofile_modules, sender=SiteProfile.modules.through, dispatch_uid='siteprofile.evict_siteprofile_modules')
+post_save.connect(evict_module, sender=Module, dispatch_uid='siteprofile.evict_module')
+pre_delete.connect(evict_module, sender=Module, dispatch_uid='siteprofile.evict_module_delete')
 
 
 class SiteMixin(models.Model):
@@ -159,7 +225,8 @@ class SiteMixin(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Set object’s `site` to kwargs['site'] or current site.
+        Set object’s `site` to kwargs['site'] or current site
+        (of the request, see `dorsale.local`).
 
         calls `super`
         """
@@ -167,7 +234,7 @@ class SiteMixin(models.Model):
             self.site = kwargs['site']
             del kwargs['site']
         else:
-            self.site = Site.objects.get_current()
+            self.site = local.get_current_site()
         super(SiteMixin, self).save(*args, **kwargs)
 
 
@@ -194,7 +261,7 @@ class AuthorSiteMixin(AuthorMixin, SiteMixin):
             self.site = kwargs['site']
             del kwargs['site']
         else:
-            self.site = Site.objects.get_current()
+            self.site = local.get_current_site()
         super(AuthorSiteMixin, self).save(*args, **kwargs)
 
 
@@ -220,6 +287,9 @@ class DorsaleBaseModel(FakeDeleteMixin, AuthorSiteMixin, FieldInfoMixin):
        :site:
             Site this object belongs to
 
+       saving an existing object writes only changed fields
+       (see `dorsale.models.DirtyFieldsMixin`)
+
     2) additional meta info methods/properties for generic view:
 
        :field_info: dict
@@ -243,18 +313,35 @@ class DorsaleBaseModel(FakeDeleteMixin, AuthorSiteMixin, FieldInfoMixin):
        :items_per_page: int (r/w)
             number of items on one list view page
             (default: 10 or `settings.ITEMS_PER_PAGE`)
+       :count_strategy: str
+            how list views count items: 'exact', 'cached', 'estimate' or 'none'
+            (default: `settings.DORSALE_COUNT_STRATEGY`, see `dorsale.pagination`)
+       :keyset_pagination: bool
+            list views use keyset pagination (cursors instead of page numbers),
+            for large tables (default: False)
        :list_display: list
             list of field names that should be used for generic list views
             (default: empty and thus ignored)
             used by fields(), fieldnames(), fieldnames_verbose() and fieldvalues()
 
-    3) changed/additional manager methods:
+    3) default indexes (see `dorsale.indexes`):
+
+       :dorsale_indexes: bool
+            add composite indexes on (site, deleted, id/get_latest_by)
+            to `Meta.indexes` of concrete subclasses (default: True)
+       :dorsale_group_index: str
+            name of the group foreign key (see `DorsaleGroupSiteManager`)
+            to index as (site, deleted, group, id) (default: None)
+
+    4) changed/additional manager methods:
 
        :objects: `DorsaleSiteManager`
             returning only not-deleted objects of the current site
        :really_all_objects: `models.Manager`
             former default manager, returning all objects
     """
+    dorsale_indexes = True
+    dorsale_group_index = None
     really_all_objects = models.Manager()
     # `objects = models.Manager()`
     # must come before any other manager, if admin should see *all* objects